@@ -4,7 +4,6 @@
 #include <HTTPClient.h>   // HTTP POST requests
 #include "esp_camera.h"   // Camera functions
 #include <ArduinoJson.h>  // JSON parsing and generation
-#include "Base64.h"       // Base64 encoding for image
 
 // --- Wi-Fi Credentials ---
 const char* WIFI_SSID = "Inno";
@@ -176,36 +175,23 @@ void sendToServer(camera_fb_t* fb) {
   g_lightSensorValue = analogRead(LIGHT_SENSOR_PIN);
   Serial.printf("[INFO] Light sensor reading: %d\n", g_lightSensorValue);
 
-  // Base64 encode image (without the "data:image/jpeg;base64," prefix if your server expects just raw base64)
-  String imageBase64 = base64::encode(fb->buf, fb->len);
-  // If your server requires "image_base64" key, use that key name exactly.
-  // Here, we're using "image" as the key — adjust on the server side accordingly.
-  imageBase64 = "data:image/jpeg;base64," + imageBase64;
-
-  // Construct JSON payload string manually
-  String jsonPayload = "{";
-  jsonPayload += "\"timestamp\":\"" + g_receivedTimestamp + "\",";
-  jsonPayload += "\"rfid\":\"" + g_receivedRfid + "\",";
-  jsonPayload += "\"sex\":\"" + g_receivedSex + "\",";
-  jsonPayload += "\"weight\":" + String(g_receivedWeight, 2) + ",";
-  jsonPayload += "\"temperature\":" + String(g_receivedTemperature, 1) + ",";
-  jsonPayload += "\"humidity\":" + String(g_receivedHumidity, 1) + ",";
-  jsonPayload += "\"light\":" + String(g_lightSensorValue) + ",";
-  jsonPayload += "\"pressure\":" + String(g_dummyPressure, 2) + ",";
-  jsonPayload += "\"image_base64\":\"" + imageBase64 + "\"";  // Use key image_base64 to match your Flask error
-  jsonPayload += "}";
-
-  Serial.println("[INFO] JSON payload:");
-  Serial.println(jsonPayload);
-
   WiFiClient client;
   HTTPClient http;
 
   http.begin(client, FLASK_SERVER_URL);
-  http.addHeader("Content-Type", "application/json");
-
-  Serial.println("[INFO] Sending HTTP POST...");
-  int httpCode = http.POST(jsonPayload);
+  // Send the JPEG as the request body with the readings in headers: no
+  // base64 encoding on the camera and a third less data over Wi-Fi
+  http.addHeader("Content-Type", "image/jpeg");
+  http.addHeader("X-RFID", g_receivedRfid);
+  http.addHeader("X-Sex", g_receivedSex);
+  http.addHeader("X-Weight", String(g_receivedWeight, 2));
+  http.addHeader("X-Temperature", String(g_receivedTemperature, 1));
+  http.addHeader("X-Humidity", String(g_receivedHumidity, 1));
+  http.addHeader("X-Light", String(g_lightSensorValue));
+  http.addHeader("X-Pressure", String(g_dummyPressure, 2));
+
+  Serial.printf("[INFO] Sending HTTP POST (%u byte JPEG)...\n", fb->len);
+  int httpCode = http.POST(fb->buf, fb->len);
 
   if (httpCode > 0) {
     String response = http.getString();
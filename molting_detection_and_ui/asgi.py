@@ -0,0 +1,205 @@
+# asgi.py
+
+import asyncio
+import json
+import os
+
+import hi
+from hi import app as flask_app, esp_events, live_frame
+from live_frame import MJPEG_IDLE_SECONDS, MJPEG_MAX_SECONDS, mjpeg_part
+
+SSE_PING_SECONDS = int(os.environ.get('SSE_PING_SECONDS', 30))  # Keep-alive comment interval
+
+
+async def send_json(send, payload, status=200):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode('ascii'))]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def esp32_sse(scope, receive, send):
+    """SSE stream held as a coroutine instead of a blocked worker thread."""
+    headers = dict(scope['headers'])
+    last_event_id = headers.get(b'last-event-id', b'').decode('latin-1') or None
+    if not last_event_id:
+        for pair in scope.get('query_string', b'').decode('latin-1').split('&'):
+            if pair.startswith('last_event_id='):
+                last_event_id = pair.split('=', 1)[1]
+
+    subscription = esp_events.subscribe_async(last_event_id)
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    disconnected = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'),
+                        (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')]
+        })
+        while not disconnected.done():
+            next_frame = asyncio.ensure_future(subscription.get(timeout=SSE_PING_SECONDS))
+            await asyncio.wait({next_frame, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                next_frame.cancel()
+                break
+            frame = next_frame.result()
+            await send({'type': 'http.response.body',
+                        'body': (frame if frame is not None else ": ping\n\n").encode('utf-8'),
+                        'more_body': True})
+    finally:
+        esp_events.unsubscribe(subscription)
+        disconnected.cancel()
+
+
+async def esp32_live_data(scope, receive, send):
+    data = hi.latest_esp_data
+    if not data:
+        return await send_json(send, {"success": False, "message": "No data available yet"}, 404)
+
+    response_data = {
+        "success": True,
+        "data": data,
+        "has_image": live_frame.etag is not None
+    }
+    if 'image_path' in data:
+        response_data['image_path'] = data['image_path']
+    await send_json(send, response_data)
+
+
+async def esp32_live_image(scope, receive, send):
+    image_b64 = live_frame.base64()
+    if not image_b64:
+        return await send_json(send, {"success": False, "message": "No image available yet"}, 404)
+    await send_json(send, {"success": True, "image": image_b64})
+
+
+async def esp32_live_jpeg(scope, receive, send):
+    data, etag, content_type, _ = live_frame.snapshot()
+    if data is None:
+        return await send_json(send, {"success": False, "message": "No image available yet"}, 404)
+
+    quoted = f'"{etag}"'.encode('ascii')
+    headers = [(b'etag', quoted), (b'cache-control', b'no-cache')]
+    if_none_match = dict(scope['headers']).get(b'if-none-match', b'')
+    if quoted in (tag.strip().replace(b'W/', b'') for tag in if_none_match.split(b',')):
+        await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+        return await send({'type': 'http.response.body', 'body': b''})
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': headers + [(b'content-type', content_type.encode('ascii')),
+                              (b'content-length', str(len(data)).encode('ascii'))]
+    })
+    await send({'type': 'http.response.body', 'body': data})
+
+
+async def esp32_live_mjpeg(scope, receive, send):
+    """MJPEG stream; woken by the SSE hub, which is published to with every new frame.
+
+    Like the WSGI route, an idle camera still gets the current frame (or a
+    blank preamble line before the first one) every MJPEG_IDLE_SECONDS so
+    proxies keep the connection, and the stream ends after MJPEG_MAX_SECONDS.
+    """
+    loop = asyncio.get_running_loop()
+    subscription = esp_events.subscribe_async()
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    disconnected = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'multipart/x-mixed-replace; boundary=frame'),
+                        (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')]
+        })
+        deadline = loop.time() + MJPEG_MAX_SECONDS
+        version, sent_at = 0, None
+        while not disconnected.done() and loop.time() < deadline:
+            data, _, content_type, new_version = live_frame.snapshot()
+            if new_version > version or sent_at is None or loop.time() - sent_at >= MJPEG_IDLE_SECONDS:
+                version, sent_at = new_version, loop.time()
+                await send({'type': 'http.response.body',
+                            'body': mjpeg_part(data, content_type) if data is not None else b'\r\n',
+                            'more_body': True})
+            wait = max(0.0, min(sent_at + MJPEG_IDLE_SECONDS, deadline) - loop.time())
+            next_event = asyncio.ensure_future(subscription.get(timeout=wait))
+            await asyncio.wait({next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            next_event.cancel()
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        esp_events.unsubscribe(subscription)
+        disconnected.cancel()
+
+
+# GET endpoints served on the event loop; everything else goes to Flask on threads
+ASYNC_ROUTES = {
+    '/api/esp32-sse': esp32_sse,
+    '/api/esp32-live-data': esp32_live_data,
+    '/api/esp32-live-image': esp32_live_image,
+    '/api/esp32-live.jpg': esp32_live_jpeg,
+    '/api/esp32-live.mjpg': esp32_live_mjpeg,
+}
+
+
+def _wsgi_fallback():
+    try:
+        from asgiref.wsgi import WsgiToAsgi
+    except ImportError:
+        raise ImportError("ASGI mode needs asgiref for the Flask routes: pip install asgiref uvicorn")
+    return WsgiToAsgi(flask_app)
+
+
+wsgi_app = _wsgi_fallback()
+
+
+async def app(scope, receive, send):
+    """ASGI entry point: ``uvicorn asgi:app``.
+
+    Live-data and SSE requests are answered on the event loop, so idle
+    dashboards cost a coroutine each rather than a thread. Detection
+    ingest, inference and the pages run through the unchanged Flask app
+    on asgiref's thread pool.
+    """
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                hi.start_background_workers()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    handler = ASYNC_ROUTES.get(scope.get('path')) if scope['type'] == 'http' else None
+    if handler is not None and scope['method'] == 'GET':
+        return await handler(scope, receive, send)
+    return await wsgi_app(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the dashboard with async SSE and live-data endpoints")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
@@ -0,0 +1,116 @@
+# batching.py
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Collects single inference requests into small batches.
+
+    Callers block in ``submit`` while a dispatcher thread gathers up to
+    ``max_batch_size`` items, or whatever arrived within ``max_wait_ms`` of
+    the first one, and hands them to ``batch_fn`` in a single call.
+    ``batch_fn`` must return one result per item, in order.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=20):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._dispatch, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queue one item and wait for its result."""
+        future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = list(self.batch_fn(items))
+                if len(results) != len(batch):
+                    raise RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, future in batch:
+                    self._settle(future, exception=e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                self._settle(future, result=result)
+
+    @staticmethod
+    def _settle(future, result=None, exception=None):
+        # A future that cannot take its outcome must not stop the dispatcher for everyone else
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except Exception as e:
+            print(f"Could not deliver a batched result: {str(e)}")
+
+
+def benchmark_vgg16(batch_sizes=(1, 4, 8, 16), iterations=5, threads=None):
+    """Measure VGG16 (2-class head) forward throughput on CPU per batch size."""
+    import torch
+    import torch.nn as nn
+    from torchvision import models
+
+    if threads:
+        torch.set_num_threads(threads)
+
+    model = models.vgg16(weights=None)
+    model.classifier[6] = nn.Linear(model.classifier[6].in_features, 2)
+    model.eval()
+
+    results = {}
+    with torch.inference_mode():
+        # Warm-up pass so allocator and thread pool start-up are not measured
+        model(torch.randn(1, 3, 224, 224))
+
+        for batch_size in batch_sizes:
+            batch = torch.randn(batch_size, 3, 224, 224)
+            start = time.perf_counter()
+            for _ in range(iterations):
+                torch.softmax(model(batch), dim=1)
+            elapsed = time.perf_counter() - start
+            results[batch_size] = batch_size * iterations / elapsed
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark batched VGG16 molt classification on CPU")
+    parser.add_argument('--batch-sizes', default='1,4,8,16', help='Comma separated batch sizes')
+    parser.add_argument('--iterations', type=int, default=5, help='Forward passes per batch size')
+    parser.add_argument('--threads', type=int, default=None, help='torch CPU threads (default: torch default)')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.batch_sizes.split(',')]
+    throughput = benchmark_vgg16(sizes, args.iterations, args.threads)
+
+    print(f"{'batch':>6} {'images/s':>10} {'speed-up':>9}")
+    for batch_size in sizes:
+        print(f"{batch_size:>6} {throughput[batch_size]:>10.2f} {throughput[batch_size] / throughput[sizes[0]]:>8.2f}x")
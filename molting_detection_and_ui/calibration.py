@@ -0,0 +1,286 @@
+# calibration.py
+
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from db import get_connection
+from loadcell_filters import HX711_SATURATED, LOADCELL_GRAMS_PER_COUNT, LOADCELL_OFFSET_GRAMS
+
+DEFAULT_PLATFORM = os.environ.get('DEFAULT_PLATFORM', 'default')  # Platform of uploads that do not name one
+CALIBRATION_SIGMAS = 4.0       # Residuals beyond this many robust sigmas are dropped and the fit redone
+CALIBRATION_ITERATIONS = 5
+CALIBRATION_CACHE_SECONDS = float(os.environ.get('CALIBRATION_CACHE_SECONDS', 60))  # Picks up CLI fits within this
+TEMPERATURE_COLUMNS = ('temperature', 'temperature_c')  # BME/AHT reading logged next to each sample
+TRAINING_CSV_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                'Electronics and Controls Subsystem', 'Weight_Estimation_Training')
+
+
+def load_csvs(paths):
+    """Concatenate ``raw_reading,true_weight_grams[,temperature]`` files.
+
+    Returns (raw, grams, temperature); temperature is None unless every
+    file has a temperature column. Rows that do not parse are skipped.
+    """
+    raws, grams, temps = [], [], []
+    for path in paths:
+        with open(path, newline='') as f_in:
+            header = [name.strip().lower() for name in next(csv.reader(f_in))]
+        try:
+            columns = [header.index('raw_reading'), header.index('true_weight_grams')]
+        except ValueError:
+            raise ValueError(f"{path}: needs raw_reading and true_weight_grams columns")
+        temp_column = next((header.index(name) for name in TEMPERATURE_COLUMNS if name in header), None)
+        if temp_column is not None:
+            columns.append(temp_column)
+        try:
+            data = np.loadtxt(path, delimiter=',', skiprows=1, usecols=columns, ndmin=2)
+        except ValueError:
+            # Stray text rows, as the notebook had to drop; slower but tolerant
+            data = np.genfromtxt(path, delimiter=',', skip_header=1, usecols=columns, ndmin=2)
+            data = data[np.isfinite(data).all(axis=1)]
+        raws.append(data[:, 0])
+        grams.append(data[:, 1])
+        temps.append(data[:, 2] if temp_column is not None else None)
+    temperature = np.concatenate(temps) if temps and all(t is not None for t in temps) else None
+    return np.concatenate(raws), np.concatenate(grams), temperature
+
+
+def fit(raw, grams, temperature=None, sigmas=CALIBRATION_SIGMAS, iterations=CALIBRATION_ITERATIONS):
+    """Least-squares calibration of grams against raw HX711 counts.
+
+    Fits ``grams = a * raw + b``, plus ``c * dT + d * raw * dT`` when
+    temperatures are given (dT from their median), so both zero and span
+    drift are compensated. Glitches and readings taken while the weight
+    was still settling are removed by refitting without residuals beyond
+    ``sigmas`` robust standard deviations. Returns a profile dict.
+    """
+    raw = np.asarray(raw, dtype=np.float64)
+    grams = np.asarray(grams, dtype=np.float64)
+    valid = np.isfinite(raw) & np.isfinite(grams) & ~np.isin(raw, HX711_SATURATED)
+    if temperature is not None:
+        temperature = np.asarray(temperature, dtype=np.float64)
+        valid &= np.isfinite(temperature)
+    if not valid.any() or grams[valid].min() == grams[valid].max():
+        raise ValueError('Calibration needs readings at two or more known weights')
+
+    # Centre and scale the counts so the normal equations stay well conditioned
+    raw_centre, raw_scale = np.median(raw[valid]), max(np.std(raw[valid]), 1.0)
+    x = (raw - raw_centre) / raw_scale
+    columns = [x, np.ones_like(x)]
+    reference_temp = None
+    if temperature is not None:
+        reference_temp = float(np.median(temperature[valid]))
+        dt = temperature - reference_temp
+        if np.ptp(dt[valid]) < 1.0:
+            raise ValueError('Temperature compensation needs readings over at least 1 degree C')
+        columns += [dt, x * dt]
+    design = np.column_stack(columns)
+
+    keep = valid.copy()
+    for _ in range(iterations):
+        kept = design[keep]
+        # Normal equations: a 4x4 solve instead of an SVD of the whole design matrix
+        coef = np.linalg.solve(kept.T @ kept, kept.T @ grams[keep])
+        residual = grams - design @ coef
+        sigma = max(1.4826 * np.median(np.abs(residual[keep])), 0.1)
+        new_keep = valid & (np.abs(residual) <= sigmas * sigma)
+        if np.array_equal(new_keep, keep):
+            break
+        keep = new_keep
+
+    # Back to raw counts: grams = a * raw + b + c * dT + d * raw * dT
+    a = coef[0] / raw_scale
+    b = coef[1] - a * raw_centre
+    profile = {
+        'grams_per_count': float(a),
+        'offset_grams': float(b),
+        'reference_temp_c': reference_temp,
+        'offset_grams_per_c': 0.0,
+        'span_per_c': 0.0,
+        'samples': int(valid.sum()),
+        'rejected': int(valid.sum() - keep.sum()),
+        'residual_rms_g': float(np.sqrt(np.mean(residual[keep] ** 2))),
+        'residual_max_g': float(np.abs(residual[keep]).max()),
+    }
+    if temperature is not None:
+        d = coef[3] / raw_scale
+        profile['offset_grams_per_c'] = float(coef[2] - d * raw_centre)
+        profile['span_per_c'] = float(d / a)
+    profile['residuals_by_weight'] = residuals_by_weight(grams[keep], residual[keep])
+    return profile
+
+
+def residuals_by_weight(grams, residual):
+    """Mean and spread of the residuals at each reference weight."""
+    weights, index, counts = np.unique(grams, return_inverse=True, return_counts=True)
+    means = np.bincount(index, residual) / counts
+    spread = np.sqrt(np.bincount(index, (residual - means[index]) ** 2) / counts)
+    return [{'true_grams': float(w), 'samples': int(n), 'mean_g': round(float(m), 2), 'std_g': round(float(s), 2)}
+            for w, n, m, s in zip(weights, counts, means, spread)]
+
+
+def coefficients_at(profile, temperature=None):
+    """(grams_per_count, offset_grams) of a profile at ``temperature`` degrees C."""
+    if not profile:
+        return LOADCELL_GRAMS_PER_COUNT, LOADCELL_OFFSET_GRAMS
+    grams_per_count, offset_grams = profile['grams_per_count'], profile['offset_grams']
+    if temperature is not None and profile.get('reference_temp_c') is not None:
+        dt = temperature - profile['reference_temp_c']
+        grams_per_count *= 1 + (profile.get('span_per_c') or 0.0) * dt
+        offset_grams += (profile.get('offset_grams_per_c') or 0.0) * dt
+    return grams_per_count, offset_grams
+
+
+def apply(profile, raw, temperature=None):
+    """Grams for raw HX711 counts under ``profile``."""
+    grams_per_count, offset_grams = coefficients_at(profile, temperature)
+    return np.asarray(raw, dtype=np.float64) * grams_per_count + offset_grams
+
+
+class CalibrationProfiles:
+    """Calibration profiles per platform in ``calibration_profiles``.
+
+    Saving a fit adds a row; the newest row of a platform is the one in
+    use, so older calibrations stay around for comparison. Lookups are
+    cached for ``cache_seconds`` because every raw upload needs one; a
+    fit saved by the CLI is picked up when the entry expires.
+    """
+
+    def __init__(self, db_path, cache_seconds=CALIBRATION_CACHE_SECONDS):
+        self.db_path = db_path
+        self.cache_seconds = cache_seconds
+        self._cache = {}  # platform_id -> (loaded at, profile or None)
+        self._lock = threading.Lock()
+
+    def get(self, platform_id=DEFAULT_PLATFORM):
+        """Newest profile of the platform, or None to use the LOADCELL_* constants."""
+        with self._lock:
+            cached = self._cache.get(platform_id)
+            if cached and time.monotonic() - cached[0] < self.cache_seconds:
+                return cached[1]
+        conn = get_connection(self.db_path)
+        conn.row_factory = sqlite3.Row
+        row = conn.execute(
+            "SELECT * FROM calibration_profiles WHERE platform_id = ? ORDER BY id DESC LIMIT 1", (platform_id,)
+        ).fetchone()
+        conn.close()
+        profile = dict(row) if row else None
+        with self._lock:
+            self._cache[platform_id] = (time.monotonic(), profile)
+        return profile
+
+    def coefficients(self, platform_id=None, temperature=None):
+        return coefficients_at(self.get(platform_id or DEFAULT_PLATFORM), temperature)
+
+    def save(self, platform_id, profile, source=None):
+        conn = get_connection(self.db_path)
+        cursor = conn.execute(
+            '''INSERT INTO calibration_profiles
+               (platform_id, fitted_at, grams_per_count, offset_grams, reference_temp_c, offset_grams_per_c,
+                span_per_c, samples, rejected, residual_rms_g, residual_max_g, source)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            (platform_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), profile['grams_per_count'],
+             profile['offset_grams'], profile['reference_temp_c'], profile['offset_grams_per_c'],
+             profile['span_per_c'], profile['samples'], profile['rejected'], profile['residual_rms_g'],
+             profile['residual_max_g'], json.dumps(source) if source else None)
+        )
+        profile_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        with self._lock:
+            self._cache.pop(platform_id, None)
+        return profile_id
+
+    def all(self):
+        """Newest profile of every platform."""
+        conn = get_connection(self.db_path)
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(
+            '''SELECT * FROM calibration_profiles
+               WHERE id IN (SELECT MAX(id) FROM calibration_profiles GROUP BY platform_id)
+               ORDER BY platform_id'''
+        ).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+
+if __name__ == "__main__":
+    import argparse
+    import glob
+
+    from db import DB_PATH, migrate
+
+    parser = argparse.ArgumentParser(description="Fit a load-cell calibration from raw_reading,true_weight_grams "
+                                                 "CSVs and optionally store it as a platform's profile")
+    parser.add_argument('csv', nargs='*', help='Calibration CSVs (default: Weight_Estimation_Training/weight_*.csv)')
+    parser.add_argument('--platform', default=DEFAULT_PLATFORM)
+    parser.add_argument('--temperature', action='store_true',
+                        help='Also fit zero and span drift against a temperature column')
+    parser.add_argument('--save', action='store_true', help='Store the fit as the platform\'s profile')
+    parser.add_argument('--list', action='store_true', help='Show the profile in use for every platform')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--benchmark', type=int, metavar='N', help='Time a fit on N simulated readings')
+    args = parser.parse_args()
+
+    if args.list:
+        conn = get_connection(args.db)
+        migrate(conn)
+        conn.close()
+        for profile in CalibrationProfiles(args.db).all():
+            print(f"{profile['platform_id']}: {profile['grams_per_count']:.8f} g/count, "
+                  f"{profile['offset_grams']:.2f} g, rms {profile['residual_rms_g']:.2f} g, "
+                  f"fitted {profile['fitted_at']}")
+        raise SystemExit
+
+    if args.benchmark:
+        rng = np.random.default_rng(0)
+        true = rng.choice([0.0, 500.0, 1000.0, 2000.0, 4000.0], args.benchmark)
+        temperature = rng.uniform(5, 30, args.benchmark)
+        raw = (true * (1 - 2e-4 * (temperature - 18)) + 1862.8 + 0.8 * (temperature - 18)) / 0.0045558
+        raw += rng.normal(0, 300, args.benchmark)
+        glitches = rng.random(args.benchmark) < 0.02
+        raw[glitches] = rng.uniform(0, 1.1e6, glitches.sum())
+        for use_temperature in (False, True):
+            start = time.perf_counter()
+            profile = fit(raw, true, temperature if use_temperature else None)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"{args.benchmark} readings{' + temperature' if use_temperature else ''}: {elapsed:.1f} ms, "
+                  f"{profile['grams_per_count']:.7f} g/count (true 0.0045558), {profile['offset_grams']:.1f} g, "
+                  f"span {profile['span_per_c'] * 1e6:.0f} ppm/C, zero {profile['offset_grams_per_c']:.2f} g/C, "
+                  f"rms {profile['residual_rms_g']:.2f} g, {profile['rejected']} rejected")
+        raise SystemExit
+
+    paths = args.csv or sorted(glob.glob(os.path.join(TRAINING_CSV_DIR, 'weight_*.csv')))
+    if not paths:
+        parser.error(f"no CSVs given and none found in {TRAINING_CSV_DIR}")
+    raw, grams, temperature = load_csvs(paths)
+    if args.temperature and temperature is None:
+        parser.error(f"--temperature needs a {' or '.join(TEMPERATURE_COLUMNS)} column in every file")
+    start = time.perf_counter()
+    profile = fit(raw, grams, temperature if args.temperature else None)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    print(f"{len(paths)} files, {profile['samples']} readings, {profile['rejected']} rejected, fitted in {elapsed:.1f} ms")
+    print(f"grams = {profile['grams_per_count']:.8f} * raw + {profile['offset_grams']:.2f}")
+    if args.temperature:
+        print(f"  at {profile['reference_temp_c']:.1f} C; span {profile['span_per_c'] * 1e6:+.1f} ppm/C, "
+              f"zero {profile['offset_grams_per_c']:+.3f} g/C")
+    print(f"residuals: rms {profile['residual_rms_g']:.2f} g, max {profile['residual_max_g']:.2f} g")
+    for level in profile['residuals_by_weight']:
+        print(f"  {level['true_grams']:8.1f} g: {level['samples']:6d} readings, "
+              f"mean {level['mean_g']:+.2f} g, std {level['std_g']:.2f} g")
+
+    if args.save:
+        conn = get_connection(args.db)
+        migrate(conn)
+        conn.close()
+        profile_id = CalibrationProfiles(args.db).save(
+            args.platform, profile, source=[os.path.basename(path) for path in paths])
+        print(f"Saved as profile {profile_id} for platform {args.platform}")
@@ -2,17 +2,103 @@
 
 import sqlite3
 import os
+import threading
 from datetime import datetime
 
 DB_PATH = 'penguin_molting.db'
 
-def init_db():
-    """Initialize the database with required tables."""
-    
-    # Connect to the database (creates it if it doesn't exist)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
+# Connection settings shared by the dashboard, ESP32 ingest and workers
+BUSY_TIMEOUT_MS = 10000   # Wait this long for a write lock instead of failing
+CACHE_SIZE_KB = 16384     # Page cache per connection
+MAX_IDLE_CONNECTIONS = 8  # Idle connections kept per database file
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool.
+
+    Code written as ``conn = get_connection() ... conn.close()`` reuses
+    connections without any other change; uncommitted work is rolled back
+    before the connection is reused.
+    """
+
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+
+class ConnectionPool:
+    """Pool of SQLite connections to one database file, configured for WAL."""
+
+    def __init__(self, db_path, max_idle=MAX_IDLE_CONNECTIONS):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False, factory=PooledConnection)
+        conn.execute('PRAGMA journal_mode=WAL')      # readers no longer block on writers
+        conn.execute('PRAGMA synchronous=NORMAL')    # durable at checkpoints, safe with WAL
+        conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._open()
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.Error:
+            sqlite3.Connection.close(conn)
+            return
+
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        sqlite3.Connection.close(conn)
+
+    def close_idle(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            sqlite3.Connection.close(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_connection(db_path=None):
+    """Return a pooled connection; call close() on it to give it back."""
+    db_path = db_path or DB_PATH
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path)
+    return pool.acquire()
+
+def close_pools():
+    """Close every idle pooled connection (e.g. before copying the database file)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_idle()
+
+def _create_base_tables(cursor):
     # Create penguins table with updated fields
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS penguins (
@@ -29,7 +115,7 @@ def init_db():
         health TEXT DEFAULT 'Healthy'
     )
     ''')
-    
+
     # Create detections table with updated fields
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS detections (
@@ -48,7 +134,7 @@ def init_db():
         FOREIGN KEY (rfid) REFERENCES penguins(rfid)
     )
     ''')
-    
+
     # Create environmental data table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS environmental_data (
@@ -60,49 +146,605 @@ def init_db():
         pressure REAL DEFAULT 0
     )
     ''')
-    
-    # For migrating existing database - add missing columns
-    tables = [row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
-    
-    # If the tables already exist, check for missing columns
-    if 'penguins' in tables:
-        # Get existing columns in penguins table
-        penguin_columns = [row[1] for row in cursor.execute("PRAGMA table_info(penguins)").fetchall()]
-        
-        # Add new columns to penguins table if they don't exist
-        new_penguin_columns = {
+
+    # Create detection jobs table (queued ESP32 detections awaiting inference)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS detection_jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT DEFAULT 'queued',
+        rfid TEXT,
+        image_path TEXT,
+        weight_kg REAL DEFAULT 0,
+        sex TEXT,
+        env_data TEXT,
+        source TEXT,
+        submitted_at TEXT,
+        started_at TEXT,
+        finished_at TEXT,
+        detection_id INTEGER,
+        result TEXT,
+        error TEXT
+    )
+    ''')
+
+def _add_health_columns(cursor):
+    """Bring databases created before the health/stage columns up to date."""
+    new_columns = {
+        'penguins': {
             'stage_name': 'TEXT DEFAULT "Non-molting"',
             'daily_change': 'REAL DEFAULT 0',
             'health': 'TEXT DEFAULT "Healthy"'
-        }
-        
-        for col_name, col_type in new_penguin_columns.items():
-            if col_name not in penguin_columns:
-                cursor.execute(f"ALTER TABLE penguins ADD COLUMN {col_name} {col_type}")
-    
-    if 'detections' in tables:
-        # Get existing columns in detections table
-        detection_columns = [row[1] for row in cursor.execute("PRAGMA table_info(detections)").fetchall()]
-        
-        # Add new columns to detections table if they don't exist
-        new_detection_columns = {
+        },
+        'detections': {
             'weight_kg': 'REAL DEFAULT 0',
             'stage_name': 'TEXT DEFAULT "Non-molting"',
             'daily_change': 'REAL DEFAULT 0',
             'health': 'TEXT DEFAULT "Healthy"'
         }
-        
-        for col_name, col_type in new_detection_columns.items():
-            if col_name not in detection_columns:
-                cursor.execute(f"ALTER TABLE detections ADD COLUMN {col_name} {col_type}")
-    
-    # Commit changes and close connection
-    conn.commit()
+    }
+
+    for table, columns in new_columns.items():
+        existing = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+        for col_name, col_type in columns.items():
+            if col_name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {col_name} {col_type}")
+
+def _add_dashboard_indexes(cursor):
+    # Per-penguin history, newest first (penguin detail, export by penguin)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_detections_rfid_time ON detections(rfid, detection_time)')
+    # Recent detections across all penguins
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_detections_time ON detections(detection_time)')
+    # Latest reading and the detection -> environment join
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_environmental_data_date ON environmental_data(date)')
+    # Dashboard health counts
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_penguins_health ON penguins(health)')
+    # Penguin list, most recently seen first
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_penguins_last_detection ON penguins(last_detection_time)')
+
+# Health states with their own counter column in dashboard_summary
+SUMMARY_HEALTH_COLUMNS = {
+    'Healthy': 'healthy',
+    'Molting': 'molting',
+    'Underweight': 'underweight',
+    'Rapid Weight Loss': 'rapid_weight_loss',
+    'Not a Danger': 'danger',  # what the dashboard's danger count has always matched
+}
+
+def _summary_terms(row):
+    """0/1 contribution of one penguins row (NEW or OLD) to each dashboard_summary counter."""
+    terms = {'total_penguins': '1'}
+    for health, column in SUMMARY_HEALTH_COLUMNS.items():
+        terms[column] = f"({row}.health IS '{health}')"
+    terms['healthy_today'] = (f"({row}.health IS 'Healthy' "
+                              f"AND date({row}.last_detection_time) IS healthy_today_date)")
+    return terms
+
+def _summary_trigger(name, event, add=None, remove=None):
+    """CREATE TRIGGER statement that adds the NEW row and/or removes the OLD row."""
+    assignments = []
+    for column in _summary_terms('NEW'):
+        if column == 'total_penguins' and add and remove:
+            continue
+        expression = column
+        if remove:
+            expression += f" - {_summary_terms(remove)[column]}"
+        if add:
+            expression += f" + {_summary_terms(add)[column]}"
+        assignments.append(f"{column} = {expression}")
+    return f'''
+    CREATE TRIGGER IF NOT EXISTS {name} {event}
+    BEGIN
+        UPDATE dashboard_summary SET
+            {', '.join(assignments)}
+        WHERE id = 1;
+    END
+    '''
+
+def refresh_dashboard_summary(cursor):
+    """Recompute dashboard_summary from scratch (migration, and once per day for healthy_today)."""
+    counts = ', '.join(
+        f"COALESCE(SUM(health = '{health}'), 0)" for health in SUMMARY_HEALTH_COLUMNS
+    )
+    cursor.execute(f'''
+        UPDATE dashboard_summary SET
+            (total_penguins, {', '.join(SUMMARY_HEALTH_COLUMNS.values())}) =
+                (SELECT COUNT(*), {counts} FROM penguins),
+            healthy_today_date = date('now', 'localtime'),
+            healthy_today = (SELECT COUNT(*) FROM penguins
+                             WHERE health = 'Healthy' AND date(last_detection_time) = date('now', 'localtime')),
+            (env_date, temperature, humidity, light_level, pressure) =
+                (SELECT date, temperature, humidity, light_level, pressure
+                 FROM environmental_data ORDER BY date DESC LIMIT 1)
+        WHERE id = 1
+    ''')
+
+def read_dashboard_summary(conn):
+    """Return the dashboard_summary row as a dict.
+
+    healthy_today is relative to the current local date (detection times
+    are stored in local time), so the first read after local midnight
+    recomputes the summary before returning it.
+    """
+    conn.row_factory = sqlite3.Row
+    summary = conn.execute(
+        "SELECT *, healthy_today_date IS date('now', 'localtime') AS current FROM dashboard_summary WHERE id = 1"
+    ).fetchone()
+    if not summary['current']:
+        with conn:
+            refresh_dashboard_summary(conn.cursor())
+        summary = conn.execute('SELECT *, 1 AS current FROM dashboard_summary WHERE id = 1').fetchone()
+    summary = dict(summary)
+    del summary['current']
+    return summary
+
+def _add_dashboard_summary(cursor):
+    """Single-row dashboard summary kept current by triggers.
+
+    The triggers run inside whatever transaction writes penguins or
+    environmental_data, so every writer (detections, manual edits,
+    restaging) keeps the counts exact without extra code.
+    """
+    counter_columns = ''.join(
+        f"        {column} INTEGER DEFAULT 0,\n" for column in SUMMARY_HEALTH_COLUMNS.values()
+    )
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS dashboard_summary (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total_penguins INTEGER DEFAULT 0,
+{counter_columns}        healthy_today INTEGER DEFAULT 0,
+        healthy_today_date TEXT,
+        env_date TEXT,
+        temperature REAL,
+        humidity REAL,
+        light_level REAL,
+        pressure REAL
+    )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO dashboard_summary (id) VALUES (1)')
+
+    cursor.execute(_summary_trigger('penguins_summary_insert', 'AFTER INSERT ON penguins', add='NEW'))
+    cursor.execute(_summary_trigger('penguins_summary_delete', 'AFTER DELETE ON penguins', remove='OLD'))
+    cursor.execute(_summary_trigger('penguins_summary_update',
+                                    'AFTER UPDATE OF health, last_detection_time ON penguins',
+                                    add='NEW', remove='OLD'))
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS environmental_data_summary_insert AFTER INSERT ON environmental_data
+    BEGIN
+        UPDATE dashboard_summary
+        SET env_date = NEW.date, temperature = NEW.temperature, humidity = NEW.humidity,
+            light_level = NEW.light_level, pressure = NEW.pressure
+        WHERE id = 1 AND (env_date IS NULL OR NEW.date >= env_date);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS environmental_data_summary_delete AFTER DELETE ON environmental_data
+    BEGIN
+        UPDATE dashboard_summary
+        SET (env_date, temperature, humidity, light_level, pressure) = (
+            SELECT date, temperature, humidity, light_level, pressure
+            FROM environmental_data ORDER BY date DESC LIMIT 1)
+        WHERE id = 1 AND OLD.date >= env_date;
+    END
+    ''')
+
+    refresh_dashboard_summary(cursor)
+
+# Per-penguin aggregates recomputed from detections; {where} narrows the rfids
+PENGUIN_STATS_SELECT = '''
+    SELECT d.rfid, COUNT(*),
+        (SELECT x.weight_kg FROM detections x WHERE x.rfid = d.rfid AND x.weight_kg > 0
+         ORDER BY x.detection_time, x.id LIMIT 1),
+        (SELECT x.detection_time FROM detections x WHERE x.rfid = d.rfid AND x.weight_kg > 0
+         ORDER BY x.detection_time, x.id LIMIT 1),
+        (SELECT x.weight_kg FROM detections x WHERE x.rfid = d.rfid AND x.weight_kg > 0
+         ORDER BY x.detection_time DESC, x.id DESC LIMIT 1),
+        (SELECT x.detection_time FROM detections x WHERE x.rfid = d.rfid AND x.weight_kg > 0
+         ORDER BY x.detection_time DESC, x.id DESC LIMIT 1),
+        MIN(CASE WHEN d.weight_kg > 0 THEN d.weight_kg END),
+        MAX(CASE WHEN d.weight_kg > 0 THEN d.weight_kg END),
+        (SELECT x.stage_name FROM detections x WHERE x.rfid = d.rfid AND x.health = 'Molting'
+         ORDER BY x.detection_time DESC, x.id DESC LIMIT 1),
+        (SELECT x.detection_time FROM detections x WHERE x.rfid = d.rfid AND x.health = 'Molting'
+         ORDER BY x.detection_time DESC, x.id DESC LIMIT 1),
+        (SELECT x.id FROM detections x WHERE x.rfid = d.rfid AND x.health = 'Molting'
+         ORDER BY x.detection_time DESC, x.id DESC LIMIT 1)
+    FROM detections d
+    WHERE {where}
+    GROUP BY d.rfid
+'''
+
+def backfill_penguin_stats(cursor):
+    """Rebuild penguin_stats for every penguin from the detections table."""
+    cursor.execute('DELETE FROM penguin_stats')
+    cursor.execute('INSERT INTO penguin_stats ' + PENGUIN_STATS_SELECT.format(where='d.rfid IS NOT NULL'))
+    return cursor.execute('SELECT COUNT(*) FROM penguin_stats').fetchone()[0]
+
+def _recompute_penguin_stats_sql(rfid):
+    """Trigger body statements that rebuild one penguin's stats row (rare: edits and deletes)."""
+    return (f"DELETE FROM penguin_stats WHERE rfid = {rfid};\n"
+            f"INSERT INTO penguin_stats {PENGUIN_STATS_SELECT.format(where=f'd.rfid = {rfid}')};")
+
+def _add_penguin_stats(cursor):
+    """Per-penguin detection aggregates, kept in step with detections by triggers.
+
+    New detections update the row in place (constant work per insert).
+    Changes to existing detections rebuild just that penguin's row, except
+    stage-only updates (restaging), which patch last_molt_stage directly.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS penguin_stats (
+        rfid TEXT PRIMARY KEY,
+        detection_count INTEGER DEFAULT 0,
+        first_weight REAL,
+        first_weight_time TEXT,
+        last_weight REAL,
+        last_weight_time TEXT,
+        min_weight REAL,
+        max_weight REAL,
+        last_molt_stage TEXT,
+        last_molt_time TEXT,
+        last_molt_id INTEGER
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS detections_stats_insert AFTER INSERT ON detections
+    WHEN NEW.rfid IS NOT NULL
+    BEGIN
+        INSERT INTO penguin_stats (
+            rfid, detection_count, first_weight, first_weight_time, last_weight, last_weight_time,
+            min_weight, max_weight, last_molt_stage, last_molt_time, last_molt_id)
+        SELECT NEW.rfid, 1, weight, weight_time, weight, weight_time, weight, weight,
+               molt_stage, molt_time, molt_id
+        FROM (SELECT
+                CASE WHEN NEW.weight_kg > 0 THEN NEW.weight_kg END AS weight,
+                CASE WHEN NEW.weight_kg > 0 THEN NEW.detection_time END AS weight_time,
+                CASE WHEN NEW.health = 'Molting' THEN NEW.stage_name END AS molt_stage,
+                CASE WHEN NEW.health = 'Molting' THEN NEW.detection_time END AS molt_time,
+                CASE WHEN NEW.health = 'Molting' THEN NEW.id END AS molt_id)
+        WHERE true
+        ON CONFLICT(rfid) DO UPDATE SET
+            detection_count = detection_count + 1,
+            first_weight = CASE WHEN excluded.first_weight_time < first_weight_time OR first_weight_time IS NULL
+                                THEN excluded.first_weight ELSE first_weight END,
+            first_weight_time = CASE WHEN excluded.first_weight_time < first_weight_time OR first_weight_time IS NULL
+                                     THEN excluded.first_weight_time ELSE first_weight_time END,
+            last_weight = CASE WHEN excluded.last_weight_time >= last_weight_time OR last_weight_time IS NULL
+                               THEN COALESCE(excluded.last_weight, last_weight) ELSE last_weight END,
+            last_weight_time = CASE WHEN excluded.last_weight_time >= last_weight_time OR last_weight_time IS NULL
+                                    THEN COALESCE(excluded.last_weight_time, last_weight_time) ELSE last_weight_time END,
+            min_weight = CASE WHEN excluded.min_weight < min_weight OR min_weight IS NULL
+                              THEN excluded.min_weight ELSE min_weight END,
+            max_weight = CASE WHEN excluded.max_weight > max_weight OR max_weight IS NULL
+                              THEN excluded.max_weight ELSE max_weight END,
+            last_molt_stage = CASE WHEN excluded.last_molt_time >= last_molt_time OR last_molt_time IS NULL
+                                   THEN COALESCE(excluded.last_molt_stage, last_molt_stage) ELSE last_molt_stage END,
+            last_molt_id = CASE WHEN excluded.last_molt_time >= last_molt_time OR last_molt_time IS NULL
+                                THEN COALESCE(excluded.last_molt_id, last_molt_id) ELSE last_molt_id END,
+            last_molt_time = CASE WHEN excluded.last_molt_time >= last_molt_time OR last_molt_time IS NULL
+                                  THEN COALESCE(excluded.last_molt_time, last_molt_time) ELSE last_molt_time END;
+    END
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS detections_stats_restage AFTER UPDATE OF stage_name ON detections
+    WHEN OLD.rfid IS NEW.rfid AND OLD.weight_kg IS NEW.weight_kg
+         AND OLD.detection_time IS NEW.detection_time AND OLD.health IS NEW.health
+    BEGIN
+        UPDATE penguin_stats SET last_molt_stage = NEW.stage_name
+        WHERE rfid = NEW.rfid AND last_molt_id = NEW.id;
+    END
+    ''')
+
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS detections_stats_update
+    AFTER UPDATE OF rfid, weight_kg, detection_time, health ON detections
+    BEGIN
+        {_recompute_penguin_stats_sql('OLD.rfid')}
+        {_recompute_penguin_stats_sql('NEW.rfid')}
+    END
+    ''')
+
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS detections_stats_delete AFTER DELETE ON detections
+    BEGIN
+        {_recompute_penguin_stats_sql('OLD.rfid')}
+    END
+    ''')
+
+    backfill_penguin_stats(cursor)
+
+def _add_visits(cursor):
+    """Raw samples behind each visit; the visit itself is one detections row."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS visit_samples (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        rfid TEXT NOT NULL,
+        sample_time TEXT NOT NULL,
+        weight_kg REAL,
+        image_path TEXT,
+        sharpness REAL,
+        sex TEXT,
+        env_data TEXT,
+        job_id TEXT,
+        detection_id INTEGER
+    )
+    ''')
+    # Unclosed samples are reloaded on start; closed ones are read per job and per visit
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_visit_samples_job ON visit_samples(job_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_visit_samples_detection ON visit_samples(detection_id)')
+
+    existing = [row[1] for row in cursor.execute("PRAGMA table_info(detections)").fetchall()]
+    for col_name, col_type in {'visit_start': 'TEXT', 'visit_end': 'TEXT',
+                               'sample_count': 'INTEGER DEFAULT 1'}.items():
+        if col_name not in existing:
+            cursor.execute(f"ALTER TABLE detections ADD COLUMN {col_name} {col_type}")
+
+def _add_calibration_profiles(cursor):
+    """Load-cell calibrations per weighing platform; the newest row of a platform is in use."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS calibration_profiles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        platform_id TEXT NOT NULL,
+        fitted_at TEXT NOT NULL,
+        grams_per_count REAL NOT NULL,
+        offset_grams REAL NOT NULL,
+        reference_temp_c REAL,
+        offset_grams_per_c REAL DEFAULT 0,
+        span_per_c REAL DEFAULT 0,
+        samples INTEGER,
+        rejected INTEGER,
+        residual_rms_g REAL,
+        residual_max_g REAL,
+        source TEXT
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_calibration_platform ON calibration_profiles(platform_id, id)')
+
+def _add_job_leases(cursor):
+    """Record which process is running a detection job and until when its claim holds."""
+    existing = [row[1] for row in cursor.execute("PRAGMA table_info(detection_jobs)").fetchall()]
+    for col_name, col_type in {'claimed_by': 'TEXT', 'lease_until': 'REAL'}.items():
+        if col_name not in existing:
+            cursor.execute(f"ALTER TABLE detection_jobs ADD COLUMN {col_name} {col_type}")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_detection_jobs_status ON detection_jobs(status, submitted_at)')
+
+def _rebuild_summary_triggers(cursor):
+    """Recreate the penguins summary triggers after a change to SUMMARY_HEALTH_COLUMNS."""
+    for name in ('penguins_summary_insert', 'penguins_summary_delete', 'penguins_summary_update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    _add_dashboard_summary(cursor)
+
+# Schema migrations, applied in order. PRAGMA user_version records the last
+# one applied; append new steps here rather than editing old ones.
+MIGRATIONS = [
+    (1, 'base tables', _create_base_tables),
+    (2, 'health and stage columns', _add_health_columns),
+    (3, 'dashboard indexes', _add_dashboard_indexes),
+    (4, 'dashboard summary', _add_dashboard_summary),
+    (5, 'per-penguin detection stats', _add_penguin_stats),
+    (6, 'visits and their raw samples', _add_visits),
+    (7, 'load-cell calibration profiles', _add_calibration_profiles),
+    (8, 'detection job leases', _add_job_leases),
+    (9, 'dashboard danger count as before the summary row', _rebuild_summary_triggers),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate(conn):
+    """Apply every migration newer than the database's user_version.
+
+    Each step runs in its own transaction together with the version bump,
+    so an interrupted upgrade resumes from the last completed step. Steps
+    are idempotent, which lets databases created before versioning (user
+    version 0, tables already present) go through the same path.
+    """
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    applied = []
+
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            step(cursor)
+            cursor.execute(f'PRAGMA user_version = {version}')
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        applied.append(version)
+        print(f"Applied migration {version}: {description}")
+
+    return applied
+
+def init_db():
+    """Initialize the database and bring its schema up to date."""
+    conn = get_connection()
+    migrate(conn)
     conn.close()
-    
+
     print("Database initialized successfully!")
 
+# Hot dashboard queries and the index each one must use (see hi.py)
+QUERY_PLAN_CHECKS = [
+    ('recent detections',
+     'SELECT d.*, p.sex FROM detections d LEFT JOIN penguins p ON d.rfid = p.rfid '
+     'ORDER BY d.detection_time DESC LIMIT 20', (),
+     ['idx_detections_time']),
+    ('penguin detail',
+     'SELECT d.*, e.temperature FROM detections d '
+     'LEFT JOIN environmental_data e ON d.detection_time = e.date '
+     'WHERE d.rfid = ? ORDER BY d.detection_time DESC', ('PENG001',),
+     ['idx_detections_rfid_time', 'idx_environmental_data_date']),
+    ('detection history page',
+     'SELECT d.*, p.sex FROM detections d LEFT JOIN penguins p ON d.rfid = p.rfid '
+     'WHERE (d.detection_time, d.id) < (?, ?) AND d.detection_time >= ? '
+     'ORDER BY d.detection_time DESC, d.id DESC LIMIT 21', ('2025-06-01 12:00:00', 100, '2025-01-01'),
+     ['idx_detections_time']),
+    ('penguin detail page',
+     'SELECT d.* FROM detections d WHERE d.rfid = ? AND (d.detection_time, d.id) > (?, ?) '
+     'ORDER BY d.detection_time ASC, d.id ASC LIMIT 101', ('PENG001', '2025-06-01 12:00:00', 100),
+     ['idx_detections_rfid_time']),
+    ('environment history page',
+     'SELECT * FROM environmental_data WHERE (date, id) < (?, ?) ORDER BY date DESC, id DESC LIMIT 51',
+     ('2025-06-01', 100),
+     ['idx_environmental_data_date']),
+    ('latest environment reading',
+     'SELECT * FROM environmental_data ORDER BY date DESC LIMIT 1', (),
+     ['idx_environmental_data_date']),
+    ('dashboard summary',
+     'SELECT * FROM dashboard_summary WHERE id = 1', (),
+     ['INTEGER PRIMARY KEY']),
+    ('molting count',
+     "SELECT COUNT(*) FROM penguins WHERE health = 'Molting'", (),
+     ['idx_penguins_health']),
+    ('needs attention count',
+     "SELECT COUNT(*) FROM penguins WHERE health IN ('Underweight', 'Rapid Weight Loss')", (),
+     ['idx_penguins_health']),
+    ('healthy today',
+     "SELECT COUNT(*) FROM penguins WHERE health = 'Healthy' AND date(last_detection_time) = date('now', 'localtime')", (),
+     ['idx_penguins_health']),
+    ('penguin list',
+     'SELECT p.*, s.detection_count FROM penguins p LEFT JOIN penguin_stats s ON s.rfid = p.rfid '
+     'ORDER BY p.last_detection_time DESC', (),
+     ['idx_penguins_last_detection', 'sqlite_autoindex_penguin_stats_1']),
+]
+
+def check_query_plans(db_path=None):
+    """Assert with EXPLAIN QUERY PLAN that each dashboard query uses its indexes.
+
+    Fails if an expected index is missing from the plan or if any step
+    falls back to a full table scan or a temporary sort.
+    """
+    conn = get_connection(db_path)
+    failures = []
+    try:
+        for name, sql, params, indexes in QUERY_PLAN_CHECKS:
+            plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+            detail = ' | '.join(plan)
+            missing = [index for index in indexes if index not in detail]
+            full_scans = [step for step in plan
+                          if (step.startswith('SCAN') and 'INDEX' not in step) or 'TEMP B-TREE' in step]
+            status = 'ok' if not missing and not full_scans else 'FAIL'
+            print(f"{status:>4}  {name}: {detail}")
+            if status != 'ok':
+                failures.append(name)
+    finally:
+        conn.close()
+
+    assert not failures, f"Queries not using their indexes: {', '.join(failures)}"
+
+def load_test(db_path, pooled=True, readers=4, writers=2, seconds=5.0):
+    """Hammer a database with dashboard-style reads and detection-style writes.
+
+    ``pooled=False`` mimics the old behaviour: a fresh sqlite3.connect() per
+    operation on a rollback-journal database. Returns operation rates and
+    the number of 'database is locked' failures.
+    """
+    if not pooled:
+        conn = sqlite3.connect(db_path)
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.close()
+
+    def connect():
+        return get_connection(db_path) if pooled else sqlite3.connect(db_path)
+
+    counts = {'reads': 0, 'writes': 0, 'locked': 0}
+    counts_lock = threading.Lock()
+    stop = threading.Event()
+
+    def count(key):
+        with counts_lock:
+            counts[key] += 1
+
+    def reader():
+        while not stop.is_set():
+            try:
+                conn = connect()
+                conn.execute('SELECT * FROM detections ORDER BY detection_time DESC LIMIT 20').fetchall()
+                conn.execute("SELECT COUNT(*) FROM penguins WHERE health = 'Molting'").fetchone()
+                conn.close()
+                count('reads')
+            except sqlite3.OperationalError:
+                count('locked')
+
+    def writer(worker_id):
+        i = 0
+        while not stop.is_set():
+            i += 1
+            rfid = f"LOAD{worker_id}_{i % 50}"
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            try:
+                conn = connect()
+                conn.execute(
+                    '''INSERT INTO detections (rfid, detection_time, molting_prediction, confidence, weight_kg)
+                       VALUES (?, ?, 0, 0.9, 3.5)''', (rfid, now))
+                conn.execute(
+                    '''INSERT INTO penguins (rfid, last_weight, last_detection_time, first_seen)
+                       VALUES (?, 3.5, ?, ?)
+                       ON CONFLICT(rfid) DO UPDATE SET last_weight = 3.5,
+                           last_detection_time = excluded.last_detection_time''',
+                    (rfid, now, now))
+                conn.commit()
+                conn.close()
+                count('writes')
+            except sqlite3.OperationalError:
+                count('locked')
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    stop.wait(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'reads_per_second': round(counts['reads'] / seconds, 1),
+        'writes_per_second': round(counts['writes'] / seconds, 1),
+        'locked_errors': counts['locked']
+    }
+
 # If this script is run directly, initialize the database
 if __name__ == "__main__":
-    init_db()
-    print(f"Database initialized at {DB_PATH}")
\ No newline at end of file
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Initialize the penguin database")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--check-plans', action='store_true',
+                        help='Migrate, then verify with EXPLAIN QUERY PLAN that dashboard queries use indexes')
+    parser.add_argument('--backfill-penguin-stats', action='store_true',
+                        help='Rebuild the per-penguin detection aggregates from the detections table')
+    parser.add_argument('--load-test', action='store_true',
+                        help='Compare per-request connections with pooled WAL connections on a scratch database')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    args = parser.parse_args()
+    DB_PATH = args.db
+
+    if args.load_test:
+        for pooled in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                DB_PATH = os.path.join(tmp, 'load_test.db')
+                init_db()
+                close_pools()
+                result = load_test(DB_PATH, pooled, args.readers, args.writers, args.seconds)
+                label = 'pooled + WAL' if pooled else 'connect per request'
+                print(f"{label:>20}: {result['reads_per_second']} reads/s, "
+                      f"{result['writes_per_second']} writes/s, {result['locked_errors']} locked errors")
+    else:
+        init_db()
+        print(f"Database initialized at {DB_PATH} (schema version {SCHEMA_VERSION})")
+        if args.backfill_penguin_stats:
+            conn = get_connection()
+            with conn:
+                count = backfill_penguin_stats(conn.cursor())
+            conn.close()
+            print(f"Rebuilt detection stats for {count} penguin(s)")
+        if args.check_plans:
+            check_query_plans()
\ No newline at end of file
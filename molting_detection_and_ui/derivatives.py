@@ -0,0 +1,167 @@
+# derivatives.py
+
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+from PIL import Image
+
+DERIVED_DIR = os.environ.get('DERIVED_DIR', 'derived')                  # Resized copies, served by /images/<variant>/
+DERIVED_CACHE_MB = int(os.environ.get('DERIVED_CACHE_MB', 512))         # Evict least recently used above this
+DERIVED_QUALITY = int(os.environ.get('DERIVED_QUALITY', 80))
+
+# variant -> (mode, size). 'fit' keeps the aspect ratio inside size; 'stretch'
+# matches the (224, 224) Resize in inference.transform
+VARIANTS = {
+    'thumb': ('fit', (320, 320)),
+    'model': ('stretch', (224, 224)),
+}
+
+
+def render(image, variant):
+    """Return the ``variant`` derivative of a PIL image as RGB."""
+    mode, size = VARIANTS[variant]
+    # For JPEGs, decode straight at 1/2, 1/4 or 1/8 scale instead of full size
+    image.draft('RGB', size)
+    image = image.convert('RGB')
+    if mode == 'fit':
+        image.thumbnail(size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+        return image
+    return image.resize(size, Image.Resampling.BILINEAR)
+
+
+class DerivativeCache:
+    """Size-bounded on-disk cache of resized images.
+
+    Derivatives are keyed by variant and source URL, plus the source's
+    mtime and size unless the URL is ``immutable`` (a content-addressed
+    store URL): a legacy upload overwritten in place gets a new derivative
+    rather than the old one. The least recently used ones are deleted
+    once the cache holds more than ``max_bytes``; file mtimes record use,
+    so the order survives restarts.
+    """
+
+    def __init__(self, root=DERIVED_DIR, max_bytes=DERIVED_CACHE_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # path -> size, least recently used first
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    def _load(self):
+        files = []
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if filename.endswith('.tmp'):
+                    os.remove(path)  # left by an interrupted write
+                    continue
+                stat = os.stat(path)
+                files.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._entries[path] = size
+            self._total += size
+
+    def path_for(self, variant, source_url, source_path=None, immutable=True):
+        if not immutable:
+            stat = os.stat(source_path)
+            source_url = f"{source_url}?{stat.st_mtime_ns}:{stat.st_size}"
+        key = hashlib.sha1(source_url.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, variant, key[:2], f"{key}.jpg")
+
+    def get(self, variant, source_url, source_path, immutable=False):
+        """Path of the derivative, generating it from ``source_path`` on a miss."""
+        path = self.path_for(variant, source_url, source_path, immutable)
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                hit = True
+            else:
+                self.misses += 1
+                hit = False
+        if hit:
+            try:
+                os.utime(path)
+                return path
+            except FileNotFoundError:
+                with self._lock:
+                    self._total -= self._entries.pop(path, 0)
+
+        with Image.open(source_path) as image:
+            derived = render(image, variant)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f_out:
+                derived.save(f_out, 'JPEG', quality=DERIVED_QUALITY, optimize=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        size = os.path.getsize(path)
+        with self._lock:
+            self._total += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+            evicted = []
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_path, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                evicted.append(old_path)
+            self.evictions += len(evicted)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+if __name__ == "__main__":
+    import argparse
+    import glob
+    import time
+
+    parser = argparse.ArgumentParser(description="Build thumbnails for existing images and time cold vs cached reads")
+    parser.add_argument('--images', default='static', help='Directory searched recursively for JPEG/PNG files')
+    parser.add_argument('--variant', choices=sorted(VARIANTS), default='thumb')
+    args = parser.parse_args()
+
+    sources = sorted(path for pattern in ('*.jpg', '*.jpeg', '*.png')
+                     for path in glob.glob(os.path.join(args.images, '**', pattern), recursive=True))
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = DerivativeCache(tmp)
+        start = time.perf_counter()
+        derived = [cache.get(args.variant, path, path) for path in sources]
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        for path in sources:
+            cache.get(args.variant, path, path)
+        warm = time.perf_counter() - start
+
+        original_bytes = sum(os.path.getsize(path) for path in sources)
+        derived_bytes = sum(os.path.getsize(path) for path in derived)
+        count = max(len(sources), 1)
+        print(f"{len(sources)} images: {original_bytes / 1024:.0f} KB originals -> "
+              f"{derived_bytes / 1024:.0f} KB {args.variant} ({original_bytes / max(derived_bytes, 1):.1f}x smaller)")
+        print(f"generate {cold / count * 1000:.2f} ms/image, cached lookup {warm / count * 1000:.3f} ms/image")
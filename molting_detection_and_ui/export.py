@@ -0,0 +1,158 @@
+# export.py
+
+import os
+import time
+
+# pyarrow is optional: only the Parquet / Arrow exports need it
+CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 50000))  # Rows per record batch / row group
+COMPRESSION = os.environ.get('EXPORT_COMPRESSION', 'zstd')
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+COLUMNAR_FORMATS = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrow', 'application/vnd.apache.arrow.file'),
+}
+
+# Column (name, kind) of the joined detection export served by /api/export-detections
+DETECTION_EXPORT_COLUMNS = [
+    ('id', 'int'),
+    ('rfid', 'text'),
+    ('detection_time', 'timestamp'),
+    ('image_path', 'text'),
+    ('molting_prediction', 'bool'),
+    ('confidence', 'float'),
+    ('weight_kg', 'float'),
+    ('stage_name', 'text'),
+    ('daily_change', 'float'),
+    ('health', 'text'),
+    ('sex', 'text'),
+    ('penguin_notes', 'text'),
+]
+
+# Columns stored as INTEGER/TEXT in SQLite that have a better Arrow type
+BOOL_COLUMNS = {'molting_prediction', 'processed', 'current_molting_status'}
+TIMESTAMP_COLUMNS = {'detection_time', 'last_detection_time', 'first_seen', 'date'}
+
+TABLES = ['detections', 'penguins', 'environmental_data']
+
+
+def table_columns(conn, table):
+    """(name, kind) for every column of a table, from its declared SQLite types."""
+    columns = []
+    for _, name, declared, *_ in conn.execute(f"PRAGMA table_info({table})").fetchall():
+        declared = (declared or '').upper()
+        if name in BOOL_COLUMNS:
+            kind = 'bool'
+        elif name in TIMESTAMP_COLUMNS:
+            kind = 'timestamp'
+        elif 'INT' in declared:
+            kind = 'int'
+        elif 'REAL' in declared or 'FLOA' in declared or 'DOUB' in declared:
+            kind = 'float'
+        else:
+            kind = 'text'
+        columns.append((name, kind))
+    return columns
+
+
+def arrow_schema(columns):
+    import pyarrow as pa
+
+    types = {
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'bool': pa.bool_(),
+        'text': pa.string(),
+        'timestamp': pa.timestamp('s'),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def _record_batch(rows, columns, schema):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    arrays = []
+    for (name, kind), values in zip(columns, zip(*rows)):
+        if kind == 'timestamp':
+            # Unparseable timestamps become null rather than failing the export
+            arrays.append(pc.strptime(pa.array(values, pa.string()), format=TIMESTAMP_FORMAT,
+                                      unit='s', error_is_null=True))
+        elif kind == 'bool':
+            arrays.append(pa.array([None if v is None else bool(v) for v in values], pa.bool_()))
+        else:
+            arrays.append(pa.array(values, schema.field(name).type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_columnar(cursor, columns, sink, file_format='parquet', chunk_rows=CHUNK_ROWS):
+    """Write cursor rows to ``sink`` as Parquet or an Arrow IPC file.
+
+    Rows are pulled with fetchmany() and written one typed record batch at
+    a time, so memory stays at one chunk whatever the table size. ``sink``
+    is a path or a binary file object. Returns the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(columns)
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression=COMPRESSION)
+    elif file_format == 'arrow':
+        writer = pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression=COMPRESSION))
+    else:
+        raise ValueError(f"Unsupported columnar format: {file_format}")
+
+    total = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            writer.write_batch(_record_batch(rows, columns, schema))
+            total += len(rows)
+    finally:
+        writer.close()
+    return total
+
+
+def export_tables(db_path, out_dir, file_format='parquet', tables=TABLES):
+    """Write each table to ``out_dir/<table>.<ext>``. Returns {table: (path, rows, seconds)}."""
+    from db import get_connection
+
+    os.makedirs(out_dir, exist_ok=True)
+    extension = COLUMNAR_FORMATS[file_format][0]
+    results = {}
+
+    conn = get_connection(db_path)
+    try:
+        for table in tables:
+            start = time.perf_counter()
+            columns = table_columns(conn, table)
+            if not columns:
+                raise ValueError(f"No such table: {table}")
+            path = os.path.join(out_dir, f"{table}.{extension}")
+            names = ', '.join(name for name, _ in columns)
+            cursor = conn.execute(f"SELECT {names} FROM {table} ORDER BY {columns[0][0]}")
+            rows = write_columnar(cursor, columns, path, file_format)
+            cursor.close()
+            results[table] = (path, rows, round(time.perf_counter() - start, 3))
+    finally:
+        conn.close()
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import DB_PATH
+
+    parser = argparse.ArgumentParser(description="Export tables to typed, compressed Parquet or Arrow files")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--out', default='exports')
+    parser.add_argument('--format', choices=sorted(COLUMNAR_FORMATS), default='parquet')
+    parser.add_argument('--tables', nargs='+', default=TABLES, choices=TABLES)
+    args = parser.parse_args()
+
+    for table, (path, rows, seconds) in export_tables(args.db, args.out, args.format, args.tables).items():
+        print(f"{table}: {rows} rows -> {path} ({os.path.getsize(path) / 1024:.1f} KB, {seconds}s)")
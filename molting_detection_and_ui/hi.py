@@ -1,26 +1,32 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response
-from werkzeug.utils import secure_filename
 import sqlite3
 import os
-import json
-import numpy as np
 from datetime import datetime
-import torch
-from torchvision import transforms, models
-from tensorflow.keras.models import load_model
-import joblib
-import torch.nn as nn
-import torch.nn.functional as F
 from PIL import Image
 import base64
-from db import init_db
+from db import init_db, get_connection, read_dashboard_summary
+from jobs import DetectionJobQueue
+from model_registry import registry
+from restage import restage_detections
+from export import COLUMNAR_FORMATS, DETECTION_EXPORT_COLUMNS, write_columnar
+from sse_hub import EventHub
+from live_frame import LiveFrame, MJPEG_IDLE_SECONDS, MJPEG_MAX_SECONDS, mjpeg_part
+from image_store import ImageStore
+from derivatives import DerivativeCache, VARIANTS as DERIVED_VARIANTS
+from frame_cache import FrameCache, dhash
+from loadcell_filters import decode_adc_burst, estimate_weight
+from calibration import CalibrationProfiles, DEFAULT_PLATFORM
+from metrics import metrics
+from visits import VisitSessionizer, VISIT_BEST_FRAMES, VISIT_SOURCE, median_env, robust_weight, sharpness
+from werkzeug.security import safe_join
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import queue
-from transformers import OwlViTProcessor, OwlViTForObjectDetection
-from flask import make_response
+from flask import send_file, stream_with_context
 import csv
 import io
+import tempfile
 import logging
 
 
@@ -31,131 +37,58 @@ app = Flask(__name__)
 app.secret_key = 'supersecretkey'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 
-# Initialize OwlV2 model for animal detection
-owl_processor = OwlViTProcessor.from_pretrained("./owlvit-local")
-owl_model = OwlViTForObjectDetection.from_pretrained("./owlvit-local")
-
-# Define animal categories we want to detect
-ANIMAL_CATEGORIES = ["penguin", "honey badger", "bird", "seal", "other animal"]
-DETECTION_THRESHOLD = 0.25  # Confidence threshold for animal detection
-
 # Create queues and variables to store ESP32 data
 esp_data_queue = queue.Queue(maxsize=20)  # Store the last 20 readings
 latest_esp_data = None
-latest_esp_image = None
-esp_clients = []  # List to track connected clients for SSE
+live_frame = LiveFrame()  # Latest ESP32 camera frame as raw JPEG bytes
+esp_events = EventHub()  # Live dashboard SSE fan-out, published to only when new data arrives
 
 # Database and model paths
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+IMAGE_CONTENT_TYPES = {'image/jpeg': 'jpg', 'image/png': 'png'}  # Raw-body detection uploads
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', 8 * 1024 * 1024))  # Largest raw detection image
+# Header form of the detection fields for raw image uploads (query parameters also work)
+DETECTION_HEADERS = {
+    'rfid': 'X-RFID',
+    'weight': 'X-Weight',
+    'sex': 'X-Sex',
+    'temperature': 'X-Temperature',
+    'humidity': 'X-Humidity',
+    'light': 'X-Light',
+    'pressure': 'X-Pressure',
+    'platform': 'X-Platform',
+}
 DB_PATH = 'penguin_molting.db'
-MODEL_PATH = r"C:\Users\MKHIN\Downloads\Design Project\penguin_project_code\checkponts\checkpoints\best_model_fold4.pt"
+image_store = ImageStore()  # Content-addressed images under static/images; static/uploads holds older files
+derived_images = DerivativeCache()  # Thumbnails and model-size copies, LRU-bounded
+calibrations = CalibrationProfiles(DB_PATH)  # Load-cell calibration per platform, for raw adc bursts
+INGEST_VARIANTS = ('thumb',)  # Derivatives built when a detection image arrives rather than on first view
 MODEL_VERSION = 'fold4/1'
-# Add after your other model loading code
-MOLT_STAGE_MODEL_PATH = r"C:\Users\MKHIN\Downloads\Design Project\penguin_project_code\checkponts\checkpoints\molt_stage_model_simplified.h5"  # Update with your actual path
-MOLT_STAGE_SCALER_PATH = r"C:\Users\MKHIN\Downloads\Design Project\penguin_project_code\checkponts\checkpoints\molt_stage_scaler.save"  # Scaler for feature normalization
-
-# Load molt stage model and scaler
-try:
-    molt_stage_model = load_model(MOLT_STAGE_MODEL_PATH)
-    molt_stage_scaler = joblib.load(MOLT_STAGE_SCALER_PATH)
-    print("Successfully loaded molt stage classifier")
-except Exception as e:
-    molt_stage_model = None
-    molt_stage_scaler = None
-    print(f"Error loading molt stage model: {str(e)}")
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 2))  # Background detection workers
+LOG_DUPLICATE_FRAMES = os.environ.get('LOG_DUPLICATE_FRAMES', '1') == '1'  # Still save a detection (weight) for reused frames
+MODEL_LOADING = os.environ.get('MODEL_LOADING', 'eager')  # eager | background | lazy
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 init_db()
 
-# --- Model Loading ---
-model = models.vgg16(weights=None)
-num_features = model.classifier[6].in_features
-model.classifier[6] = nn.Linear(num_features, 2)
-state_dict = torch.load(MODEL_PATH, map_location=torch.device('cpu'))
-model.load_state_dict(state_dict)
-model.eval()
+# Single background thread for image writes that are not on the inference path
+image_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-writer")
 
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
+# Model scores of recent frames per RFID, reused for near-identical frames of the same visit
+frame_cache = FrameCache()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def preprocess_image(filepath):
-    img = Image.open(filepath).convert('RGB')
-    img = transform(img).unsqueeze(0)
-    return img
-
-def predict(filepath):
-    img = preprocess_image(filepath)
-    with torch.no_grad():
-        output = model(img)
-        probs = F.softmax(output, dim=1).squeeze()
-        molting_prob = probs[0].item()
-        normal_prob = probs[1].item()
-    return molting_prob, normal_prob
-def get_molting_stage(weight, sex, detection_date):
-    """
-    Determine molt stage for MOLTING penguins only using ML model
-    Returns tuple of (stage_name, confidence)
-    
-    Args:
-        weight: float - penguin weight in kg
-        sex: str - 'Male' or 'Female'
-        detection_date: datetime - date of observation
-    
-    Returns:
-        tuple: (stage_name: str, confidence: float)
-    """
-    # Validate ML components
-    if molt_stage_model is None or molt_stage_scaler is None:
-        raise ValueError("Molt stage classifier not properly initialized")
-    
-    try:
-        # Convert sex to numerical (0=female, 1=male)
-        sex_code = 0 if sex and sex.lower() == 'female' else 1
-        
-        # Extract temporal features
-        day_of_year = detection_date.timetuple().tm_yday
-        
-        # Create cyclical features for seasonality
-        day_sin = np.sin(day_of_year * (2 * np.pi / 365))
-        day_cos = np.cos(day_of_year * (2 * np.pi / 365))
-        
-        # Prepare features array (order must match training)
-        features = np.array([[weight, sex_code, day_of_year, day_sin, day_cos]])
-        
-        # Normalize features
-        scaled_features = molt_stage_scaler.transform(features)
-        
-        # Get prediction
-        predictions = molt_stage_model.predict(scaled_features)
-        stage_idx = np.argmax(predictions)
-        confidence = np.max(predictions)
-        
-        # Map index to stage name
-        stage_mapping = {
-            0: "Pre-molt",
-            1: "Mid-molt", 
-            2: "Post-molt"
-        }
-        
-        return stage_mapping[stage_idx], float(confidence)
-        
-    except Exception as e:
-        print(f"Error in ML molt stage prediction: {str(e)}")
-        raise RuntimeError("Failed to predict molt stage using ML model")
-
 def get_previous_weight(penguin_id):
-    conn = sqlite3.connect(DB_PATH)
+    """Weight at the penguin's last weighed detection (penguin_stats), else its recorded weight."""
+    conn = get_connection(DB_PATH)
     cursor = conn.cursor()
     result = cursor.execute(
-        "SELECT last_weight FROM penguins WHERE rfid = ?",
-        (penguin_id,)
+        '''SELECT COALESCE((SELECT last_weight FROM penguin_stats WHERE rfid = ?),
+                           (SELECT last_weight FROM penguins WHERE rfid = ?))''',
+        (penguin_id, penguin_id)
     ).fetchone()
     conn.close()
     return result[0] if result else None
@@ -170,58 +103,14 @@ def determine_health_status(weight_kg, molting_prob, daily_change=None):
     else:
         return "Healthy"
 
-def detect_animal(image_path):
-    """Use OwlV2 to detect if the image contains a penguin or other animal"""
-    image = Image.open(image_path).convert('RGB')
-    
-    # Prepare inputs and run detection
-    inputs = owl_processor(text=ANIMAL_CATEGORIES, images=image, return_tensors="pt")
-    outputs = owl_model(**inputs)
-    
-    # Target image sizes (height, width) to rescale box predictions
-    target_sizes = torch.Tensor([image.size[::-1]])
-    
-    # Convert outputs (bounding boxes and class logits) to COCO API
-    results = owl_processor.post_process_object_detection(
-        outputs=outputs, 
-        target_sizes=target_sizes,
-        threshold=DETECTION_THRESHOLD
-    )
-    
-    # Process results
-    is_penguin = False
-    animal_info = []
-    
-    if len(results) > 0 and 'scores' in results[0] and len(results[0]['scores']) > 0:
-        for score, label in zip(results[0]['scores'], results[0]['labels']):
-            animal_type = ANIMAL_CATEGORIES[label.item()]
-            confidence = score.item()
-            
-            if animal_type == "penguin" and confidence >= DETECTION_THRESHOLD:
-                is_penguin = True
-            
-            animal_info.append(f"{animal_type} (confidence: {confidence:.2f})")
-    
-    notes = "Detected animals: " + ", ".join(animal_info) if animal_info else "No animals detected"
-    return is_penguin, notes
-
 import os
 import base64
 import sqlite3
 from datetime import datetime
 from PIL import Image
-from werkzeug.utils import secure_filename
-
-def process_detection(rfid, image_file_or_b64, weight, sex=None, env_data=None):
-    """Process penguin detection with ML-based molt stage classification."""
-
-    # Ensure upload folder exists
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-    now = datetime.now()
-    detection_time_str = now.strftime('%Y-%m-%d %H:%M:%S')
 
-    # Save image (base64 string or Werkzeug file)
+def read_detection_image(image_file_or_b64):
+    """Return the raw image bytes and file extension from a base64 string or Werkzeug file."""
     if isinstance(image_file_or_b64, str):
         # Handle possible data URI prefix
         if image_file_or_b64.startswith('data:image'):
@@ -230,41 +119,127 @@ def process_detection(rfid, image_file_or_b64, weight, sex=None, env_data=None):
             encoded = image_file_or_b64
 
         try:
-            file_bytes = base64.b64decode(encoded)
+            with metrics.span('base64_decode'):
+                return base64.b64decode(encoded), 'jpg'
         except Exception as e:
             raise RuntimeError(f"Base64 decode error: {e}")
 
-        filename = secure_filename(f"{rfid}_{now.strftime('%Y%m%d_%H%M%S')}.jpg")
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    # Werkzeug file object
+    ext = image_file_or_b64.filename.rsplit('.', 1)[1].lower()
+    return image_file_or_b64.read(), ext
+
+def store_image(file_bytes, ext='jpg'):
+    """Save image bytes in the image store; returns (filepath, image_url)."""
+    try:
+        with metrics.span('image_write'):
+            filepath, image_url, _ = image_store.put(file_bytes, ext)
+    except OSError as e:
+        raise RuntimeError(f"Failed to save image: {e}")
+    return filepath, image_url
 
+def write_image_file_async(filepath, file_bytes, image_url=None):
+    """Write an image on the background writer so inference does not wait on disk.
+
+    With ``image_url`` the ingest-time thumbnails are built after the write.
+    """
+    def _write():
+        try:
+            with metrics.span('image_write'):
+                image_store.write(filepath, file_bytes)
+        except OSError as e:
+            print(f"Background image write failed for {filepath}: {str(e)}")
+            return
+        if image_url:
+            warm_derivatives(image_url, filepath)
+    image_writer.submit(_write)
+
+def warm_derivatives(image_url, filepath):
+    for variant in INGEST_VARIANTS:
         try:
-            with open(filepath, "wb") as f_out:
-                f_out.write(file_bytes)
+            derived_images.get(variant, image_url, filepath, immutable=True)
         except Exception as e:
-            raise RuntimeError(f"Failed to save image: {e}")
+            print(f"Could not build {variant} for {image_url}: {str(e)}")
 
-    else:
-        # Werkzeug file object
-        ext = image_file_or_b64.filename.rsplit('.', 1)[1].lower()
-        filename = secure_filename(f"{rfid}_{now.strftime('%Y%m%d_%H%M%S')}.{ext}")
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        image_file_or_b64.save(filepath)
+def thumbnail_url(image_url, variant='thumb'):
+    """URL of a resized copy of a /static image, served by ``derived_image``."""
+    if not image_url or not image_url.startswith('/static/'):
+        return None
+    return f"/images/{variant}/{image_url[len('/static/'):]}"
 
-    # Validate that the image can be opened properly
+def decode_image(file_bytes):
+    """Decode image bytes once into an RGB PIL image shared by the whole pipeline."""
     try:
-        img = Image.open(filepath).convert('RGB')
+        with metrics.span('image_decode'):
+            image = Image.open(io.BytesIO(file_bytes))
+            return image.convert('RGB')
     except Exception as e:
-        os.remove(filepath)
-        raise RuntimeError(f"Invalid image file saved: {e}")
+        raise RuntimeError(f"Invalid image file: {e}")
 
-    image_url = f"/static/uploads/{filename}"
+def process_detection(rfid, image_file_or_b64, weight, sex=None, env_data=None):
+    """Process penguin detection with ML-based molt stage classification."""
+
+    now = datetime.now()
+    file_bytes, ext = read_detection_image(image_file_or_b64)
+    image = decode_image(file_bytes)
+
+    # The upload is already in memory, so the disk write can happen off the critical path
+    filepath, image_url = image_store.locate(file_bytes, ext)
+    write_image_file_async(filepath, file_bytes, image_url)
+
+    model_version = "ESP CAM" if isinstance(image_file_or_b64, str) else "Manual"
+    return process_decoded_detection(rfid, image, image_url, weight, sex, env_data,
+                                     model_version=model_version, now=now)
+
+def run_models(image):
+    """(is_penguin, animal_notes, molting_prob, normal_prob) from the detector and, for penguins, the classifier."""
+    import inference
+
+    with metrics.span('detect_animal'):
+        is_penguin, animal_notes = inference.detect_animal(image)
+    if not is_penguin:
+        return is_penguin, animal_notes, 0.0, 0.0
+    with metrics.span('predict'):
+        molting_prob, normal_prob = inference.predict(image)
+    return is_penguin, animal_notes, molting_prob, normal_prob
+
+@metrics.timed('detection')
+def process_decoded_detection(rfid, image, image_url, weight, sex=None, env_data=None,
+                              model_version="ESP CAM", now=None, scores=None, visit=None):
+    """Run animal detection, molt classification and staging on a decoded RGB image.
+
+    ``scores`` skips the models with precomputed (is_penguin, animal_notes,
+    molting_prob, normal_prob); ``visit`` ({'start', 'end', 'sample_count'})
+    marks the detection as a whole visit rather than a single frame. A
+    near-duplicate frame is staged with its own weight but, unless
+    LOG_DUPLICATE_FRAMES is set, not written: its ``detection_id`` is None
+    and ``source_detection_id`` names the detection its scores came from.
+    """
 
-    # Detect animal type and notes
-    is_penguin, animal_notes = detect_animal(filepath)
+    # Deferred so torch/transformers are only imported once a detection needs them
+    import inference
+
+    now = now or datetime.now()
+    detection_time_str = now.strftime('%Y-%m-%d %H:%M:%S')
+
+    # A near-identical frame of the same penguin scored moments ago gets its scores reused
+    frame_hash = dhash(image) if frame_cache.enabled and scores is None else None
+    reused, frame_distance = (frame_cache.lookup(rfid, frame_hash, now.timestamp())
+                              if frame_hash is not None else (None, None))
+    # Staged with this frame's weight either way; only the logging is skipped
+    logged = not (reused and reused['result'] and not LOG_DUPLICATE_FRAMES)
+
+    if scores is not None:
+        is_penguin, animal_notes, molting_prob, normal_prob = scores
+    elif reused:
+        is_penguin, animal_notes, molting_prob, normal_prob = reused['scores']
+    else:
+        # Detect animal type and notes
+        is_penguin, animal_notes, molting_prob, normal_prob = run_models(image)
+    if reused:
+        metrics.inc('frames_reused_total')
+    metrics.inc('detections_total', result='penguin' if is_penguin else 'not_penguin')
 
     # Initialize defaults for molt detection
-    molting_prob = 0.0
-    normal_prob = 0.0
     molting_prediction = 0
     confidence = 0.0
     stage_name = "Unknown"
@@ -274,7 +249,6 @@ def process_detection(rfid, image_file_or_b64, weight, sex=None, env_data=None):
     daily_change = 0.0
 
     if is_penguin:
-        molting_prob, normal_prob = predict(filepath)
         molting_prediction = int(molting_prob > normal_prob)
         confidence = float(max(molting_prob, normal_prob))
 
@@ -283,15 +257,17 @@ def process_detection(rfid, image_file_or_b64, weight, sex=None, env_data=None):
 
         if molting_prob >= 0.5:
             try:
-                stage_name, stage_confidence = get_molting_stage(
-                    weight=float(weight),
-                    sex=sex,
-                    detection_date=now
-                )
+                with metrics.span('get_molting_stage'):
+                    stage_name, stage_confidence = inference.get_molting_stage(
+                        weight=float(weight),
+                        sex=sex,
+                        detection_date=now
+                    )
                 health = "Molting"
                 notes = f"{animal_notes} | ML Stage Confidence: {stage_confidence:.2f}"
             except Exception as e:
                 print(f"ML stage prediction failed: {str(e)}")
+                metrics.inc('stage_fallbacks_total')
                 if molting_prob < 0.7:
                     stage_name = "Early-molt"
                 else:
@@ -315,53 +291,65 @@ def process_detection(rfid, image_file_or_b64, weight, sex=None, env_data=None):
         status_color = "red"
         notes = animal_notes
 
-    # Database operations
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute(
-        '''INSERT INTO detections (
-            rfid, image_path, detection_time, molting_prediction, confidence, 
-            model_version, processed, weight_kg, stage_name, daily_change, health)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-        (rfid, image_url, detection_time_str, molting_prediction, confidence,
-         "ESP CAM" if isinstance(image_file_or_b64, str) else "Manual",
-         True, weight, stage_name, daily_change, health)
-    )
+    if reused:
+        source = f"detection {reused['result']['detection_id']}" if reused['result'] else "an earlier frame"
+        notes = f"{notes} | Scores reused from {source} (frame distance {frame_distance})"
 
-    penguin = cursor.execute('SELECT * FROM penguins WHERE rfid = ?', (rfid,)).fetchone()
-    if penguin:
-        cursor.execute('''
-            UPDATE penguins
-            SET last_detection_time=?, current_molting_status=?, molting_confidence=?,
-                last_weight=?, sex=COALESCE(?, sex), stage_name=?, daily_change=?, health=?,
-                notes=?
-            WHERE rfid=?
-        ''', (detection_time_str, molting_prediction, confidence, weight, sex,
-              stage_name, daily_change, health, notes, rfid))
-    else:
-        cursor.execute('''
-            INSERT INTO penguins (
-                rfid, last_weight, current_molting_status, molting_confidence,
-                last_detection_time, first_seen, sex, stage_name, daily_change, health,
-                notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (rfid, weight, molting_prediction, confidence, detection_time_str,
-              detection_time_str, sex, stage_name, daily_change, health, notes))
-
-    if env_data:
-        cursor.execute('''
-            INSERT INTO environmental_data (
-                date, temperature, humidity, light_level, pressure)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (detection_time_str, env_data.get('temperature', 0),
-              env_data.get('humidity', 0), env_data.get('light_level', 0),
-              env_data.get('pressure', 0)))
-
-    conn.commit()
-    conn.close()
+    visit = visit or {'start': detection_time_str, 'end': detection_time_str, 'sample_count': 1}
+    detection_id = None
 
-    return {
+    # Database operations
+    if logged:
+        with metrics.span('db_transaction'):
+            conn = get_connection(DB_PATH)
+            cursor = conn.cursor()
+
+            cursor.execute(
+                '''INSERT INTO detections (
+                    rfid, image_path, detection_time, molting_prediction, confidence, 
+                    model_version, processed, weight_kg, stage_name, daily_change, health,
+                    visit_start, visit_end, sample_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (rfid, image_url, detection_time_str, molting_prediction, confidence,
+                 model_version, True, weight, stage_name, daily_change, health,
+                 visit['start'], visit['end'], visit['sample_count'])
+            )
+            detection_id = cursor.lastrowid
+
+            penguin = cursor.execute('SELECT * FROM penguins WHERE rfid = ?', (rfid,)).fetchone()
+            if penguin:
+                cursor.execute('''
+                    UPDATE penguins
+                    SET last_detection_time=?, current_molting_status=?, molting_confidence=?,
+                        last_weight=?, sex=COALESCE(?, sex), stage_name=?, daily_change=?, health=?,
+                        notes=?
+                    WHERE rfid=?
+                ''', (detection_time_str, molting_prediction, confidence, weight, sex,
+                      stage_name, daily_change, health, notes, rfid))
+            else:
+                cursor.execute('''
+                    INSERT INTO penguins (
+                        rfid, last_weight, current_molting_status, molting_confidence,
+                        last_detection_time, first_seen, sex, stage_name, daily_change, health,
+                        notes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (rfid, weight, molting_prediction, confidence, detection_time_str,
+                      detection_time_str, sex, stage_name, daily_change, health, notes))
+
+            if env_data:
+                cursor.execute('''
+                    INSERT INTO environmental_data (
+                        date, temperature, humidity, light_level, pressure)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (detection_time_str, env_data.get('temperature', 0),
+                      env_data.get('humidity', 0), env_data.get('light_level', 0),
+                      env_data.get('pressure', 0)))
+
+            conn.commit()
+            conn.close()
+
+    result = {
+        'detection_id': detection_id,
         'rfid': rfid,
         'image_url': image_url,
         'detection_time': detection_time_str,
@@ -371,18 +359,34 @@ def process_detection(rfid, image_file_or_b64, weight, sex=None, env_data=None):
         'confidence': confidence,
         'weight': weight,
         'sex': sex,
-        'model_version': "ESP CAM" if isinstance(image_file_or_b64, str) else "Manual",
+        'model_version': model_version,
         'stage_name': stage_name,
         'daily_change': daily_change,
         'health': health,
         'status_color': status_color,
-        'notes': notes
+        'notes': notes,
+        'sample_count': visit['sample_count'],
+        'frame_reused': reused is not None,
+        'frame_distance': frame_distance,
+        'source_detection_id': reused['result']['detection_id'] if reused and reused['result'] else None,
+        'logged': logged
     }
+    if frame_hash is not None and not reused:
+        frame_cache.store(rfid, frame_hash, now.timestamp(), {
+            'scores': (is_penguin, animal_notes, molting_prob, normal_prob),
+            'result': result
+        })
+    return result
+
+def publish_esp_data(data):
+    """Make ``data`` the latest ESP32 reading and push it to SSE clients."""
+    global latest_esp_data
+    latest_esp_data = data
+    esp_events.publish(data)
 
 #  ESP32 Endpoints
 @app.route('/api/esp32-live', methods=['POST'])
 def esp32_live():
-    global latest_esp_data, latest_esp_image
     try:
         if request.is_json:
             data = request.get_json()
@@ -390,27 +394,22 @@ def esp32_live():
                 data['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 
             if 'image' in data:
-                image_b64 = data['image']
-                latest_esp_image = image_b64
                 try:
-                    file_bytes = base64.b64decode(image_b64)
-                    filename = f"esp_live_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    with open(filepath, "wb") as f_out:
-                        f_out.write(file_bytes)
-                    data['image_path'] = f"/static/uploads/{filename}"
+                    file_bytes = base64.b64decode(data['image'])
+                    data['frame_etag'] = live_frame.update(file_bytes)
+                    _, data['image_path'] = store_image(file_bytes)
                 except Exception as img_err:
                     print(f"Error saving image: {str(img_err)}")
                     data['image_path'] = None
                 del data['image']
                 
-            latest_esp_data = data
+            publish_esp_data(data)
             if esp_data_queue.full():
                 esp_data_queue.get()
             esp_data_queue.put(data)
             
             if data.get('log_to_db', False):
-                conn = sqlite3.connect(DB_PATH)
+                conn = get_connection(DB_PATH)
                 cursor = conn.cursor()
                 cursor.execute(
                     '''INSERT INTO environmental_data (date, temperature, humidity, light_level, pressure)
@@ -431,18 +430,14 @@ def esp32_live():
             form_data = request.form.to_dict()
             
             if file and allowed_file(file.filename):
-                filename = secure_filename(f"esp_live_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file.filename.rsplit('.', 1)[1].lower()}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
+                img_data = file.read()
+                _, image_url = store_image(img_data, file.filename.rsplit('.', 1)[1])
                 
                 data = form_data
                 data['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                data['image_path'] = f"/static/uploads/{filename}"
-                latest_esp_data = data
-                
-                with open(filepath, 'rb') as img_file:
-                    img_data = img_file.read()
-                    latest_esp_image = base64.b64encode(img_data).decode('utf-8')
+                data['image_path'] = image_url
+                data['frame_etag'] = live_frame.update(img_data, file.mimetype or 'image/jpeg')
+                publish_esp_data(data)
                 
                 if esp_data_queue.full():
                     esp_data_queue.get()
@@ -466,7 +461,7 @@ def get_esp32_live_data():
             response_data = {
                 "success": True,
                 "data": latest_esp_data,
-                "has_image": latest_esp_image is not None
+                "has_image": live_frame.etag is not None
             }
             if 'image_path' in latest_esp_data:
                 response_data['image_path'] = latest_esp_data['image_path']
@@ -478,14 +473,46 @@ def get_esp32_live_data():
 
 @app.route('/api/esp32-live-image', methods=['GET'])
 def get_esp32_live_image():
+    # Kept for older clients; the dashboard uses /api/esp32-live.jpg
     try:
-        if latest_esp_image:
-            return jsonify({"success": True, "image": latest_esp_image})
+        image_b64 = live_frame.base64()
+        if image_b64:
+            return jsonify({"success": True, "image": image_b64})
         else:
             return jsonify({"success": False, "message": "No image available yet"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/esp32-live.jpg', methods=['GET'])
+def get_esp32_live_jpeg():
+    data, etag, content_type, _ = live_frame.snapshot()
+    if data is None:
+        return jsonify({"success": False, "message": "No image available yet"}), 404
+
+    response = Response(data, mimetype=content_type)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Answers If-None-Match with an empty 304 when the viewer already has this frame
+    return response.make_conditional(request)
+
+@app.route('/api/esp32-live.mjpg', methods=['GET'])
+def get_esp32_live_mjpeg():
+    def frame_stream():
+        # A WSGI server only notices a closed connection when it writes, so
+        # an idle camera still gets the current frame (or, before the first
+        # one, a blank preamble line) every MJPEG_IDLE_SECONDS
+        deadline = time.monotonic() + MJPEG_MAX_SECONDS
+        version = 0
+        while time.monotonic() < deadline:
+            data, _, content_type, new_version = live_frame.wait_for_new(version, timeout=MJPEG_IDLE_SECONDS)
+            version = new_version
+            yield mjpeg_part(data, content_type) if data is not None else b'\r\n'
+
+    return Response(frame_stream(),
+                   mimetype="multipart/x-mixed-replace; boundary=frame",
+                   headers={"Cache-Control": "no-cache",
+                            "X-Accel-Buffering": "no"})
+
 @app.route('/api/esp32-live-history', methods=['GET'])
 def get_esp32_live_history():
     try:
@@ -496,37 +523,22 @@ def get_esp32_live_history():
 
 @app.route('/api/esp32-sse')
 def esp32_sse():
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
     def event_stream():
-        client_queue = queue.Queue()
-        esp_clients.append(client_queue)
+        subscription = esp_events.subscribe(last_event_id)
         try:
-            if latest_esp_data:
-                yield f"data: {json.dumps(latest_esp_data)}\n\n"
             while True:
-                try:
-                    data = client_queue.get(timeout=30)
-                    yield f"data: {json.dumps(data)}\n\n"
-                except queue.Empty:
-                    yield ": ping\n\n"
+                frame = subscription.get(timeout=30)
+                yield frame if frame is not None else ": ping\n\n"
         finally:
-            esp_clients.remove(client_queue)
+            esp_events.unsubscribe(subscription)
 
     return Response(event_stream(), 
                    mimetype="text/event-stream", 
                    headers={"Cache-Control": "no-cache", 
                             "X-Accel-Buffering": "no"})
 
-def broadcast_esp_data():
-    while True:
-        if latest_esp_data and esp_clients:
-            for client_queue in esp_clients:
-                if not client_queue.full():
-                    client_queue.put(latest_esp_data)
-        time.sleep(0.5)
-
-broadcast_thread = threading.Thread(target=broadcast_esp_data, daemon=True)
-broadcast_thread.start()
-
 # Main application routes
 @app.route('/detection.html', methods=['GET', 'POST'])
 def detection():
@@ -554,75 +566,366 @@ def detection():
         return redirect(url_for('detection'))
         
     return render_template('detection.html')
+def receive_detection_upload():
+    """Read a detection request's fields and save its image.
+
+    Accepts JSON with ``image_base64`` (the original ESP32 firmware),
+    multipart with an ``image`` file, or the JPEG itself as the body with
+    the fields in X- headers. JSON and multipart requests may send a raw
+    ``adc`` burst instead of ``weight``; its estimate is in
+    ``data['weight_estimate']``. Returns (data, file_bytes, image_url); raises
+    ValueError for a malformed request and RuntimeError if the image
+    cannot be decoded or saved.
+    """
+    content_type = request.mimetype
+    if request.is_json:
+        data = request.get_json()
+        image, image_field = data.get('image_base64'), 'image_base64'
+    elif content_type == 'multipart/form-data':
+        data = request.form.to_dict()
+        image, image_field = request.files.get('image'), 'image'
+    elif content_type in IMAGE_CONTENT_TYPES:
+        data = {field: request.headers.get(header, request.args.get(field))
+                for field, header in DETECTION_HEADERS.items()}
+        data = {field: value for field, value in data.items() if value is not None}
+        image, image_field = request.stream, 'body'
+    else:
+        raise ValueError('Content-Type must be application/json, multipart/form-data or image/jpeg')
+
+    # A raw HX711 burst (JSON list, base64 int32s or an ``adc`` file part) is
+    # filtered here and replaces any weight the ESP32 worked out itself
+    adc = data.pop('adc', None)
+    if adc is None and content_type == 'multipart/form-data' and 'adc' in request.files:
+        adc = request.files['adc'].read()
+
+    # Validate required fields
+    for field in ['rfid'] if adc is not None else ['rfid', 'weight']:
+        if field not in data:
+            raise ValueError(f'Missing required field: {field}')
+    if not image:
+        raise ValueError(f'Missing required field: {image_field}')
+    if image_field == 'image' and not allowed_file(image.filename):
+        raise ValueError('Invalid image file')
+
+    reported_temperature = data.get('temperature') not in (None, '')
+    try:
+        # Form and header values are strings, so go through float for the integer fields
+        if adc is None:
+            data['weight'] = float(data['weight'])
+        data['temperature'] = float(data.get('temperature', 0))
+        data['humidity'] = float(data.get('humidity', 0))
+        data['light'] = int(float(data.get('light', 0)))
+        data['pressure'] = int(float(data.get('pressure', 0)))
+        adc_rate = float(data.pop('adc_rate', 0) or 0) or None
+    except (ValueError, TypeError):
+        raise ValueError('Invalid numeric value')
+
+    if adc is not None:
+        # Converted with the platform's calibration at the temperature it reported
+        platform = data.get('platform') or DEFAULT_PLATFORM
+        grams_per_count, offset_grams = calibrations.coefficients(
+            platform, data['temperature'] if reported_temperature else None)
+        data['weight_estimate'] = {
+            **estimate_weight(decode_adc_burst(adc), adc_rate, grams_per_count, offset_grams),
+            'platform': platform
+        }
+        data['weight'] = data['weight_estimate']['weight_kg']
+
+    # Persist the image now so the job survives a restart; inference runs on a worker
+    if image_field == 'body':
+        try:
+            # Includes reading the body off the socket, which happens as it is written
+            with metrics.span('image_write'):
+                filepath, image_url, file_bytes = image_store.put_stream(
+                    image, IMAGE_CONTENT_TYPES[content_type], max_bytes=MAX_IMAGE_BYTES)
+        except (OSError, ValueError) as e:
+            raise RuntimeError(f"Failed to save image: {e}")
+    else:
+        file_bytes, ext = read_detection_image(image)
+        filepath, image_url = store_image(file_bytes, ext)
+    image_writer.submit(warm_derivatives, image_url, filepath)
+    return data, file_bytes, image_url
+
 @app.route('/api/esp32-detection', methods=['POST'])
 def esp32_detection():
     try:
-        detection_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        if not request.is_json:
-            return jsonify({'error': 'Content-Type must be application/json'}), 400
-        
-        data = request.get_json()
-        
-        # Validate required fields
-        required_fields = ['rfid', 'weight', 'image_base64']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
-        
         try:
-            weight = float(data['weight'])
-            temperature = float(data.get('temperature', 0))
-            humidity = float(data.get('humidity', 0))
-            light_level = int(data.get('light', 0))
-            pressure = int(data.get('pressure', 0))
-        except (ValueError, TypeError):
-            return jsonify({'error': 'Invalid numeric value'}), 400
-
-        # Pass the base64 string directly, do NOT decode here
-        image_base64 = data['image_base64']
-
-        result = process_detection(
+            data, file_bytes, image_url = receive_detection_upload()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        env_data = {
+            'temperature': data['temperature'],
+            'humidity': data['humidity'],
+            'light_level': data['light'],
+            'pressure': data['pressure']
+        }
+
+        if visits.enabled:
+            # Scored (sharpness included) once the penguin leaves; the live view still gets every sample
+            sample_id, visit_samples = visits.add_sample(
+                data['rfid'], data['weight'], image_url, None, data.get('sex'), env_data)
+            publish_esp_data({
+                'rfid': data['rfid'],
+                'weight': data['weight'],
+                'image_path': image_url,
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'visit_samples': visit_samples,
+                'weight_uncertainty': data.get('weight_estimate', {}).get('uncertainty_kg'),
+                **env_data
+            })
+            response = {
+                'success': True,
+                'message': 'Sample added to visit',
+                'sample_id': sample_id,
+                'visit_samples': visit_samples,
+                'status': 'sampling',
+                'status_url': url_for('visit_sample_status', sample_id=sample_id),
+                'image_url': image_url
+            }
+            if 'weight_estimate' in data:
+                response['weight_estimate'] = data['weight_estimate']
+            return jsonify(response), 202
+
+        job_id = detection_jobs.submit(
             rfid=data['rfid'],
-            image_file_or_b64=image_base64,
-            weight=weight,
+            image_path=image_url,
+            weight=data['weight'],
             sex=data.get('sex'),
-            env_data={
-                'temperature': temperature,
-                'humidity': humidity,
-                'light_level': light_level,
-                'pressure': pressure
-            }
+            env_data=env_data,
+            source="ESP CAM",
+            payload=file_bytes
         )
-        
-        # Save/update latest detection data globally (optional)
-        global latest_esp_data
-        latest_esp_data = {
-            'rfid': data['rfid'],
-            'weight': weight,
-            'temperature': temperature,
-            'humidity': humidity,
-            'light_level': light_level,
-            'pressure': pressure,
-            'timestamp': detection_time,
-            'image_path': result.get('image_url', ''),
-            'health': result.get('health', 'Danger'),
-            'stage_name': result.get('stage_name', '--'),
-            'confidence': result.get('confidence', '--'),
-            'is_penguin': result.get('is_penguin', False)
-        }
 
-        return jsonify({
+        response = {
             'success': True,
-            'message': 'Detection processed successfully',
-            'detection_time': detection_time,
-            **result
-        })
+            'message': 'Detection queued for processing',
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': url_for('job_status', job_id=job_id),
+            'image_url': image_url
+        }
+        if 'weight_estimate' in data:
+            response['weight_estimate'] = data['weight_estimate']
+        return jsonify(response), 202
 
     except Exception as e:
         logging.error(f"Unexpected error in ESP32 detection: {str(e)}", exc_info=True)
+        metrics.inc('errors_total', stage='esp32_detection')
         return jsonify({'success': False, 'error': 'Internal server error'}), 500
 
+@app.route('/api/weight-estimate', methods=['POST'])
+def weight_estimate():
+    """Filter a raw HX711 burst without recording anything, for checking a platform.
+
+    Takes JSON ``{"adc": [...], "adc_rate": 80, "platform": ..., "temperature": ...}``
+    or the readings as little-endian int32s in an application/octet-stream
+    body with the other fields as query parameters.
+    """
+    try:
+        fields = request.get_json() if request.is_json else request.args
+        if not isinstance(fields, dict):
+            return jsonify({'error': 'JSON body must be an object'}), 400
+        adc = fields.get('adc') if request.is_json else request.get_data()
+        if not adc:
+            return jsonify({'error': 'Missing required field: adc'}), 400
+        platform = fields.get('platform') or DEFAULT_PLATFORM
+        temperature = fields.get('temperature')
+        grams_per_count, offset_grams = calibrations.coefficients(
+            platform, float(temperature) if temperature not in (None, '') else None)
+        estimate = estimate_weight(decode_adc_burst(adc), float(fields.get('adc_rate') or 0) or None,
+                                   grams_per_count, offset_grams)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, **estimate, 'platform': platform,
+                    'grams_per_count': grams_per_count, 'offset_grams': offset_grams})
+
+@app.route('/api/calibration')
+def calibration_profiles():
+    """The calibration in use for every platform; fitted with ``python calibration.py --save``."""
+    return jsonify({'success': True, 'default_platform': DEFAULT_PLATFORM, 'profiles': calibrations.all()})
+
+@app.route('/api/jobs/<string:job_id>')
+def job_status(job_id):
+    job = detection_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+
+    return jsonify({'success': True, **job})
+
+@app.route('/api/visit-samples/<int:sample_id>')
+def visit_sample_status(sample_id):
+    """A visit sample's state: 'sampling' while the visit is open, then the status of the visit's job."""
+    sample = visits.get_sample(sample_id)
+    if sample is None:
+        return jsonify({'success': False, 'message': 'Sample not found'}), 404
+    if sample['job_id'] is None:
+        return jsonify({'success': True, **sample, 'status': 'sampling'})
+
+    job = detection_jobs.get(sample['job_id'])
+    return jsonify({
+        'success': True,
+        **sample,
+        'status': job['status'] if job else 'closing',  # tagged, job row not written yet
+        'status_url': url_for('job_status', job_id=sample['job_id'])
+    })
+
+def score_visit_frames(rfid, images, now):
+    """(is_penguin, animal_notes, molting_prob, normal_prob) over a visit's best frames.
+
+    Each frame goes through the near-duplicate cache, so a bird that stood
+    still costs one model run. The animal check is a majority vote and the
+    molt probabilities are averaged over the frames judged to be a penguin.
+    """
+    frame_scores = []
+    for image in images:
+        frame_hash = dhash(image) if frame_cache.enabled else None
+        cached, _ = (frame_cache.lookup(rfid, frame_hash, now.timestamp())
+                     if frame_hash is not None else (None, None))
+        if cached:
+            frame_scores.append(cached['scores'])
+            continue
+        scores = run_models(image)
+        if frame_hash is not None:
+            frame_cache.store(rfid, frame_hash, now.timestamp(), {'scores': scores, 'result': None})
+        frame_scores.append(scores)
+
+    penguin_frames = [scores for scores in frame_scores if scores[0]]
+    if len(penguin_frames) * 2 < len(frame_scores):
+        return False, frame_scores[0][1], 0.0, 0.0
+    return (True, penguin_frames[0][1],
+            sum(scores[2] for scores in penguin_frames) / len(penguin_frames),
+            sum(scores[3] for scores in penguin_frames) / len(penguin_frames))
+
+def close_visit(rfid, samples, job_id):
+    """Sessionizer callback: queue one detection job for a finished visit."""
+    # Frames are ranked by the worker; until then the job shows the sharpest already scored, or the first
+    best = max(samples, key=lambda sample: sample['sharpness'] or 0)
+    sex = next((sample['sex'] for sample in reversed(samples) if sample['sex']), None)
+    detection_jobs.submit(
+        rfid=rfid,
+        image_path=best['image_path'],
+        weight=robust_weight([sample['weight_kg'] for sample in samples]),
+        sex=sex,
+        env_data=median_env(samples),
+        source=VISIT_SOURCE,
+        job_id=job_id
+    )
+
+def run_visit_job(job):
+    """Worker handler for a closed visit: score its sharpest frames and save one detection."""
+    samples = visits.samples_for_job(job['id'])
+    scored = {}
+    with metrics.span('sharpness'):
+        for sample in samples:
+            if sample['sharpness'] is not None:
+                continue
+            try:
+                with open(image_store.path_from_url(sample['image_path']), 'rb') as f_in:
+                    sample['sharpness'] = sharpness(Image.open(f_in))
+            except (OSError, TypeError, ValueError):
+                sample['sharpness'] = -1.0  # unreadable: ranked last, skipped below
+            scored[sample['id']] = sample['sharpness']
+    visits.set_sharpness(scored)
+    samples.sort(key=lambda sample: (-sample['sharpness'], sample['sample_time']))  # sharpest first
+
+    frames = []
+    for sample in samples:
+        if len(frames) == VISIT_BEST_FRAMES:
+            break
+        filepath = image_store.path_from_url(sample['image_path'])
+        try:
+            with open(filepath, 'rb') as f_in:
+                frames.append((sample['image_path'], decode_image(f_in.read())))
+        except (OSError, TypeError, RuntimeError) as e:
+            print(f"Skipping unreadable visit frame {sample['image_path']}: {str(e)}")
+    if not frames:
+        raise RuntimeError(f"No readable frames in visit of {job['rfid']}")
+
+    sample_times = [sample['sample_time'] for sample in samples]
+    started = datetime.strptime(min(sample_times), '%Y-%m-%d %H:%M:%S')
+    result = process_decoded_detection(
+        rfid=job['rfid'],
+        image=frames[0][1],
+        image_url=frames[0][0],
+        weight=job['weight_kg'],
+        sex=job['sex'],
+        env_data=job['env_data'],
+        now=started,
+        scores=score_visit_frames(job['rfid'], [image for _, image in frames], started),
+        visit={'start': min(sample_times), 'end': max(sample_times), 'sample_count': len(samples)}
+    )
+    visits.mark_scored(job['id'], result['detection_id'])
+    return result
+
+def load_job_image(job):
+    """Image bytes of a job resumed after a restart or claimed by another process."""
+    if job['source'] == VISIT_SOURCE:
+        return None  # visit jobs read their frames from visit_samples
+    filepath = (image_store.path_from_url(job['image_path'])
+                or os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(job['image_path'])))
+    print(f"Reading image of job {job['id']} from {filepath}")
+    with open(filepath, 'rb') as f_in:
+        return f_in.read()
+
+def run_detection_job(job):
+    """Worker handler: run the full detection pipeline for a queued ESP32 job."""
+    if job['source'] == VISIT_SOURCE:
+        return run_visit_job(job)
+
+    # The blob is content-addressed and may back other detections, so an
+    # undecodable one stays on disk and the job just fails
+    image = decode_image(job['payload'])
+
+    return process_decoded_detection(
+        rfid=job['rfid'],
+        image=image,
+        image_url=job['image_path'],
+        weight=job['weight_kg'],
+        sex=job['sex'],
+        env_data=job['env_data'],
+        model_version=job['source'] or "ESP CAM",
+        now=datetime.strptime(job['submitted_at'], '%Y-%m-%d %H:%M:%S')
+    )
+
+def on_detection_job_complete(job):
+    """Publish a finished job to the live dashboard via the SSE stream."""
+    result = job['result'] or {}
+    env_data = job['env_data'] or {}
+
+    data = {
+        'job_id': job['id'],
+        'job_status': job['status'],
+        'rfid': job['rfid'],
+        'weight': job['weight_kg'],
+        'temperature': env_data.get('temperature', 0),
+        'humidity': env_data.get('humidity', 0),
+        'light_level': env_data.get('light_level', 0),
+        'pressure': env_data.get('pressure', 0),
+        'timestamp': job['submitted_at'],
+        'detection_time': result.get('detection_time', job['submitted_at']),
+        'image_path': result.get('image_url', job['image_path']),
+        'health': result.get('health', 'Danger'),
+        'stage_name': result.get('stage_name', '--'),
+        'confidence': result.get('confidence', '--'),
+        'is_penguin': result.get('is_penguin', False)
+    }
+    if job['status'] == 'failed':
+        data['error'] = job['error']
+
+    publish_esp_data(data)
+
+detection_jobs = DetectionJobQueue(DB_PATH, run_detection_job,
+                                   num_workers=INFERENCE_WORKERS,
+                                   on_complete=on_detection_job_complete,
+                                   load_payload=load_job_image)
+# Groups ESP32 samples into visits; VISIT_GAP_SECONDS=0 scores every sample on its own
+visits = VisitSessionizer(DB_PATH, close_visit)
+metrics.gauge('pending_jobs', detection_jobs.pending_count, 'Detection jobs queued or running')
+metrics.gauge('open_visits', lambda: visits.stats()['open_visits'], 'Penguins currently on a platform')
+
 @app.route('/')
 def home():
     return redirect(url_for('index'))
@@ -644,19 +947,98 @@ def history():
     return render_template('history.html')
 
 # API endpoints
+MAX_PAGE_SIZE = 500  # Upper bound for ?limit= on paginated endpoints
+
+def page_cursor(row, time_col):
+    """Opaque keyset cursor for a row: '<timestamp>|<id>'."""
+    return f"{row[time_col]}|{row['id']}"
+
+def parse_cursor(cursor):
+    timestamp, _, row_id = cursor.rpartition('|')
+    if not timestamp:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return timestamp, int(row_id)
+
+def keyset_page(conn, select, time_col, id_col, where=None, params=(), default_limit=20):
+    """Run ``select`` as one keyset page over (time_col, id_col), newest first.
+
+    Reads ``limit``, ``before``/``after`` (cursors from a previous page) and
+    ``start_date``/``end_date`` (inclusive; dates or timestamps) from the
+    request. Each page is a single index range scan, however deep into the
+    history it is. Returns (rows, pagination), where pagination holds
+    ``next_before`` (older page, None at the end) and ``next_after`` (for
+    polling newer rows).
+    """
+    limit = min(max(int(request.args.get('limit', default_limit)), 1), MAX_PAGE_SIZE)
+    before = request.args.get('before')
+    after = request.args.get('after')
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+
+    where = list(where or [])
+    params = list(params)
+    if before:
+        where.append(f"({time_col}, {id_col}) < (?, ?)")
+        params.extend(parse_cursor(before))
+    if after:
+        where.append(f"({time_col}, {id_col}) > (?, ?)")
+        params.extend(parse_cursor(after))
+    if start_date:
+        where.append(f"{time_col} >= ?")
+        params.append(start_date)
+    if end_date:
+        # A bare date covers the whole day
+        where.append(f"{time_col} <= ?")
+        params.append(end_date + ' 23:59:59' if len(end_date) == 10 else end_date)
+
+    # Walk forwards from an 'after' cursor so the page starts right next to it
+    direction = 'ASC' if after and not before else 'DESC'
+    query = select
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += f" ORDER BY {time_col} {direction}, {id_col} {direction} LIMIT ?"
+    params.append(limit + 1)
+
+    rows = conn.execute(query, params).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == 'ASC':
+        rows.reverse()
+
+    key = time_col.split('.')[-1]
+    older_exists = has_more if direction == 'DESC' else bool(after)
+    return rows, {
+        'limit': limit,
+        'next_before': page_cursor(rows[-1], key) if rows and older_exists else None,
+        'next_after': page_cursor(rows[0], key) if rows else after
+    }
+
+def paginated_json(items, pagination):
+    """JSON list response with the page cursors in X-Next-Before / X-Next-After."""
+    response = jsonify(items)
+    if pagination['next_before']:
+        response.headers['X-Next-Before'] = pagination['next_before']
+    if pagination['next_after']:
+        response.headers['X-Next-After'] = pagination['next_after']
+    return response
 @app.route('/api/penguin/<string:penguin_id>')
 def api_penguin_detail(penguin_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     conn.row_factory = sqlite3.Row
     penguin = conn.execute('SELECT * FROM penguins WHERE rfid = ?', (penguin_id,)).fetchone()
-    detections = conn.execute(
-        '''SELECT d.*, e.temperature, e.humidity, e.light_level, e.pressure 
-           FROM detections d
-           LEFT JOIN environmental_data e ON d.detection_time = e.date
-           WHERE d.rfid = ? 
-           ORDER BY d.detection_time DESC''', 
-        (penguin_id,)
-    ).fetchall()
+    stats = conn.execute('SELECT * FROM penguin_stats WHERE rfid = ?', (penguin_id,)).fetchone()
+    try:
+        detections, pagination = keyset_page(
+            conn,
+            '''SELECT d.*, e.temperature, e.humidity, e.light_level, e.pressure 
+               FROM detections d
+               LEFT JOIN environmental_data e ON d.detection_time = e.date''',
+            'd.detection_time', 'd.id',
+            where=['d.rfid = ?'], params=[penguin_id], default_limit=100
+        )
+    except ValueError as e:
+        conn.close()
+        return jsonify({'success': False, 'message': str(e)}), 400
     conn.close()
 
     if penguin is None:
@@ -665,7 +1047,9 @@ def api_penguin_detail(penguin_id):
     return jsonify({
         'success': True,
         'penguin': dict(penguin),
-        'detections': [dict(d) for d in detections]
+        'stats': dict(stats) if stats else None,
+        'detections': [dict(d, thumbnail_url=thumbnail_url(d['image_path'])) for d in detections],
+        'pagination': pagination
     })
 
 @app.route('/penguin/<string:penguin_id>')
@@ -674,140 +1058,85 @@ def penguin_detail_page(penguin_id):
 
 @app.route('/api/dashboard-stats')
 def dashboard_stats():
-    conn = sqlite3.connect(DB_PATH)
-    total_penguins = conn.execute('SELECT COUNT(*) FROM penguins').fetchone()[0]
-    
-    has_health_column = False
-    columns = conn.execute("PRAGMA table_info(penguins)").fetchall()
-    column_names = [col[1] for col in columns]
-    has_health_column = 'health' in column_names
-
-    if has_health_column:
-        healthy_today = conn.execute('''
-            SELECT COUNT(*) FROM penguins 
-            WHERE health = 'Healthy'
-            AND date(last_detection_time) = date('now')
-        ''').fetchone()[0]
-        molting = conn.execute('SELECT COUNT(*) FROM penguins WHERE health = "Molting"').fetchone()[0]
-        needs_attention = conn.execute('''
-            SELECT COUNT(*) FROM penguins 
-            WHERE health IN ('Underweight', 'Rapid Weight Loss')
-        ''').fetchone()[0]
-        danger = conn.execute('''
-            SELECT COUNT(*) FROM penguins 
-            WHERE health = 'Not a Danger'
-        ''').fetchone()[0]
-    else:
-        healthy_today = conn.execute('''
-            SELECT COUNT(*) FROM penguins 
-            WHERE current_molting_status = 0 
-            AND date(last_detection_time) = date('now')
-        ''').fetchone()[0]
-        molting = conn.execute('SELECT COUNT(*) FROM penguins WHERE current_molting_status = 1').fetchone()[0]
-        needs_attention = conn.execute('''
-            SELECT COUNT(*) FROM penguins 
-            WHERE (last_weight < 3.5) OR (current_molting_status = 1 AND molting_confidence > 0.7)
-        ''').fetchone()[0]
-        danger = 0  # Can't determine without health column
-
-    has_detection_columns = False
-    detection_columns = conn.execute("PRAGMA table_info(detections)").fetchall()
-    detection_column_names = [col[1] for col in detection_columns]
-    has_detection_columns = all(col in detection_column_names for col in ['weight_kg', 'stage_name', 'daily_change', 'health'])
-
-    if has_detection_columns:
-        recent_detections = conn.execute('''
-            SELECT d.rfid, d.detection_time, d.molting_prediction, d.weight_kg, d.stage_name, d.daily_change, d.health
-            FROM detections d
-            ORDER BY d.detection_time DESC
-            LIMIT 5
-        ''').fetchall()
-    else:
-        recent_detections = conn.execute('''
-            SELECT d.rfid, d.detection_time, d.molting_prediction, p.last_weight
-            FROM detections d
-            JOIN penguins p ON d.rfid = p.rfid
-            ORDER BY d.detection_time DESC
-            LIMIT 5
-        ''').fetchall()
-
-    env_data = None
-    tables = conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
-    table_names = [table[0] for table in tables]
-
-    if 'environmental_data' in table_names:
-        env_data = conn.execute('''
-            SELECT * FROM environmental_data
-            ORDER BY date DESC
-            LIMIT 1
-        ''').fetchone()
-
+    conn = get_connection(DB_PATH)
+    # Counts and the latest reading are maintained by triggers on write (see db.py)
+    summary = read_dashboard_summary(conn)
+    recent_detections = conn.execute('''
+        SELECT d.rfid, d.detection_time, d.molting_prediction, d.weight_kg, d.stage_name, d.daily_change, d.health
+        FROM detections d
+        ORDER BY d.detection_time DESC
+        LIMIT 5
+    ''').fetchall()
     conn.close()
 
     response = {
-        'total_penguins': total_penguins,
-        'healthy_today': healthy_today,
-        'molting': molting,
-        'needs_attention': needs_attention,
-        'danger': danger,
+        'total_penguins': summary['total_penguins'],
+        'healthy_today': summary['healthy_today'],
+        'molting': summary['molting'],
+        'needs_attention': summary['underweight'] + summary['rapid_weight_loss'],
+        'danger': summary['danger'],
         'recent_detections': [
             {
-                'rfid': row[0],
-                'detection_time': row[1],
-                'molting_prediction': bool(row[2]),
-                'weight_kg': row[3],
-                'stage_name': row[4] if len(row) > 4 else 'Unknown',
-                'daily_change': row[5] if len(row) > 5 else 0,
-                'health': row[6] if len(row) > 6 else 'Unknown'
+                'rfid': row['rfid'],
+                'detection_time': row['detection_time'],
+                'molting_prediction': bool(row['molting_prediction']),
+                'weight_kg': row['weight_kg'],
+                'stage_name': row['stage_name'],
+                'daily_change': row['daily_change'],
+                'health': row['health']
             } for row in recent_detections
         ]
     }
 
-    if env_data:
+    if summary['env_date']:
         response['latest_env_data'] = {
-            'temperature': env_data[1] if env_data else None,
-            'humidity': env_data[2] if env_data else None,
-            'light_level': env_data[3] if env_data else None,
-            'pressure': env_data[4] if env_data else None
+            'date': summary['env_date'],
+            'temperature': summary['temperature'],
+            'humidity': summary['humidity'],
+            'light_level': summary['light_level'],
+            'pressure': summary['pressure']
         }
 
     return jsonify(response)
 @app.route('/api/recent-detections')
 def recent_detections():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     conn.row_factory = sqlite3.Row
     
     # Query to get recent detections with status color calculation
-    detections = conn.execute('''
-        SELECT 
-            d.*, 
-            p.sex,
-            p.notes as animal_notes,
-            d.model_version as detection_type,  
-            CASE 
-                WHEN d.health IN ('Underweight', 'Rapid Weight Loss') THEN 'red'
-                WHEN d.health = 'Molting' THEN 'orange'
-                WHEN d.health = 'Healthy' THEN 'green'
-                WHEN d.health = 'Danger' THEN 'red'
-                ELSE 'black'
-            END as status_color,
-            CASE
-                WHEN d.stage_name = 'Not a Penguin' THEN 0
-                ELSE 1
-            END as is_penguin
-        FROM detections d
-        LEFT JOIN penguins p ON d.rfid = p.rfid
-        ORDER BY d.detection_time DESC
-        LIMIT 20
-    ''').fetchall()
+    try:
+        detections, pagination = keyset_page(conn, '''
+            SELECT 
+                d.*, 
+                p.sex,
+                p.notes as animal_notes,
+                d.model_version as detection_type,  
+                CASE 
+                    WHEN d.health IN ('Underweight', 'Rapid Weight Loss') THEN 'red'
+                    WHEN d.health = 'Molting' THEN 'orange'
+                    WHEN d.health = 'Healthy' THEN 'green'
+                    WHEN d.health = 'Danger' THEN 'red'
+                    ELSE 'black'
+                END as status_color,
+                CASE
+                    WHEN d.stage_name = 'Not a Penguin' THEN 0
+                    ELSE 1
+                END as is_penguin
+            FROM detections d
+            LEFT JOIN penguins p ON d.rfid = p.rfid''',
+            'd.detection_time', 'd.id', default_limit=20)
+    except ValueError as e:
+        conn.close()
+        return jsonify({'success': False, 'error': str(e)}), 400
     
     conn.close()
 
-    return jsonify([
+    return paginated_json([
         {
             'id': row['id'],
             'rfid': row['rfid'],
             'image_path': row['image_path'],
+            'thumbnail_url': thumbnail_url(row['image_path']),
             'detection_time': row['detection_time'],
             'molting_prediction': bool(row['molting_prediction']),
             'confidence': row['confidence'],
@@ -817,6 +1146,9 @@ def recent_detections():
             'stage_name': row['stage_name'],
             'daily_change': row['daily_change'],
             'health': row['health'],
+            'sample_count': row['sample_count'],
+            'visit_start': row['visit_start'],
+            'visit_end': row['visit_end'],
             'sex': row['sex'],
             'status_color': row['status_color'],
             'detection_type': row['detection_type'],
@@ -824,16 +1156,20 @@ def recent_detections():
             'animal_notes': row['animal_notes'] if 'animal_notes' in row.keys() else ''
         } 
         for row in detections
-    ])
+    ], pagination)
 
 @app.route('/api/penguins')
 def api_penguins():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     conn.row_factory = sqlite3.Row
+    # Aggregates are maintained by triggers on detections (see db.py penguin_stats)
     penguins = conn.execute('''
     SELECT p.*,
-    (SELECT COUNT(*) FROM detections d WHERE d.rfid = p.rfid) as detection_count
+        COALESCE(s.detection_count, 0) as detection_count,
+        s.first_weight, s.first_weight_time, s.last_weight AS last_weighed, s.last_weight_time,
+        s.min_weight, s.max_weight, s.last_molt_stage
     FROM penguins p
+    LEFT JOIN penguin_stats s ON s.rfid = p.rfid
     ORDER BY p.last_detection_time DESC
     ''').fetchall()
     conn.close()
@@ -851,7 +1187,14 @@ def api_penguins():
             'stage_name': row['stage_name'] if 'stage_name' in row.keys() else '',
             'daily_change': row['daily_change'] if 'daily_change' in row.keys() else 0,
             'health': row['health'] if 'health' in row.keys() else '',
-            'detection_count': row['detection_count'] if 'detection_count' in row.keys() else 0
+            'detection_count': row['detection_count'],
+            'first_weight': row['first_weight'],
+            'first_weight_time': row['first_weight_time'],
+            'last_weighed': row['last_weighed'],
+            'last_weight_time': row['last_weight_time'],
+            'min_weight': row['min_weight'],
+            'max_weight': row['max_weight'],
+            'last_molt_stage': row['last_molt_stage']
         } for row in penguins
     ])
 
@@ -866,7 +1209,7 @@ def update_penguin():
         if not rfid:
             return jsonify({'success': False, 'error': 'RFID is required'}), 400
             
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         cursor = conn.cursor()
         penguin = cursor.execute('SELECT * FROM penguins WHERE rfid = ?', (rfid,)).fetchone()
         
@@ -900,84 +1243,160 @@ def update_penguin():
             'error': str(e)
         }), 500
 
+@app.route('/api/restage', methods=['POST'])
+def restage():
+    """Re-score the molt stage of all (or one penguin's) molting detections."""
+    try:
+        engine = registry.get('molt_stage')
+        summary = restage_detections(
+            DB_PATH, engine,
+            rfid=request.values.get('rfid') or None,
+            dry_run=request.values.get('dry_run', '').lower() in ('1', 'true', 'yes')
+        )
+        return jsonify({'success': True, **summary})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/environmental-data')
 def environmental_data():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     conn.row_factory = sqlite3.Row
-    env_data = conn.execute('''
-    SELECT * FROM environmental_data
-    ORDER BY date DESC
-    LIMIT 50
-    ''').fetchall()
+    try:
+        env_data, pagination = keyset_page(conn, 'SELECT * FROM environmental_data', 'date', 'id',
+                                           default_limit=50)
+    except ValueError as e:
+        conn.close()
+        return jsonify({'success': False, 'error': str(e)}), 400
     conn.close()
 
-    return jsonify([dict(row) for row in env_data])
+    return paginated_json([dict(row) for row in env_data], pagination)
+
+EXPORT_FIELDS = [name for name, _ in DETECTION_EXPORT_COLUMNS]
+EXPORT_CHUNK_ROWS = 500  # Rows per chunk written to the response stream
+
+def export_query(args):
+    """Build the export SELECT from request filters.
+
+    Supports penguin_id, start_date/end_date (inclusive; dates or
+    timestamps) and comma-separated health and stage lists. Columns come
+    back in EXPORT_FIELDS order.
+    """
+    query = '''
+        SELECT d.id, d.rfid, d.detection_time, d.image_path, d.molting_prediction,
+               d.confidence, d.weight_kg, d.stage_name, d.daily_change, d.health,
+               p.sex, p.notes as penguin_notes
+        FROM detections d
+        LEFT JOIN penguins p ON d.rfid = p.rfid
+    '''
+    where, params = [], []
+
+    if args.get('penguin_id'):
+        where.append('d.rfid = ?')
+        params.append(args['penguin_id'])
+    if args.get('start_date'):
+        where.append('d.detection_time >= ?')
+        params.append(args['start_date'])
+    if args.get('end_date'):
+        end_date = args['end_date']
+        where.append('d.detection_time <= ?')
+        params.append(end_date + ' 23:59:59' if len(end_date) == 10 else end_date)
+    for arg, column in (('health', 'd.health'), ('stage', 'd.stage_name')):
+        values = [v.strip() for v in args.get(arg, '').split(',') if v.strip()]
+        if values:
+            where.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ORDER BY d.detection_time DESC'
+    return query, params
+
+def stream_export_rows(conn, cursor, first_row, file_format):
+    """Yield the export file in chunks straight from the open cursor.
+
+    Only EXPORT_CHUNK_ROWS rows are held at a time; the pooled connection
+    goes back to the pool when the stream finishes or the client goes away.
+    """
+    molting_idx = EXPORT_FIELDS.index('molting_prediction')
+    buffer = io.StringIO()
+    if file_format == 'csv':
+        writer = csv.writer(buffer)
+        write_row = writer.writerow
+    else:
+        write_row = lambda row: buffer.write('\t'.join(str(value) for value in row) + '\n')
+
+    try:
+        write_row(EXPORT_FIELDS)
+        row = first_row
+        while row is not None:
+            for row in [row] + cursor.fetchmany(EXPORT_CHUNK_ROWS - 1):
+                row = list(row)
+                row[molting_idx] = 'Yes' if row[molting_idx] else 'No'
+                write_row(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            row = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+
+def export_detections_columnar(file_format, penguin_id):
+    """Typed Parquet / Arrow export, spooled to a temporary file then sent.
+
+    Both formats end with a footer, so the file is written chunk by chunk
+    to disk rather than memory and streamed from there.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return jsonify({'success': False, 'error': f'{file_format} export needs pyarrow installed'}), 501
+
+    query, params = export_query(request.args)
+    output = tempfile.TemporaryFile()
+    conn = get_connection(DB_PATH)
+    try:
+        rows = write_columnar(conn.execute(query, params), DETECTION_EXPORT_COLUMNS, output, file_format)
+    finally:
+        conn.close()
+
+    if rows == 0:
+        output.close()
+        return jsonify({'success': False, 'error': 'No detections found'}), 404
+
+    output.seek(0)
+    extension, mimetype = COLUMNAR_FORMATS[file_format]
+    return send_file(output, mimetype=mimetype, as_attachment=True,
+                     download_name=f'detections_{penguin_id or "all"}.{extension}')
 
 @app.route('/api/export-detections', methods=['GET'])
 def export_detections():
     try:
         file_format = request.args.get('format', 'csv').lower()
         penguin_id = request.args.get('penguin_id', None)
-        
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        
-        query = '''
-            SELECT d.*, p.sex, p.notes as penguin_notes 
-            FROM detections d
-            LEFT JOIN penguins p ON d.rfid = p.rfid
-        '''
-        params = []
-        
-        if penguin_id:
-            query += ' WHERE d.rfid = ?'
-            params.append(penguin_id)
-            
-        query += ' ORDER BY d.detection_time DESC'
-        
-        detections = conn.execute(query, params).fetchall()
-        conn.close()
-        
-        if not detections:
+
+        if file_format in COLUMNAR_FORMATS:
+            return export_detections_columnar(file_format, penguin_id)
+        if file_format not in ('csv', 'txt'):
+            return jsonify({'success': False, 'error': 'Invalid format specified'}), 400
+
+        query, params = export_query(request.args)
+        conn = get_connection(DB_PATH)
+        cursor = conn.execute(query, params)
+        first_row = cursor.fetchone()
+
+        if first_row is None:
+            cursor.close()
+            conn.close()
             return jsonify({'success': False, 'error': 'No detections found'}), 404
-        
-        fieldnames = [
-            'id', 'rfid', 'detection_time', 'image_path', 'molting_prediction',
-            'confidence', 'weight_kg', 'stage_name', 'daily_change', 'health',
-            'sex', 'penguin_notes'
-        ]
-        
-        if file_format == 'csv':
-            output = io.StringIO()
-            writer = csv.DictWriter(output, fieldnames=fieldnames)
-            writer.writeheader()
-            
-            for detection in detections:
-                row = {field: detection[field] for field in fieldnames}
-                row['molting_prediction'] = 'Yes' if row['molting_prediction'] else 'No'
-                writer.writerow(row)
-            
-            response = make_response(output.getvalue())
-            response.headers['Content-Disposition'] = f'attachment; filename=detections_{penguin_id or "all"}.csv'
-            response.headers['Content-Type'] = 'text/csv'
-            return response
-            
-        elif file_format == 'txt':
-            output = io.StringIO()
-            output.write('\t'.join(fieldnames) + '\n')
-            
-            for detection in detections:
-                row = [str(detection[field]) for field in fieldnames]
-                row[fieldnames.index('molting_prediction')] = 'Yes' if detection['molting_prediction'] else 'No'
-                output.write('\t'.join(row) + '\n')
-            
-            response = make_response(output.getvalue())
-            response.headers['Content-Disposition'] = f'attachment; filename=detections_{penguin_id or "all"}.txt'
-            response.headers['Content-Type'] = 'text/plain'
-            return response
-            
-        return jsonify({'success': False, 'error': 'Invalid format specified'}), 400
-        
+
+        response = Response(
+            stream_with_context(stream_export_rows(conn, cursor, first_row, file_format)),
+            mimetype='text/csv' if file_format == 'csv' else 'text/plain'
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename=detections_{penguin_id or "all"}.{file_format}'
+        return response
+
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 @app.route('/upload', methods=['POST'])
@@ -994,26 +1413,20 @@ def handle_upload():
             return jsonify({"error": "No selected file"}), 400
             
         if file and allowed_file(file.filename):
-            # Secure the filename and save to upload folder
-            filename = secure_filename(f"esp32_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg")
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            # Stored under its content hash, so a repeated upload reuses the same file
+            _, image_url = store_image(file.read(), file.filename.rsplit('.', 1)[1])
             
             # Process any additional form data
             weight = request.form.get('weight', 0)
             rfid = request.form.get('rfid', 'unknown')
             
-            # Create response data
-            image_url = f"/static/uploads/{filename}"
-            
             # Broadcast to SSE clients
-            global latest_esp_data
-            latest_esp_data = {
+            publish_esp_data({
                 'image_path': image_url,
                 'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                 'weight': weight,
                 'rfid': rfid
-            }
+            })
             
             return jsonify({
                 "success": True,
@@ -1025,5 +1438,163 @@ def handle_upload():
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+@app.route('/images/<string:variant>/<path:source>')
+def derived_image(variant, source):
+    """Resized copy of /static/<source>, built on first request and cached on disk."""
+    if variant not in DERIVED_VARIANTS:
+        return jsonify({'success': False, 'message': f'Unknown image variant: {variant}'}), 404
+
+    source_url = f"/static/{source}"
+    # Store URLs name their content, so their derivatives never change; a
+    # legacy upload can be overwritten, so browsers revalidate those
+    store_path = image_store.path_from_url(source_url)
+    immutable = store_path is not None
+    source_path = store_path or safe_join(app.static_folder, source)
+    if not source_path or not os.path.isfile(source_path):
+        return jsonify({'success': False, 'message': 'Image not found'}), 404
+
+    try:
+        path = derived_images.get(variant, source_url, source_path, immutable=immutable)
+    except OSError as e:
+        return jsonify({'success': False, 'message': f'Could not resize image: {e}'}), 422
+
+    response = send_file(os.path.abspath(path), mimetype='image/jpeg', conditional=True,
+                         max_age=31536000 if immutable else 0)
+    response.cache_control.immutable = immutable
+    return response
+
+@app.route('/api/health')
+def health():
+    models_status = registry.status()
+    ready = all(status['loaded'] for status in models_status.values())
+    failed = any(status['error'] for status in models_status.values())
+
+    return jsonify({
+        'success': True,
+        'status': 'ready' if ready else ('degraded' if failed else 'loading'),
+        'ready': ready,
+        'model_loading': MODEL_LOADING,
+        'models': models_status,
+        'pending_jobs': detection_jobs.pending_count(),
+        'sse': esp_events.stats(),
+        'frame_cache': frame_cache.stats(),
+        'visits': visits.stats(),
+        'derived_images': derived_images.stats(),
+        'stage_latency': metrics.stages()
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms, p50/p95/p99 and detection counters."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def start_background_workers():
+    """Start the inference workers and the visit closer in the process that serves requests.
+
+    Not done at import, so a process that never serves (the debug
+    reloader's parent, a gunicorn --preload master, the benchmarks) runs
+    no jobs. Safe to call more than once.
+    """
+    detection_jobs.start()
+    visits.start()
+
+@app.before_request
+def ensure_background_workers():
+    # For WSGI servers pointed at hi:app rather than create_app()
+    if not detection_jobs.started:
+        start_background_workers()
+
+def create_app():
+    """WSGI app factory: ``gunicorn 'hi:create_app()'``."""
+    start_background_workers()
+    return app
+
+def start_model_loading(mode):
+    """Load the inference models now (eager), on a warm-up thread (background) or on first use (lazy)."""
+    global MODEL_LOADING
+
+    def warm_up():
+        import inference
+        inference.warm_up()
+
+    if mode == 'eager':
+        warm_up()
+    elif mode == 'background':
+        threading.Thread(target=warm_up, name="model-warm-up", daemon=True).start()
+    elif mode != 'lazy':
+        raise ValueError(f"Unknown model loading mode: {mode}")
+    MODEL_LOADING = mode
+
+def benchmark_ingest(runs=200, width=640, height=480):
+    """Compare request size and server CPU of the three detection upload formats.
+
+    Builds one synthetic ESP32-CAM sized JPEG, then times
+    ``receive_detection_upload`` (body parsing, decoding and the image
+    write) for each format. Images go to a temporary image store and no
+    inference job is queued.
+    """
+    global image_store, INGEST_VARIANTS
+    import numpy as np
+    from werkzeug.test import EnvironBuilder
+
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    pixels = gradient + np.random.default_rng(0).normal(0, 12, (height, width, 3))
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype('uint8')).save(buffer, 'JPEG', quality=80)
+    jpeg = buffer.getvalue()
+
+    fields = {'rfid': 'PENG001', 'weight': '3.45', 'sex': 'F', 'temperature': '18.5',
+              'humidity': '71.0', 'light': '512', 'pressure': '1013.25'}
+    formats = {
+        'json/base64': lambda: EnvironBuilder(method='POST', json={
+            **fields, 'image_base64': 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode('ascii')}),
+        'multipart': lambda: EnvironBuilder(method='POST', data={
+            **fields, 'image': (io.BytesIO(jpeg), 'capture.jpg', 'image/jpeg')}),
+        'image/jpeg': lambda: EnvironBuilder(method='POST', data=jpeg, content_type='image/jpeg', headers={
+            DETECTION_HEADERS[field]: value for field, value in fields.items()}),
+    }
+
+    saved_store, saved_variants = image_store, INGEST_VARIANTS
+    with tempfile.TemporaryDirectory() as tmp:
+        image_store, INGEST_VARIANTS = ImageStore(tmp), ()
+        try:
+            print(f"JPEG: {len(jpeg)} bytes, {runs} requests per format")
+            for name, build in formats.items():
+                cpu = 0.0
+                for _ in range(runs):
+                    environ = build().get_environ()
+                    body_size = int(environ['CONTENT_LENGTH'])
+                    header_size = sum(len(k) + len(str(v)) + 4 for k, v in environ.items()
+                                      if k.startswith('HTTP_') or k.startswith('CONTENT_'))
+                    with app.request_context(environ):
+                        start = time.process_time()
+                        _, file_bytes, _ = receive_detection_upload()
+                        cpu += time.process_time() - start
+                    assert file_bytes == jpeg
+                print(f"{name:>12}: {body_size + header_size:>8} bytes/request "
+                      f"(body {body_size}), {cpu / runs * 1000:.3f} ms CPU/detection")
+        finally:
+            image_store, INGEST_VARIANTS = saved_store, saved_variants
+
 if __name__ == '__main__':
-     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Penguin molt detection dashboard")
+    parser.add_argument('--model-loading', choices=['eager', 'background', 'lazy'], default=MODEL_LOADING,
+                        help='Load models at startup, on a warm-up thread, or on first detection')
+    parser.add_argument('--benchmark-ingest', action='store_true',
+                        help='Compare JSON/base64, multipart and raw JPEG detection uploads, then exit')
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.benchmark_ingest:
+        benchmark_ingest(args.runs)
+    else:
+        start_model_loading(args.model_loading)
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            # The reloader's child serves; its parent only watches files
+            start_background_workers()
+        app.run(host='0.0.0.0', port=5000, debug=True)
+else:
+    # Imported by a WSGI server: use the MODEL_LOADING environment setting
+    start_model_loading(MODEL_LOADING)
\ No newline at end of file
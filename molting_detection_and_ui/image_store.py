@@ -0,0 +1,242 @@
+# image_store.py
+
+import hashlib
+import os
+import re
+import tempfile
+
+IMAGE_DIR = os.environ.get('IMAGE_DIR', os.path.join('static', 'images'))  # Store root, served under /static
+IMAGE_URL_PREFIX = '/static/images'
+SHARD_LEVELS = 2  # ab/cd/abcd...jpg: 65,536 leaf directories
+SHARD_WIDTH = 2
+# Names the app gave uploads before the store: <rfid|esp_live|esp32>_YYYYmmdd_HHMMSS.<ext>.
+# Anything else in static/ (placeholders, silhouettes) is a page asset and is left alone.
+LEGACY_UPLOAD_NAME = re.compile(r'_\d{8}_\d{6}\.(jpe?g|png)$', re.IGNORECASE)
+
+IMAGE_PATH_TABLES = ('detections', 'detection_jobs', 'visit_samples')  # Columns repointed by migrate_static
+
+
+class ImageStore:
+    """Content-addressed image files.
+
+    An image is stored once under the SHA-256 of its bytes, in
+    ``<root>/<h[0:2]>/<h[2:4]>/<h>.<ext>``. Uploading the same bytes again
+    (an ESP32 retry, a re-sent frame) returns the existing file, two
+    different frames can never overwrite each other, and no directory grows
+    past a few entries however many images are kept. Files are written to
+    a temporary name and renamed into place, so a reader never sees a
+    partial image.
+    """
+
+    def __init__(self, root=IMAGE_DIR, url_prefix=IMAGE_URL_PREFIX):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def _relative(self, digest, ext):
+        shards = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+        return shards + [f"{digest}.{normalise_extension(ext)}"]
+
+    def path_for(self, digest, ext='jpg'):
+        return os.path.join(self.root, *self._relative(digest, ext))
+
+    def url_for(self, digest, ext='jpg'):
+        return '/'.join([self.url_prefix] + self._relative(digest, ext))
+
+    def locate(self, data, ext='jpg'):
+        """Return (filepath, image_url) for ``data`` without writing it."""
+        digest = self.digest(data)
+        return self.path_for(digest, ext), self.url_for(digest, ext)
+
+    def write(self, filepath, data):
+        """Write ``data`` to its content path; returns False if it was already stored."""
+        if os.path.exists(filepath):
+            return False
+        directory = os.path.dirname(filepath)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f_out:
+                f_out.write(data)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return True
+
+    def put(self, data, ext='jpg'):
+        """Store ``data``; returns (filepath, image_url, created)."""
+        filepath, image_url = self.locate(data, ext)
+        return filepath, image_url, self.write(filepath, data)
+
+    def put_stream(self, stream, ext='jpg', max_bytes=None, chunk_size=64 * 1024):
+        """Store a file-like body read in chunks, hashing it as it is written.
+
+        Returns (filepath, image_url, data); the bytes are kept because the
+        caller usually needs them next. Raises ValueError for an empty or
+        oversized body.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        hasher, chunks, size = hashlib.sha256(), [], 0
+        try:
+            with os.fdopen(fd, 'wb') as f_out:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise ValueError(f"Image larger than {max_bytes} bytes")
+                    hasher.update(chunk)
+                    f_out.write(chunk)
+                    chunks.append(chunk)
+            if not size:
+                raise ValueError("Empty image body")
+
+            digest = hasher.hexdigest()
+            filepath = self.path_for(digest, ext)
+            if os.path.exists(filepath):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                os.replace(tmp_path, filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return filepath, self.url_for(digest, ext), b''.join(chunks)
+
+    def path_from_url(self, image_url):
+        """Filesystem path of a stored image URL, or None if it is not in this store."""
+        if not image_url or not image_url.startswith(self.url_prefix + '/'):
+            return None
+        parts = image_url[len(self.url_prefix) + 1:].split('/')
+        if len(parts) != SHARD_LEVELS + 1 or any(part in ('', '.', '..') for part in parts):
+            return None
+        return os.path.join(self.root, *parts)
+
+    def digest_from_url(self, image_url):
+        path = self.path_from_url(image_url)
+        return os.path.splitext(os.path.basename(path))[0] if path else None
+
+
+def normalise_extension(ext):
+    ext = (ext or 'jpg').lower().lstrip('.')
+    return 'jpg' if ext == 'jpeg' else ext
+
+
+def legacy_image_paths(image_url, static_dir='static'):
+    """Candidate files for a pre-store ``/static/...`` URL.
+
+    Uploads were recorded as ``/static/uploads/<name>`` but some trees only
+    have them flat in ``static/``, so both places are tried.
+    """
+    if not image_url or not image_url.startswith('/static/'):
+        return []
+    relative = image_url[len('/static/'):]
+    candidates = [os.path.join(static_dir, *relative.split('/'))]
+    flat = os.path.join(static_dir, os.path.basename(relative))
+    if flat not in candidates:
+        candidates.append(flat)
+    return candidates
+
+
+def migrate_static(db_path, static_dir='static', store=None, remove_originals=False, dry_run=False):
+    """Move existing ``static/`` images into the store and repoint the database.
+
+    Upload-named images in ``static_dir`` and ``static_dir/uploads`` are
+    hashed and stored; ``image_path`` values in ``IMAGE_PATH_TABLES`` that
+    point at a migrated file are rewritten to its content URL in one
+    transaction. Originals are kept
+    unless ``remove_originals`` is set. Returns a dict of counts.
+    """
+    from db import get_connection, migrate
+
+    store = store or ImageStore(os.path.join(static_dir, 'images'))
+    stats = {'files': 0, 'stored': 0, 'already_stored': 0, 'duplicates': 0, 'bytes_saved': 0,
+             'rows_updated': 0, 'missing': 0, 'removed': 0}
+
+    new_urls = {}  # absolute original path -> content URL
+    seen = set()
+    for directory in (static_dir, os.path.join(static_dir, 'uploads')):
+        if not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if not LEGACY_UPLOAD_NAME.search(filename) or not os.path.isfile(path):
+                continue
+            ext = filename.rsplit('.', 1)[1]
+            with open(path, 'rb') as f_in:
+                data = f_in.read()
+            filepath, image_url = store.locate(data, ext)
+            stats['files'] += 1
+            if image_url in seen:
+                stats['duplicates'] += 1
+                stats['bytes_saved'] += len(data)
+            elif os.path.exists(filepath):
+                stats['already_stored'] += 1
+            else:
+                stats['stored'] += 1
+                if not dry_run:
+                    store.write(filepath, data)
+            new_urls[os.path.abspath(path)] = image_url
+            seen.add(image_url)
+
+    conn = get_connection(db_path)
+    try:
+        migrate(conn)
+        conn.execute('BEGIN IMMEDIATE')
+        for table in IMAGE_PATH_TABLES:
+            updates = []
+            for row_id, image_url in conn.execute(f"SELECT id, image_path FROM {table}").fetchall():
+                if not image_url or store.path_from_url(image_url):
+                    continue
+                for candidate in legacy_image_paths(image_url, static_dir):
+                    new_url = new_urls.get(os.path.abspath(candidate))
+                    if new_url:
+                        updates.append((new_url, row_id))
+                        break
+                else:
+                    stats['missing'] += 1
+            conn.executemany(f"UPDATE {table} SET image_path = ? WHERE id = ?", updates)
+            stats['rows_updated'] += len(updates)
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if remove_originals and not dry_run:
+        for path in new_urls:
+            os.remove(path)
+            stats['removed'] += 1
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import DB_PATH
+
+    parser = argparse.ArgumentParser(description="Move static/ images into the content-addressed image store")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--static', default='static', help='Directory holding the existing images')
+    parser.add_argument('--remove-originals', action='store_true',
+                        help='Delete the old files once the database points at the store')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    args = parser.parse_args()
+
+    stats = migrate_static(args.db, args.static, remove_originals=args.remove_originals, dry_run=args.dry_run)
+    print(f"{stats['files']} images: {stats['stored']} stored, {stats['already_stored']} already in the store, "
+          f"{stats['duplicates']} duplicates ({stats['bytes_saved'] / 1024:.1f} KB saved)")
+    print(f"{stats['rows_updated']} rows repointed, {stats['missing']} rows reference files not found, "
+          f"{stats['removed']} originals removed")
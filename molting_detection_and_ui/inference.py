@@ -0,0 +1,193 @@
+# inference.py
+
+import os
+import threading
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torchvision import transforms, models
+from transformers import OwlViTProcessor, OwlViTForObjectDetection
+from transformers.models.owlvit.modeling_owlvit import OwlViTObjectDetectionOutput
+
+from batching import MicroBatcher
+from molt_stage_engine import build_features, encode_sex
+from model_registry import registry
+
+# Model paths
+OWLVIT_PATH = "./owlvit-local"
+MODEL_PATH = r"C:\Users\MKHIN\Downloads\Design Project\penguin_project_code\checkponts\checkpoints\best_model_fold4.pt"
+
+VGG_MAX_BATCH_SIZE = int(os.environ.get('VGG_MAX_BATCH_SIZE', 8))  # Images per VGG16 forward pass
+VGG_MAX_WAIT_MS = float(os.environ.get('VGG_MAX_WAIT_MS', 20))     # Max time to wait for a batch to fill
+
+# Define animal categories we want to detect
+ANIMAL_CATEGORIES = ["penguin", "honey badger", "bird", "seal", "other animal"]
+DETECTION_THRESHOLD = 0.25  # Confidence threshold for animal detection
+
+# Text-query embeddings for ANIMAL_CATEGORIES, encoded once per loaded OwlViT model
+_owl_query_cache = {'categories': None, 'model': None, 'embeds': None, 'mask': None}
+_owl_query_lock = threading.Lock()
+
+transform = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+])
+
+# --- Model Loading ---
+def load_owlvit():
+    """Load the OwlViT processor and detection model used as the animal gate."""
+    owl_processor = OwlViTProcessor.from_pretrained(OWLVIT_PATH)
+    owl_model = OwlViTForObjectDetection.from_pretrained(OWLVIT_PATH)
+    owl_model.eval()
+    return owl_processor, owl_model
+
+def load_vgg16():
+    """Load the fine-tuned VGG16 molting/normal classifier."""
+    model = models.vgg16(weights=None)
+    num_features = model.classifier[6].in_features
+    model.classifier[6] = nn.Linear(num_features, 2)
+    state_dict = torch.load(MODEL_PATH, map_location=torch.device('cpu'))
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model
+
+def warm_up():
+    """Load every model and encode the animal prompts ahead of the first detection."""
+    registry.load_all()
+    if registry.is_loaded('owlvit'):
+        get_owl_query_embeddings()
+
+def preprocess_image(image):
+    """Apply the VGG16 transform to an already decoded RGB PIL image."""
+    img = transform(image).unsqueeze(0)
+    return img
+
+def predict_batch(images):
+    """Run one VGG16 forward pass over a list of preprocessed (1, 3, 224, 224) tensors."""
+    model = registry.get('vgg16')
+    batch = torch.cat(images, dim=0)
+    with torch.inference_mode():
+        output = model(batch)
+        probs = F.softmax(output, dim=1)
+    # (molting_prob, normal_prob) per image
+    return [tuple(row) for row in probs.tolist()]
+
+vgg_batcher = MicroBatcher(predict_batch,
+                           max_batch_size=VGG_MAX_BATCH_SIZE,
+                           max_wait_ms=VGG_MAX_WAIT_MS)
+
+def predict(image):
+    img = preprocess_image(image)
+    molting_prob, normal_prob = vgg_batcher.submit(img)
+    return molting_prob, normal_prob
+
+def get_molting_stage(weight, sex, detection_date):
+    """
+    Determine molt stage for MOLTING penguins only using ML model
+    Returns tuple of (stage_name, confidence)
+    
+    Args:
+        weight: float - penguin weight in kg
+        sex: str - 'Male' or 'Female'
+        detection_date: datetime - date of observation
+    
+    Returns:
+        tuple: (stage_name: str, confidence: float)
+    """
+    # Validate ML components
+    try:
+        molt_stage_engine = registry.get('molt_stage')
+    except RuntimeError:
+        raise ValueError("Molt stage classifier not properly initialized")
+    
+    try:
+        # Features: weight, sex (0=female, 1=male), day of year and its sin/cos
+        features = build_features(
+            [weight],
+            encode_sex([sex]),
+            [detection_date.timetuple().tm_yday]
+        )
+        
+        # Normalize features and get prediction
+        stage_names, confidences = molt_stage_engine.predict(features)
+        
+        return stage_names[0], float(confidences[0])
+        
+    except Exception as e:
+        print(f"Error in ML molt stage prediction: {str(e)}")
+        raise RuntimeError("Failed to predict molt stage using ML model")
+
+def get_owl_query_embeddings():
+    """Return cached OwlViT text-query embeddings for ANIMAL_CATEGORIES.
+
+    The text tower only runs again when the category list or the loaded
+    OwlViT model changes.
+
+    Returns:
+        tuple: (query_embeds: (1, num_queries, dim) tensor, query_mask: (1, num_queries) tensor)
+    """
+    owl_processor, owl_model = registry.get('owlvit')
+    categories = tuple(ANIMAL_CATEGORIES)
+    with _owl_query_lock:
+        if _owl_query_cache['categories'] != categories or _owl_query_cache['model'] is not owl_model:
+            text_inputs = owl_processor(text=list(categories), return_tensors="pt")
+            with torch.inference_mode():
+                text_embeds = owl_model.owlvit.get_text_features(
+                    input_ids=text_inputs['input_ids'],
+                    attention_mask=text_inputs['attention_mask']
+                )
+            # Same normalisation OwlViTModel.forward applies before the class head
+            text_embeds = text_embeds / torch.linalg.norm(text_embeds, ord=2, dim=-1, keepdim=True)
+
+            _owl_query_cache['categories'] = categories
+            _owl_query_cache['model'] = owl_model
+            _owl_query_cache['embeds'] = text_embeds.unsqueeze(0)
+            _owl_query_cache['mask'] = (text_inputs['input_ids'][:, 0] > 0).unsqueeze(0)
+
+        return _owl_query_cache['embeds'], _owl_query_cache['mask']
+
+def detect_animal(image):
+    """Use OwlV2 to detect if a decoded RGB image contains a penguin or other animal"""
+    owl_processor, owl_model = registry.get('owlvit')
+
+    # Only the image tower runs per detection; text queries come from the cache
+    query_embeds, query_mask = get_owl_query_embeddings()
+    pixel_values = owl_processor(images=image, return_tensors="pt")['pixel_values']
+
+    with torch.inference_mode():
+        feature_map, _ = owl_model.image_embedder(pixel_values=pixel_values)
+        batch_size, patches_h, patches_w, hidden_dim = feature_map.shape
+        image_feats = feature_map.reshape(batch_size, patches_h * patches_w, hidden_dim)
+        logits, _ = owl_model.class_predictor(image_feats, query_embeds, query_mask)
+        pred_boxes = owl_model.box_predictor(image_feats, feature_map)
+
+    outputs = OwlViTObjectDetectionOutput(logits=logits, pred_boxes=pred_boxes)
+    
+    # Target image sizes (height, width) to rescale box predictions
+    target_sizes = torch.Tensor([image.size[::-1]])
+    
+    # Convert outputs (bounding boxes and class logits) to COCO API
+    results = owl_processor.post_process_object_detection(
+        outputs=outputs, 
+        target_sizes=target_sizes,
+        threshold=DETECTION_THRESHOLD
+    )
+    
+    # Process results
+    is_penguin = False
+    animal_info = []
+    
+    if len(results) > 0 and 'scores' in results[0] and len(results[0]['scores']) > 0:
+        for score, label in zip(results[0]['scores'], results[0]['labels']):
+            animal_type = ANIMAL_CATEGORIES[label.item()]
+            confidence = score.item()
+            
+            if animal_type == "penguin" and confidence >= DETECTION_THRESHOLD:
+                is_penguin = True
+            
+            animal_info.append(f"{animal_type} (confidence: {confidence:.2f})")
+    
+    notes = "Detected animals: " + ", ".join(animal_info) if animal_info else "No animals detected"
+    return is_penguin, notes
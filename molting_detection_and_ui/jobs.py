@@ -0,0 +1,238 @@
+# jobs.py
+
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+
+from db import get_connection
+from metrics import metrics
+
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 300))  # Re-queue a running job whose owner stops renewing
+
+
+class DetectionJobQueue:
+    """Persistent job queue drained by a pool of background inference workers.
+
+    Jobs are written to the ``detection_jobs`` table before they are queued,
+    so anything still queued when the server stops is picked up again on
+    the next start. A worker claims a job with a conditional UPDATE, so
+    when several processes share the database each job runs once. The
+    claim holds a lease the owning process renews every third of
+    ``JOB_LEASE_SECONDS``; a running job whose lease has lapsed belonged to
+    a process that died and is queued again.
+    """
+
+    def __init__(self, db_path, handler, num_workers=2, on_complete=None, load_payload=None):
+        self.db_path = db_path
+        self.handler = handler            # handler(job) -> result dict
+        self.num_workers = max(1, int(num_workers))
+        self.on_complete = on_complete    # on_complete(job) after done/failed
+        self.load_payload = load_payload  # load_payload(job) -> payload, for jobs whose payload is not in memory
+        self._queue = queue.Queue()
+        self._payloads = {}               # job id -> in-memory payload (e.g. image bytes)
+        self._queued_at = {}              # job id -> monotonic submit time, for the queue wait metric
+        self._queued = set()              # job ids in this process's queue
+        self._workers = []
+        self._started = False
+        self._lock = threading.Lock()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def _connect(self):
+        conn = get_connection(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @property
+    def started(self):
+        return self._started
+
+    def start(self):
+        """Start the worker threads and re-queue unfinished jobs."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        resumed = self._recover(stale_before=None)
+        if resumed:
+            print(f"Resuming {resumed} unfinished detection job(s)")
+
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._worker, name=f"inference-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        threading.Thread(target=self._keep_leases, name="job-leases", daemon=True).start()
+
+    def _enqueue(self, job_id):
+        with self._lock:
+            if job_id in self._queued:
+                return False
+            self._queued.add(job_id)
+        self._queue.put(job_id)
+        return True
+
+    def _recover(self, stale_before):
+        """Queue running jobs whose lease lapsed and queued jobs nobody claimed.
+
+        ``stale_before`` limits the queued ones to those submitted before
+        it, so a running server leaves other processes' fresh jobs alone;
+        None takes them all. Returns how many were added to the queue.
+        """
+        conn = self._connect()
+        conn.execute(
+            '''UPDATE detection_jobs SET status = 'queued', claimed_by = NULL, lease_until = NULL
+               WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)''',
+            (time.time(),)
+        )
+        conn.commit()
+        rows = conn.execute(
+            "SELECT id FROM detection_jobs WHERE status = 'queued' AND submitted_at < ? ORDER BY submitted_at",
+            (stale_before or '9999',)
+        ).fetchall()
+        conn.close()
+        return sum(self._enqueue(row['id']) for row in rows)
+
+    def _keep_leases(self):
+        while True:
+            time.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "UPDATE detection_jobs SET lease_until = ? WHERE claimed_by = ? AND status = 'running'",
+                    (time.time() + JOB_LEASE_SECONDS, self.owner)
+                )
+                conn.commit()
+                conn.close()
+                stale_before = datetime.fromtimestamp(time.time() - JOB_LEASE_SECONDS)
+                recovered = self._recover(stale_before.strftime('%Y-%m-%d %H:%M:%S'))
+                if recovered:
+                    print(f"Picked up {recovered} detection job(s) left by another process")
+            except sqlite3.Error as e:
+                print(f"Could not renew job leases: {str(e)}")
+
+    def submit(self, rfid, image_path, weight, sex=None, env_data=None, source="ESP CAM", payload=None,
+               job_id=None):
+        """Persist a detection job and queue it. Returns the job id.
+
+        ``payload`` is kept in memory only and handed to the handler as
+        ``job['payload']``. A job resumed after a restart, or claimed by
+        another process, gets ``load_payload(job)`` instead (or ``None``
+        without one); a payload that cannot be loaded fails the job.
+        ``job_id`` lets a caller that has already recorded the id pick it.
+        """
+        job_id = job_id or uuid.uuid4().hex
+        submitted_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        conn = self._connect()
+        conn.execute(
+            '''INSERT INTO detection_jobs (
+                id, status, rfid, image_path, weight_kg, sex, env_data, source, submitted_at)
+            VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)''',
+            (job_id, rfid, image_path, weight, sex,
+             json.dumps(env_data) if env_data else None, source, submitted_at)
+        )
+        conn.commit()
+        conn.close()
+
+        if payload is not None:
+            self._payloads[job_id] = payload
+        self._queued_at[job_id] = time.monotonic()
+        self._enqueue(job_id)
+        return job_id
+
+    def get(self, job_id):
+        """Return the job as a dict, or None if the id is unknown."""
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM detection_jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job['env_data'] = json.loads(job['env_data']) if job['env_data'] else None
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def pending_count(self):
+        """Jobs queued or running, in every process sharing the database."""
+        conn = self._connect()
+        count = conn.execute(
+            "SELECT COUNT(*) FROM detection_jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()[0]
+        conn.close()
+        return count
+
+    def _set_status(self, job_id, status, **fields):
+        columns = ['status = ?'] + [f"{name} = ?" for name in fields]
+        conn = self._connect()
+        conn.execute(
+            f"UPDATE detection_jobs SET {', '.join(columns)} WHERE id = ?",
+            (status, *fields.values(), job_id)
+        )
+        conn.commit()
+        conn.close()
+
+    def _claim(self, job_id):
+        """Mark a queued job as running by this process. False if it is done or someone else has it."""
+        conn = self._connect()
+        claimed = conn.execute(
+            """UPDATE detection_jobs SET status = 'running', started_at = ?, claimed_by = ?, lease_until = ?
+               WHERE id = ? AND status = 'queued'""",
+            (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), self.owner, time.time() + JOB_LEASE_SECONDS, job_id)
+        ).rowcount
+        conn.commit()
+        conn.close()
+        return claimed == 1
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            with self._lock:
+                self._queued.discard(job_id)
+            try:
+                self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        payload = self._payloads.pop(job_id, None)
+        queued_at = self._queued_at.pop(job_id, None)
+        if not self._claim(job_id):
+            return
+        job = self.get(job_id)
+
+        if queued_at is not None:
+            metrics.observe('stage_seconds', time.monotonic() - queued_at, stage='queue_wait')
+        try:
+            if payload is None and self.load_payload:
+                try:
+                    payload = self.load_payload(job)
+                except OSError as e:
+                    raise RuntimeError(f"Payload of job {job_id} is not in memory and could not be loaded: {e}")
+            job['payload'] = payload
+            result = self.handler(job)
+        except Exception as e:
+            traceback.print_exc()
+            metrics.inc('jobs_total', status='failed')
+            self._set_status(job_id, 'failed',
+                             finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                             error=str(e))
+        else:
+            metrics.inc('jobs_total', status='done')
+            self._set_status(job_id, 'done',
+                             finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                             detection_id=result.get('detection_id'),
+                             result=json.dumps(result))
+
+        if self.on_complete:
+            try:
+                self.on_complete(self.get(job_id))
+            except Exception as e:
+                print(f"Error in job completion callback: {str(e)}")
@@ -0,0 +1,63 @@
+# live_frame.py
+
+import base64
+import hashlib
+import os
+import threading
+import time
+
+MJPEG_IDLE_SECONDS = float(os.environ.get('MJPEG_IDLE_SECONDS', 15))   # Re-send the frame this often while idle
+MJPEG_MAX_SECONDS = float(os.environ.get('MJPEG_MAX_SECONDS', 600))    # End a stream after this; the page reconnects
+
+
+class LiveFrame:
+    """Latest ESP32 camera frame, kept as raw JPEG bytes in memory.
+
+    The ETag is a content hash, so viewers that already have the frame get
+    a 304; the base64 form used by the legacy JSON endpoint is built at
+    most once per frame. MJPEG streams wait on ``wait_for_new``.
+    """
+
+    def __init__(self):
+        self._changed = threading.Condition()
+        self.data = None
+        self.content_type = 'image/jpeg'
+        self.etag = None
+        self.version = 0
+        self.updated_at = None
+        self._base64 = None
+
+    def update(self, data, content_type='image/jpeg'):
+        etag = hashlib.blake2b(data, digest_size=12).hexdigest()
+        with self._changed:
+            self.data = data
+            self.content_type = content_type
+            self.etag = etag
+            self.version += 1
+            self.updated_at = time.time()
+            self._base64 = None
+            self._changed.notify_all()
+        return etag
+
+    def snapshot(self):
+        """Return (data, etag, content_type, version) of the current frame."""
+        with self._changed:
+            return self.data, self.etag, self.content_type, self.version
+
+    def wait_for_new(self, version, timeout=None):
+        """Block until a frame newer than ``version`` exists; returns ``snapshot()``."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > version, timeout)
+            return self.data, self.etag, self.content_type, self.version
+
+    def base64(self):
+        with self._changed:
+            if self.data is not None and self._base64 is None:
+                self._base64 = base64.b64encode(self.data).decode('ascii')
+            return self._base64
+
+
+def mjpeg_part(data, content_type='image/jpeg', boundary=b'frame'):
+    """One part of a multipart/x-mixed-replace MJPEG stream."""
+    return (b'--' + boundary + b'\r\nContent-Type: ' + content_type.encode('ascii') +
+            b'\r\nContent-Length: ' + str(len(data)).encode('ascii') + b'\r\n\r\n' + data + b'\r\n')
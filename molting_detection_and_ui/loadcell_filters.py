@@ -0,0 +1,331 @@
+# loadcell_filters.py
+
+import base64
+import binascii
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+LOADCELL_RATE_HZ = float(os.environ.get('LOADCELL_RATE_HZ', 10))                   # HX711 output rate (10 or 80 Hz)
+LOADCELL_GRAMS_PER_COUNT = float(os.environ.get('LOADCELL_GRAMS_PER_COUNT', 0.0045558))  # MCU_Sys_Code calibration
+LOADCELL_OFFSET_GRAMS = float(os.environ.get('LOADCELL_OFFSET_GRAMS', -1862.8))
+LOADCELL_MAX_READINGS = int(os.environ.get('LOADCELL_MAX_READINGS', 100000))       # Largest burst accepted
+LOADCELL_SETTLE_SECONDS = float(os.environ.get('LOADCELL_SETTLE_SECONDS', 1.0))    # Window that must hold still
+LOADCELL_SETTLE_KG = float(os.environ.get('LOADCELL_SETTLE_KG', 0.05))             # Max spread of a still window
+LOADCELL_STEP_KG = float(os.environ.get('LOADCELL_STEP_KG', 0.2))                  # Jump reported as a step on/off
+LOADCELL_MIN_KG = float(os.environ.get('LOADCELL_MIN_KG', 0.5))                    # Lighter than this = empty platform
+LOADCELL_KALMAN_Q = float(os.environ.get('LOADCELL_KALMAN_Q', 1e-6))               # kg^2 the weight may drift per reading
+OUTLIER_WINDOW = 7     # Readings in the running median that outliers are judged against
+OUTLIER_SIGMAS = 4.0   # Distance from that median, in robust noise sigmas, that marks an outlier
+HX711_SATURATED = (0x7FFFFF, -0x800000)  # read() returns these when the input is out of range
+
+
+def decode_adc_burst(value):
+    """Raw HX711 counts from a JSON list, base64 of little-endian int32s, or those bytes."""
+    if isinstance(value, str):
+        try:
+            value = base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError):
+            raise ValueError('adc must be a list of readings or base64 little-endian int32')
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) % 4:
+            raise ValueError('adc bytes must be little-endian int32 readings')
+        counts = np.frombuffer(value, dtype='<i4').astype(np.float64)
+    else:
+        try:
+            counts = np.asarray(value, dtype=np.float64).ravel()
+        except (TypeError, ValueError):
+            raise ValueError('adc must be a list of numbers')
+    if not counts.size:
+        raise ValueError('adc burst is empty')
+    if counts.size > LOADCELL_MAX_READINGS:
+        raise ValueError(f'adc burst longer than {LOADCELL_MAX_READINGS} readings')
+    return counts
+
+
+def counts_to_kg(counts, grams_per_count=LOADCELL_GRAMS_PER_COUNT, offset_grams=LOADCELL_OFFSET_GRAMS):
+    return (np.asarray(counts, dtype=np.float64) * grams_per_count + offset_grams) / 1000.0
+
+
+def running_median(x, window=OUTLIER_WINDOW):
+    """Centred running median, edges padded by reflection."""
+    if x.size < window:
+        return np.full_like(x, np.median(x))
+    half = window // 2
+    padded = np.pad(x, half, mode='reflect')
+    return np.median(sliding_window_view(padded, window), axis=1)
+
+
+def reject_outliers(kg, window=OUTLIER_WINDOW, sigmas=OUTLIER_SIGMAS):
+    """Hampel-style outlier mask: True for readings worth keeping.
+
+    Each reading is compared with the running median around it; the noise
+    scale is the MAD of those residuals, so steps and wobble (which the
+    median follows) do not widen it. Returns (mask, noise sigma in kg).
+    """
+    residual = kg - running_median(kg, window)
+    sigma = 1.4826 * np.median(np.abs(residual))
+    sigma = max(sigma, 1e-4)  # a perfectly flat signal would otherwise reject everything
+    return np.abs(residual) <= sigmas * sigma, float(sigma)
+
+
+def moving_average(x, window):
+    """Mean of every ``window`` consecutive readings (len(x) - window + 1 values)."""
+    sums = np.cumsum(np.concatenate(([0.0], x)))
+    return (sums[window:] - sums[:-window]) / window
+
+
+def moving_std(x, window):
+    centred = x - np.median(x)  # keeps the sum of squares well conditioned
+    mean = moving_average(centred, window)
+    var = moving_average(centred * centred, window) - mean * mean
+    return np.sqrt(np.maximum(var, 0.0))
+
+
+def _exponential_filter(a, b, x0):
+    """x[n] = a * x[n-1] + b[n] for a constant ``a``, without a Python loop per reading.
+
+    Each block is solved from a zero start with cumulative sums, blocks
+    kept short enough that a ** block stays well scaled; only the block
+    start values are then carried forward one block at a time.
+    """
+    block = len(b) if a >= 1.0 else max(1, min(len(b), int(np.log(1e-4) / np.log(max(a, 1e-12)))))
+    rows = -(-len(b) // block)
+    padded = np.zeros(rows * block)
+    padded[:len(b)] = b
+    powers = a ** np.arange(1, block + 1)
+    local = powers * np.cumsum(padded.reshape(rows, block) / powers, axis=1)
+    starts = np.empty(rows)
+    x = x0
+    for row in range(rows):
+        starts[row] = x
+        x = powers[-1] * x + local[row, -1]
+    return (local + starts[:, None] * powers).ravel()[:len(b)]
+
+
+def kalman(z, r, q=LOADCELL_KALMAN_Q, x0=None, p0=None):
+    """Scalar random-walk Kalman filter over readings ``z``.
+
+    Same update as kalmann_filter_implementation.ino. With Q and R fixed
+    the gain does not depend on the data and settles within a few dozen
+    readings; those are filtered one by one and the rest, now a plain
+    exponential filter, in NumPy. Returns (estimates, final variance).
+    """
+    out = np.empty(len(z))
+    x = z[0] if x0 is None else x0
+    p = r if p0 is None else p0
+    k = None
+    for n in range(len(z)):
+        p_prior = p + q
+        k_next = p_prior / (p_prior + r)
+        if k is not None and abs(k_next - k) < 1e-9:
+            out[n:] = _exponential_filter(1.0 - k, k * z[n:], x)
+            return out, float(p)
+        k, p = k_next, p_prior * (1 - k_next)
+        x += k * (z[n] - x)
+        out[n] = x
+    return out, float(p)
+
+
+def find_steps(kg, window, min_step=LOADCELL_STEP_KG):
+    """Indices where the mean of the next ``window`` readings differs from the previous by ``min_step``."""
+    if len(kg) < 2 * window:
+        return []
+    means = moving_average(kg, window)
+    jump = means[window:] - means[:-window]  # jump[i]: mean after reading i + window vs before it
+    big = np.abs(jump) >= min_step
+    if not big.any():
+        return []
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], big.astype(np.int8), [0]))))
+    steps = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        peak = start + int(np.argmax(np.abs(jump[start:end])))
+        steps.append((peak + window, float(jump[peak])))
+    return steps
+
+
+def settled_runs(kg, window, tolerance=LOADCELL_SETTLE_KG):
+    """(start, end) reading ranges in which every ``window`` readings stay within ``tolerance`` std."""
+    if len(kg) < window:
+        return []
+    still = moving_std(kg, window) <= tolerance
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], still.astype(np.int8), [0]))))
+    # A run of still windows [a, b) covers readings [a, b - 1 + window)
+    return [(int(a), int(b) - 1 + window) for a, b in zip(edges[::2], edges[1::2])]
+
+
+def standard_error(x, batches=10):
+    """Standard error of the mean by batch means, so slow sway is not mistaken for averaging out."""
+    if len(x) < 2 * batches:
+        return float(np.std(x, ddof=1) / np.sqrt(len(x))) if len(x) > 1 else 0.0
+    size = len(x) // batches
+    means = x[:size * batches].reshape(batches, size).mean(axis=1)
+    return float(np.std(means, ddof=1) / np.sqrt(batches))
+
+
+def estimate_weight(counts, rate_hz=None, grams_per_count=LOADCELL_GRAMS_PER_COUNT,
+                    offset_grams=LOADCELL_OFFSET_GRAMS):
+    """Weight and its uncertainty from a burst of raw HX711 counts.
+
+    Saturated and outlying readings are dropped, the remaining ones are
+    split where the bird steps on or off, and the weight is the mean of
+    the longest still stretch heavier than an empty platform. Without a
+    still stretch the Kalman estimate at the last reading before the bird
+    stepped off is used and ``settled`` is False. Raises ValueError when no
+    reading is usable or none is heavier than an empty platform.
+    """
+    rate_hz = rate_hz or LOADCELL_RATE_HZ
+    counts = np.asarray(counts, dtype=np.float64)
+    valid = np.isfinite(counts) & ~np.isin(counts, HX711_SATURATED)
+    if not valid.any():
+        raise ValueError('No valid readings in adc burst')
+
+    kg = counts_to_kg(counts[valid], grams_per_count, offset_grams)
+    keep, noise = reject_outliers(kg)
+    times = np.flatnonzero(valid)[keep] / rate_hz
+    kg = kg[keep]
+
+    window = max(3, int(round(LOADCELL_SETTLE_SECONDS * rate_hz)))
+    filtered, variance = kalman(kg, noise ** 2)
+    result = {
+        'readings': int(counts.size),
+        'rejected': int(counts.size - kg.size),
+        'noise_kg': round(noise, 4),
+        'kalman_kg': round(float(filtered[-1]), 3),
+        'steps': [{'at_seconds': round(float(times[i]), 2), 'delta_kg': round(delta, 3)}
+                  for i, delta in find_steps(kg, window)[:20]],
+    }
+
+    runs = [(start, end) for start, end in settled_runs(kg, window)
+            if kg[start:end].mean() >= LOADCELL_MIN_KG]
+    if runs:
+        # Longest still stretch; the later one on a tie, once the bird has stopped shuffling
+        start, end = max(runs, key=lambda run: (run[1] - run[0], run[0]))
+        still = kg[start:end]
+        result.update({
+            'weight_kg': round(float(still.mean()), 3),
+            'uncertainty_kg': round(max(standard_error(still), noise / np.sqrt(len(still))), 4),
+            'settled': True,
+            'settled_from': round(float(times[start]), 2),
+            'settled_to': round(float(times[end - 1]), 2),
+        })
+    else:
+        heavy = np.flatnonzero(kg >= LOADCELL_MIN_KG)
+        if not heavy.size:
+            raise ValueError(f'No reading above {LOADCELL_MIN_KG} kg in adc burst: the platform was empty')
+        last = int(heavy[-1])
+        result.update({
+            'weight_kg': round(float(filtered[last]), 3),
+            'uncertainty_kg': round(max(np.sqrt(variance), float(np.std(kg[max(0, last + 1 - window):last + 1]))), 4),
+            'settled': False,
+        })
+    return result
+
+
+# Ports of the firmware estimators, reading by reading as on the ESP32, for comparison
+def firmware_sma(kg, window=5):
+    """MCU_Sys_Code getSmoothedWeight(): mean of the last ``window`` readings."""
+    return sum(kg[-window:]) / len(kg[-window:])
+
+
+def firmware_filtered_average(kg, samples=10):
+    """Filtered_SMA_Weight_Estimate filtered_average(10) over the last ``samples`` readings."""
+    values = list(kg[-samples:])
+    max_val, min_val = max(values), min(values)
+    # Every copy of the extremes is skipped but the divisor assumes exactly two
+    return sum(v for v in values if v != max_val and v != min_val) / (samples - 2)
+
+
+def firmware_kalman(kg, median_size=5, ma_size=7, q=0.1, r=10.0):
+    """kalmann_filter_implementation.ino: median of 5 -> moving average of 7 -> Kalman, in grams."""
+    ma_buffer, idx, p, x = [0.0] * ma_size, 0, 1.0, 0.0
+    grams = [v * 1000.0 for v in kg]
+    for start in range(0, len(grams) - median_size + 1, median_size):
+        ma_buffer[idx] = sorted(grams[start:start + median_size])[median_size // 2]
+        idx = (idx + 1) % ma_size
+        ma_average = sum(ma_buffer) / ma_size
+        p += q
+        k = p / (p + r)
+        x += k * (ma_average - x)
+        p *= (1 - k)
+    return x / 1000.0
+
+
+def simulate_burst(true_kg, readings, rate_hz, rng, grams_per_count=LOADCELL_GRAMS_PER_COUNT,
+                   offset_grams=LOADCELL_OFFSET_GRAMS, noise_counts=300, step_off=False):
+    """Raw counts of a bird stepping onto the platform: empty lead-in, a damped
+    wobble, standing still with slow sway, HX711 glitches and optionally stepping off."""
+    t = np.arange(readings) / rate_hz
+    on = rng.uniform(0.0, 0.1) * t[-1]
+    settle = rng.uniform(1.0, 3.0)  # seconds of wobble
+    kg = np.where(t >= on, true_kg, 0.0)
+    wobble = rng.uniform(0.2, 0.6) * true_kg * np.exp(-(t - on) * 3.0 / settle) * np.sin(2 * np.pi * 2.5 * (t - on))
+    kg = kg + np.where(t >= on, wobble, 0.0)
+    kg = kg + 0.01 * np.sin(2 * np.pi * 0.2 * t + rng.uniform(0, 2 * np.pi))  # shuffling feet
+    if step_off:
+        kg = np.where(t >= rng.uniform(0.75, 0.9) * t[-1], 0.0, kg)
+    counts = (kg * 1000.0 - offset_grams) / grams_per_count + rng.normal(0, noise_counts, readings)
+    glitches = rng.random(readings) < 0.01
+    counts[glitches] = rng.choice([0, 1128, 7720, 2 * counts.mean()], size=glitches.sum())
+    return np.round(counts)
+
+
+if __name__ == "__main__":
+    import argparse
+    import csv
+    import time
+
+    default_csv_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                   'Electronics and Controls Subsystem', 'Weight_Estimation_Training')
+    parser = argparse.ArgumentParser(description="Compare the server filters with the firmware estimators "
+                                                 "on recorded HX711 bursts and simulated visits")
+    parser.add_argument('--csv', nargs='*', default=[os.path.join(default_csv_dir, name)
+                                                     for name in ('weight_1000.csv', 'weight_2000.csv')],
+                        help='raw_reading,true_weight_grams files, one burst each')
+    parser.add_argument('--bursts', type=int, default=200, help='Simulated bursts per size')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[200, 2000, 20000], help='Readings per burst')
+    parser.add_argument('--rate', type=float, default=80.0, help='Simulated HX711 rate in Hz')
+    args = parser.parse_args()
+
+    estimators = {
+        'server': lambda counts, rate, gpc, off: estimate_weight(counts, rate, gpc, off)['weight_kg'],
+        'firmware SMA(5)': lambda counts, rate, gpc, off: firmware_sma(list(counts_to_kg(counts, gpc, off))),
+        'firmware filtered_average(10)':
+            lambda counts, rate, gpc, off: firmware_filtered_average(list(counts_to_kg(counts, gpc, off))),
+        'firmware median/MA/Kalman':
+            lambda counts, rate, gpc, off: firmware_kalman(list(counts_to_kg(counts, gpc, off))),
+    }
+
+    # Recorded bursts: a two-point calibration from their own medians, then each estimate against the label
+    recorded = []
+    for path in args.csv:
+        with open(path, newline='') as f_in:
+            rows = [(float(row['raw_reading']), float(row['true_weight_grams'])) for row in csv.DictReader(f_in)]
+        recorded.append((os.path.basename(path), np.array([r for r, _ in rows]), rows[0][1] / 1000.0))
+    if len(recorded) >= 2:
+        (_, raw_a, kg_a), (_, raw_b, kg_b) = recorded[:2]
+        grams_per_count = (kg_b - kg_a) * 1000.0 / (np.median(raw_b) - np.median(raw_a))
+        offset_grams = kg_a * 1000.0 - grams_per_count * np.median(raw_a)
+        print(f"Recorded bursts (two-point calibration {grams_per_count:.6f} g/count, {offset_grams:.1f} g):")
+        for name, raw, true_kg in recorded:
+            estimate = estimate_weight(raw, LOADCELL_RATE_HZ, grams_per_count, offset_grams)
+            errors = ', '.join(f"{label} {(fn(raw, LOADCELL_RATE_HZ, grams_per_count, offset_grams) - true_kg) * 1000:+.0f} g"
+                               for label, fn in estimators.items())
+            print(f"  {name}: {len(raw)} readings, {estimate['rejected']} rejected, "
+                  f"server {estimate['weight_kg']:.3f} +/- {estimate['uncertainty_kg'] * 1000:.1f} g "
+                  f"(settled={estimate['settled']}); error {errors}")
+
+    rng = np.random.default_rng(0)
+    print(f"\nSimulated visits at {args.rate:g} Hz, {args.bursts} bursts per size (true weight 2-4.5 kg):")
+    for size in args.sizes:
+        bursts = [(true_kg, simulate_burst(true_kg, size, args.rate, rng, step_off=i % 4 == 0))
+                  for i, true_kg in enumerate(rng.uniform(2.0, 4.5, args.bursts))]
+        print(f"  {size} readings ({size / args.rate:.1f} s), a quarter stepping off before the end:")
+        for label, fn in estimators.items():
+            start = time.perf_counter()
+            errors = np.abs([fn(counts, args.rate, LOADCELL_GRAMS_PER_COUNT, LOADCELL_OFFSET_GRAMS) - true_kg
+                             for true_kg, counts in bursts]) * 1000
+            per_burst = (time.perf_counter() - start) / len(bursts) * 1000
+            print(f"    {label:30s} median error {np.median(errors):7.1f} g, p95 {np.percentile(errors, 95):7.1f} g, "
+                  f"{per_burst:7.2f} ms/burst")
@@ -0,0 +1,233 @@
+# metrics.py
+
+import bisect
+import collections
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'  # Stage timings and counters for /metrics
+METRICS_WINDOW = int(os.environ.get('METRICS_WINDOW', 1024))      # Recent timings behind p50/p95/p99
+METRICS_PREFIX = 'penguin_'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# name -> (type, help) for everything the app records; unknown names are rendered as untyped
+DESCRIPTIONS = {
+    'stage_seconds': ('histogram', 'Time spent in each detection pipeline stage'),
+    'stage_recent_seconds': ('gauge', f'Quantiles of the last {METRICS_WINDOW} timings of each stage'),
+    'detections_total': ('counter', 'Detections processed, by whether the animal was a penguin'),
+    'frames_reused_total': ('counter', 'Detections scored from a cached near-duplicate frame'),
+    'stage_fallbacks_total': ('counter', 'Molt stages set by the probability fallback after the stage model failed'),
+    'errors_total': ('counter', 'Exceptions raised inside a timed stage'),
+    'jobs_total': ('counter', 'Detection jobs finished, by status'),
+}
+
+
+class Histogram:
+    """Cumulative bucket counts since start, plus a window of recent values for quantiles."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=METRICS_WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.recent = collections.deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantiles(self, quantiles=QUANTILES):
+        values = sorted(self.recent)
+        if not values:
+            return {q: None for q in quantiles}
+        return {q: values[min(len(values) - 1, int(q * len(values)))] for q in quantiles}
+
+
+class Metrics:
+    """Counters, gauges and stage latency histograms in Prometheus text format.
+
+    Recording is a dict update under one lock, and a timing span adds two
+    ``perf_counter`` calls, so it stays on in production. Quantiles are
+    only computed when ``/metrics`` is scraped. Values are per process:
+    under gunicorn each worker reports its own.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._gauges = {}      # name -> callable returning a number
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def gauge(self, name, read, help_text=None):
+        """Report ``read()`` as ``name`` on every scrape."""
+        self._gauges[name] = read
+        if help_text:
+            DESCRIPTIONS.setdefault(name, ('gauge', help_text))
+
+    @contextmanager
+    def span(self, stage):
+        """Time the block as ``stage``; an exception also counts in errors_total."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('errors_total', stage=stage)
+            raise
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage)
+
+    def timed(self, stage):
+        """Decorator form of ``span``."""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def stages(self):
+        """{stage: {'count', 'mean', 'p50', 'p95', 'p99'}} in seconds, for logs and checks."""
+        with self._lock:
+            histograms = {dict(labels).get('stage'): (h.count, h.sum, h.quantiles())
+                          for (name, labels), h in self._histograms.items() if name == 'stage_seconds'}
+        return {stage: {'count': count, 'mean': total / count if count else None,
+                        **{f"p{int(q * 100)}": value for q, value in quantiles.items()}}
+                for stage, (count, total, quantiles) in histograms.items()}
+
+    def render(self):
+        """The Prometheus text exposition (format 0.0.4)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = [(key, list(h.counts), h.sum, h.count, h.quantiles())
+                          for key, h in sorted(self._histograms.items())]
+        gauges = []
+        for name, read in sorted(self._gauges.items()):
+            try:
+                gauges.append((name, float(read())))
+            except Exception as e:
+                print(f"Metrics gauge {name} failed: {str(e)}")
+
+        lines, described = [], set()
+
+        def header(name, default_type):
+            if name not in described:
+                described.add(name)
+                kind, help_text = DESCRIPTIONS.get(name, (default_type, None))
+                if help_text:
+                    lines.append(f"# HELP {METRICS_PREFIX}{name} {help_text}")
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{METRICS_PREFIX}{name}{format_labels(labels)} {format_value(value)}")
+        for name, value in gauges:
+            header(name, 'gauge')
+            lines.append(f"{METRICS_PREFIX}{name} {format_value(value)}")
+        for (name, labels), counts, total, count, _ in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{METRICS_PREFIX}{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{METRICS_PREFIX}{name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{METRICS_PREFIX}{name}_count{format_labels(labels)} {count}")
+        for (name, labels), _, _, _, quantiles in histograms:
+            if name != 'stage_seconds':
+                continue
+            header('stage_recent_seconds', 'gauge')
+            for q, value in quantiles.items():
+                if value is not None:
+                    lines.append(f"{METRICS_PREFIX}stage_recent_seconds"
+                                 f"{format_labels(labels + (('quantile', str(q)),))} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics = Metrics()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure the cost of a timing span and of rendering /metrics")
+    parser.add_argument('--spans', type=int, default=200000)
+    args = parser.parse_args()
+
+    bench = Metrics(enabled=True)
+    stages = ['base64_decode', 'image_write', 'image_decode', 'detect_animal', 'predict',
+              'get_molting_stage', 'db_transaction', 'detection']
+
+    start = time.perf_counter()
+    for i in range(args.spans):
+        pass
+    empty = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(args.spans):
+        with bench.span(stages[i % len(stages)]):
+            pass
+    spans = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(args.spans):
+        bench.inc('detections_total', result='penguin')
+    counters = time.perf_counter() - start
+
+    start = time.perf_counter()
+    text = bench.render()
+    render_ms = (time.perf_counter() - start) * 1000
+
+    disabled = Metrics(enabled=False)
+    start = time.perf_counter()
+    for i in range(args.spans):
+        with disabled.span('detection'):
+            pass
+    off = time.perf_counter() - start
+
+    print(f"span: {(spans - empty) / args.spans * 1e6:.2f} us, counter: {counters / args.spans * 1e6:.2f} us, "
+          f"disabled span: {(off - empty) / args.spans * 1e6:.2f} us")
+    print(f"render: {render_ms:.2f} ms for {len(stages)} stages, {len(text.splitlines())} lines")
+    for stage, summary in bench.stages().items():
+        print(f"  {stage}: {summary['count']} spans, p50 {summary['p50'] * 1e6:.2f} us, "
+              f"p99 {summary['p99'] * 1e6:.2f} us")
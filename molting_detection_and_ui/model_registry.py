@@ -0,0 +1,97 @@
+# model_registry.py
+
+import importlib
+import threading
+import time
+
+
+class ModelRegistry:
+    """Loads each named model the first time it is asked for.
+
+    Loaders are plain callables or ``"module:function"`` strings; the string
+    form lets the web app register models without importing torch,
+    TensorFlow or transformers until a model is actually needed.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._errors = {}
+        self._load_seconds = {}
+        self._locks = {}
+
+    def register(self, name, loader):
+        self._loaders[name] = loader
+        self._locks[name] = threading.Lock()
+
+    def names(self):
+        return list(self._loaders)
+
+    def _resolve(self, loader):
+        if callable(loader):
+            return loader
+        module_name, func_name = loader.split(':', 1)
+        return getattr(importlib.import_module(module_name), func_name)
+
+    def get(self, name):
+        """Return the loaded model, loading it on first use.
+
+        A failed load is remembered and re-raised on later calls until
+        ``reload`` is used, so a missing checkpoint is not retried per request.
+        """
+        if name in self._models:
+            return self._models[name]
+
+        with self._locks[name]:
+            if name in self._models:
+                return self._models[name]
+            if name in self._errors:
+                raise RuntimeError(f"Model '{name}' failed to load: {self._errors[name]}")
+
+            start = time.perf_counter()
+            try:
+                model = self._resolve(self._loaders[name])()
+            except Exception as e:
+                self._errors[name] = str(e)
+                print(f"Error loading model '{name}': {str(e)}")
+                raise RuntimeError(f"Model '{name}' failed to load: {e}")
+
+            self._load_seconds[name] = round(time.perf_counter() - start, 3)
+            self._models[name] = model
+            print(f"Loaded model '{name}' in {self._load_seconds[name]}s")
+            return model
+
+    def reload(self, name):
+        """Forget a loaded model or a failed load and load it again."""
+        with self._locks[name]:
+            self._models.pop(name, None)
+            self._errors.pop(name, None)
+        return self.get(name)
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def load_all(self):
+        """Load every registered model, skipping (but recording) failures."""
+        for name in self._loaders:
+            try:
+                self.get(name)
+            except RuntimeError:
+                pass
+
+    def status(self):
+        return {
+            name: {
+                'loaded': name in self._models,
+                'load_seconds': self._load_seconds.get(name),
+                'error': self._errors.get(name)
+            }
+            for name in self._loaders
+        }
+
+
+# Models used by the detection pipeline, loaded on first use
+registry = ModelRegistry()
+registry.register('owlvit', 'inference:load_owlvit')
+registry.register('vgg16', 'inference:load_vgg16')
+registry.register('molt_stage', 'molt_stage_engine:load_engine')
@@ -0,0 +1,251 @@
+# molt_stage_engine.py
+
+import json
+
+import numpy as np
+
+STAGE_NAMES = ["Pre-molt", "Mid-molt", "Post-molt"]
+
+# Default export location used by the server (relative to molting_detection_and_ui/)
+ENGINE_PATH = "models/molt_stage_engine.npz"
+
+# Layers that are the identity at inference time
+_PASSTHROUGH_LAYERS = {'InputLayer', 'Dropout', 'GaussianNoise', 'GaussianDropout', 'AlphaDropout'}
+
+
+def _relu(x):
+    return np.maximum(x, 0.0)
+
+
+def _softmax(x):
+    x = x - x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': _relu,
+    'softmax': _softmax,
+    'sigmoid': _sigmoid,
+    'tanh': np.tanh,
+}
+
+
+class MoltStageEngine:
+    """NumPy implementation of the dense molt-stage classifier.
+
+    Evaluates the exported StandardScaler and Dense/BatchNorm stack on a whole
+    feature matrix at once, so scoring one penguin or fifty thousand costs a
+    handful of matrix multiplies and no TensorFlow runtime.
+    """
+
+    def __init__(self, scaler_mean, scaler_scale, kernels, biases, activations):
+        self.scaler_mean = np.asarray(scaler_mean, dtype=np.float64)
+        self.scaler_scale = np.asarray(scaler_scale, dtype=np.float64)
+        self.kernels = [np.asarray(k, dtype=np.float64) for k in kernels]
+        self.biases = [np.asarray(b, dtype=np.float64) for b in biases]
+        self.activations = list(activations)
+
+        for activation in self.activations:
+            if activation not in ACTIVATIONS:
+                raise ValueError(f"Unsupported activation: {activation}")
+
+    @classmethod
+    def load(cls, path):
+        """Load an engine written by ``export_molt_stage_model``."""
+        with np.load(path, allow_pickle=False) as data:
+            num_layers = int(data['num_layers'])
+            return cls(
+                scaler_mean=data['scaler_mean'],
+                scaler_scale=data['scaler_scale'],
+                kernels=[data[f'kernel_{i}'] for i in range(num_layers)],
+                biases=[data[f'bias_{i}'] for i in range(num_layers)],
+                activations=[str(name) for name in data['activations']]
+            )
+
+    def save(self, path):
+        arrays = {
+            'scaler_mean': self.scaler_mean,
+            'scaler_scale': self.scaler_scale,
+            'num_layers': np.array(len(self.kernels)),
+            'activations': np.array(self.activations),
+        }
+        for i, (kernel, bias) in enumerate(zip(self.kernels, self.biases)):
+            arrays[f'kernel_{i}'] = kernel
+            arrays[f'bias_{i}'] = bias
+        np.savez(path, **arrays)
+
+    def scale(self, features):
+        return (np.asarray(features, dtype=np.float64) - self.scaler_mean) / self.scaler_scale
+
+    def predict_proba(self, features):
+        """Return an (N, 3) array of stage probabilities for an (N, 5) feature matrix."""
+        x = self.scale(np.atleast_2d(features))
+        for kernel, bias, activation in zip(self.kernels, self.biases, self.activations):
+            x = ACTIVATIONS[activation](x @ kernel + bias)
+        return x
+
+    def predict(self, features):
+        """Return (stage_names, confidences) for an (N, 5) feature matrix."""
+        probs = self.predict_proba(features)
+        stage_idx = probs.argmax(axis=1)
+        return [STAGE_NAMES[i] for i in stage_idx], probs[np.arange(len(probs)), stage_idx]
+
+
+def load_engine(path=ENGINE_PATH):
+    """Registry loader for the serving engine."""
+    return MoltStageEngine.load(path)
+
+
+def encode_sex(sexes):
+    """Vectorised sex code: 0 for 'female' (any case), 1 for everything else."""
+    sexes = np.asarray(sexes, dtype=object)
+    return np.array([0 if isinstance(sex, str) and sex.lower() == 'female' else 1 for sex in sexes],
+                    dtype=np.float64)
+
+
+def build_features(weights, sex_codes, days_of_year):
+    """Build the (N, 5) feature matrix in training order.
+
+    Columns: weight, sex code, day of year, sin and cos of the day of year
+    (cyclical seasonality).
+    """
+    days_of_year = np.asarray(days_of_year, dtype=np.float64)
+    angle = days_of_year * (2 * np.pi / 365)
+    return np.column_stack([
+        np.asarray(weights, dtype=np.float64),
+        np.asarray(sex_codes, dtype=np.float64),
+        days_of_year,
+        np.sin(angle),
+        np.cos(angle),
+    ])
+
+
+def _read_h5_layers(model_path):
+    """Yield (class_name, config, [weights]) for each layer of a Keras .h5 model."""
+    import h5py
+
+    with h5py.File(model_path, 'r') as f:
+        config = f.attrs['model_config']
+        if isinstance(config, bytes):
+            config = config.decode('utf-8')
+        layers = json.loads(config)['config']['layers']
+
+        weights_group = f['model_weights'] if 'model_weights' in f else f
+        for layer in layers:
+            name = layer['config']['name']
+            weights = []
+            if name in weights_group:
+                group = weights_group[name]
+                for weight_name in group.attrs.get('weight_names', []):
+                    if isinstance(weight_name, bytes):
+                        weight_name = weight_name.decode('utf-8')
+                    weights.append(group[weight_name][()])
+            yield layer['class_name'], layer['config'], weights
+
+
+def export_molt_stage_model(model_path, scaler_path, out_path=None):
+    """Convert the Keras molt-stage model and its scaler into a MoltStageEngine.
+
+    Reads the .h5 file directly with h5py, so TensorFlow is not needed to
+    export. BatchNormalization layers are folded into the preceding Dense
+    layer where possible.
+    """
+    import joblib
+
+    scaler = joblib.load(scaler_path)
+    scaler_mean = scaler.mean_ if getattr(scaler, 'with_mean', True) else np.zeros(scaler.n_features_in_)
+    scaler_scale = scaler.scale_ if getattr(scaler, 'with_std', True) else np.ones(scaler.n_features_in_)
+
+    kernels, biases, activations = [], [], []
+    for class_name, config, weights in _read_h5_layers(model_path):
+        if class_name in _PASSTHROUGH_LAYERS:
+            continue
+
+        if class_name == 'Dense':
+            kernel = weights[0]
+            bias = weights[1] if config.get('use_bias', True) else np.zeros(kernel.shape[1])
+            kernels.append(kernel)
+            biases.append(bias)
+            activations.append(config.get('activation', 'linear'))
+
+        elif class_name == 'BatchNormalization':
+            weights = list(weights)
+            gamma = weights.pop(0) if config.get('scale', True) else 1.0
+            beta = weights.pop(0) if config.get('center', True) else 0.0
+            moving_mean, moving_var = weights
+            factor = gamma / np.sqrt(moving_var + config.get('epsilon', 1e-3))
+
+            if kernels and activations[-1] == 'linear':
+                kernels[-1] = kernels[-1] * factor
+                biases[-1] = (biases[-1] - moving_mean) * factor + beta
+            else:
+                # After a non-linearity: keep it as its own per-feature affine layer
+                kernels.append(np.diag(factor))
+                biases.append(beta - moving_mean * factor)
+                activations.append('linear')
+
+        elif class_name == 'Activation':
+            if not kernels or activations[-1] != 'linear':
+                raise ValueError("Activation layer must follow a linear Dense layer")
+            activations[-1] = config['activation']
+
+        else:
+            raise ValueError(f"Unsupported layer type for export: {class_name}")
+
+    engine = MoltStageEngine(scaler_mean, scaler_scale, kernels, biases, activations)
+    if out_path:
+        engine.save(out_path)
+    return engine
+
+
+def check_parity(engine, model_path, scaler_path, num_samples=2000, seed=0):
+    """Compare engine output with the original Keras model and scaler.
+
+    Returns (max_abs_prob_diff, stage_agreement) over random but plausible
+    weight/sex/day-of-year inputs. Needs TensorFlow.
+    """
+    import joblib
+    from tensorflow.keras.models import load_model
+
+    rng = np.random.default_rng(seed)
+    features = build_features(
+        rng.uniform(2.0, 5.0, num_samples),
+        rng.integers(0, 2, num_samples),
+        rng.integers(1, 366, num_samples)
+    )
+
+    keras_model = load_model(model_path)
+    scaler = joblib.load(scaler_path)
+    expected = keras_model.predict(scaler.transform(features), verbose=0)
+    actual = engine.predict_proba(features)
+
+    max_diff = float(np.abs(expected - actual).max())
+    agreement = float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean())
+    return max_diff, agreement
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the Keras molt stage model to a NumPy engine")
+    parser.add_argument('--model', default='models/molt_stage_model_simplified.h5')
+    parser.add_argument('--scaler', default='models/molt_stage_scaler.save')
+    parser.add_argument('--out', default=ENGINE_PATH)
+    parser.add_argument('--check', action='store_true', help='Compare against the Keras model (needs TensorFlow)')
+    args = parser.parse_args()
+
+    engine = export_molt_stage_model(args.model, args.scaler, args.out)
+    print(f"Exported {len(engine.kernels)} dense layers ({', '.join(engine.activations)}) to {args.out}")
+
+    if args.check:
+        max_diff, agreement = check_parity(engine, args.model, args.scaler)
+        print(f"Parity vs Keras: max |p_keras - p_numpy| = {max_diff:.2e}, stage agreement = {agreement:.2%}")
+        if max_diff > 1e-5:
+            raise SystemExit("Parity check failed")
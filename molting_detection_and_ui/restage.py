@@ -0,0 +1,95 @@
+# restage.py
+
+import time
+
+import numpy as np
+
+from db import get_connection
+from molt_stage_engine import build_features, encode_sex, load_engine
+
+
+def restage_detections(db_path, engine=None, rfid=None, dry_run=False):
+    """Re-score the molt stage of every molting detection in one pass.
+
+    Builds the feature matrix for all matching rows at once, scores it with a
+    single engine call and writes ``stage_name`` back in one transaction.
+    Penguins whose latest detection was re-staged get the new stage too.
+
+    Returns a summary dict (rows scored, rows changed, timings).
+    """
+    engine = engine or load_engine()
+    start = time.perf_counter()
+
+    conn = get_connection(db_path)
+    query = '''
+        SELECT d.id, d.weight_kg, p.sex,
+               CAST(strftime('%j', d.detection_time) AS INTEGER), d.stage_name
+        FROM detections d
+        LEFT JOIN penguins p ON d.rfid = p.rfid
+        WHERE d.health = 'Molting'
+    '''
+    params = []
+    if rfid:
+        query += ' AND d.rfid = ?'
+        params.append(rfid)
+    rows = conn.execute(query, params).fetchall()
+    loaded = time.perf_counter()
+
+    if not rows:
+        conn.close()
+        return {'scored': 0, 'changed': 0, 'seconds': round(loaded - start, 3)}
+
+    ids, weights, sexes, days, old_stages = zip(*rows)
+    features = build_features(
+        np.array(weights, dtype=np.float64),
+        encode_sex(sexes),
+        np.array([day or 1 for day in days], dtype=np.float64)
+    )
+    stage_names, _ = engine.predict(features)
+    scored = time.perf_counter()
+
+    updates = [(stage, row_id) for row_id, stage, old in zip(ids, stage_names, old_stages) if stage != old]
+
+    if not dry_run and updates:
+        with conn:
+            conn.executemany('UPDATE detections SET stage_name = ? WHERE id = ?', updates)
+            conn.execute('''
+                UPDATE penguins
+                SET stage_name = (
+                    SELECT d.stage_name FROM detections d
+                    WHERE d.rfid = penguins.rfid
+                    ORDER BY d.detection_time DESC, d.id DESC
+                    LIMIT 1
+                )
+                WHERE health = 'Molting'
+            ''')
+    conn.close()
+    written = time.perf_counter()
+
+    return {
+        'scored': len(rows),
+        'changed': len(updates),
+        'dry_run': dry_run,
+        'load_seconds': round(loaded - start, 3),
+        'score_seconds': round(scored - loaded, 3),
+        'write_seconds': round(written - scored, 3),
+        'seconds': round(written - start, 3)
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import DB_PATH
+    from molt_stage_engine import ENGINE_PATH
+
+    parser = argparse.ArgumentParser(description="Re-stage all molting detections with the current molt stage model")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--engine', default=ENGINE_PATH, help='Exported NumPy engine (.npz)')
+    parser.add_argument('--rfid', default=None, help='Only re-stage one penguin')
+    parser.add_argument('--dry-run', action='store_true', help='Score but do not write back')
+    args = parser.parse_args()
+
+    summary = restage_detections(args.db, load_engine(args.engine), rfid=args.rfid, dry_run=args.dry_run)
+    print(f"Scored {summary['scored']} molting detections, {summary['changed']} stage(s) changed "
+          f"in {summary['seconds']}s{' (dry run)' if args.dry_run else ''}")
@@ -0,0 +1,319 @@
+# sse_hub.py
+
+import asyncio
+import collections
+import json
+import os
+import threading
+import time
+
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 16))      # Undelivered events kept per client
+SSE_HISTORY_SIZE = int(os.environ.get('SSE_HISTORY_SIZE', 64))   # Events kept for Last-Event-ID resume
+
+
+class Subscription:
+    """One client's bounded event queue; when full the oldest event is dropped."""
+
+    def __init__(self, max_size=SSE_QUEUE_SIZE):
+        self._events = collections.deque(maxlen=max_size)
+        self._ready = threading.Condition(threading.Lock())
+        self.dropped = 0
+
+    @property
+    def count(self):
+        return 1
+
+    def put(self, message, event_id=None):
+        with self._ready:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(message)
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """Return the next formatted event, or None if nothing arrived within ``timeout``."""
+        with self._ready:
+            if not self._events:
+                self._ready.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+
+class AsyncSubscription:
+    """Subscription for asyncio streams; only touched from its event loop."""
+
+    def __init__(self, max_size=SSE_QUEUE_SIZE):
+        self._events = collections.deque(maxlen=max_size)
+        self._ready = asyncio.Event()
+        self.last_id = 0
+        self.dropped = 0
+
+    def put(self, message, event_id=None):
+        if event_id is not None:
+            # A frame can arrive both in the resume backlog and from the relay
+            if event_id <= self.last_id:
+                return
+            self.last_id = event_id
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(message)
+        self._ready.set()
+
+    async def get(self, timeout=None):
+        if not self._events:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._events.popleft() if self._events else None
+
+
+class _LoopRelay:
+    """Hands each published frame to one event loop's async subscribers.
+
+    Registered with the hub like a single subscriber, so a publish from a
+    worker thread costs one call_soon_threadsafe per loop rather than one
+    per connection.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.subscribers = set()
+
+    @property
+    def count(self):
+        return len(self.subscribers)
+
+    @property
+    def dropped(self):
+        return sum(s.dropped for s in self.subscribers)
+
+    def put(self, message, event_id=None):
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._deliver, message, event_id)
+
+    def _deliver(self, message, event_id):
+        for subscription in list(self.subscribers):
+            subscription.put(message, event_id)
+
+
+class EventHub:
+    """Publish/subscribe fan-out for server-sent events.
+
+    Each event is serialised once when it is published and the same
+    ``id:``/``data:`` frame is handed to every subscriber. Event ids start
+    from the hub's start time in milliseconds, so they keep increasing
+    across server restarts and a reconnecting browser's ``Last-Event-ID``
+    is always comparable.
+    """
+
+    def __init__(self, queue_size=SSE_QUEUE_SIZE, history_size=SSE_HISTORY_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._history = collections.deque(maxlen=history_size)  # (event id, frame)
+        self._relays = {}  # event loop -> _LoopRelay
+        self._lock = threading.Lock()
+        self._next_id = int(time.time() * 1000)
+        self.published = 0
+        self.latest = None
+
+    @staticmethod
+    def format_event(event_id, data, event=None):
+        lines = [f"id: {event_id}"]
+        if event:
+            lines.append(f"event: {event}")
+        lines.append(f"data: {json.dumps(data)}")
+        return '\n'.join(lines) + '\n\n'
+
+    def publish(self, data, event=None):
+        """Send ``data`` to every subscriber. Returns the event id."""
+        with self._lock:
+            event_id = self._next_id
+            self._next_id += 1
+            frame = self.format_event(event_id, data, event)
+            self._history.append((event_id, frame))
+            self.latest = data
+            self.published += 1
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            subscription.put(frame, event_id)
+        return event_id
+
+    def subscribe(self, last_event_id=None):
+        """Register a client and queue what it has missed.
+
+        With a ``Last-Event-ID`` the retained events after it are replayed;
+        without one (or if it cannot be parsed) only the latest event is,
+        so a fresh page shows the current state straight away.
+        """
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            self._queue_backlog(subscription, last_event_id)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def subscribe_async(self, last_event_id=None):
+        """Like ``subscribe`` but for a coroutine on the running event loop."""
+        loop = asyncio.get_running_loop()
+        subscription = AsyncSubscription(self.queue_size)
+
+        with self._lock:
+            relay = self._relays.get(loop)
+            if relay is None:
+                relay = self._relays[loop] = _LoopRelay(loop)
+                self._subscribers.add(relay)
+            self._queue_backlog(subscription, last_event_id)
+            relay.subscribers.add(subscription)
+        return subscription
+
+    def _queue_backlog(self, subscription, last_event_id):
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+
+        if last_event_id is None:
+            backlog = list(self._history)[-1:]
+        else:
+            backlog = [item for item in self._history if item[0] > last_event_id]
+        for event_id, frame in backlog:
+            subscription.put(frame, event_id)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            for relay in self._relays.values():
+                relay.subscribers.discard(subscription)
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return {
+            'subscribers': sum(s.count for s in subscribers),
+            'published': self.published,
+            'dropped': sum(s.dropped for s in subscribers)
+        }
+
+
+def benchmark(num_subscribers=500, num_events=50, interval=0.05):
+    """Compare the hub with the old 0.5 s polling broadcaster.
+
+    Runs ``num_subscribers`` consumer threads, publishes ``num_events``
+    distinct events ``interval`` seconds apart and reports process CPU
+    time, frames delivered and publish-to-receive latency.
+    """
+    import queue
+    import statistics
+
+    def summarise(name, cpu, delivered, latencies, seconds):
+        latencies = sorted(latencies) or [0.0]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{name:>8}: {cpu:.2f}s CPU over {seconds:.1f}s, {delivered} frames delivered "
+              f"({delivered / max(num_subscribers, 1):.0f}/client for {num_events} events), "
+              f"latency p50 {statistics.median(latencies) * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms")
+
+    # Event-driven hub
+    hub = EventHub()
+    published_at = {}
+    latencies, delivered = [], [0]
+    stats_lock = threading.Lock()
+    stop = threading.Event()
+
+    def hub_client():
+        subscription = hub.subscribe()
+        while not stop.is_set():
+            frame = subscription.get(timeout=0.2)
+            if frame is None:
+                continue
+            received = time.perf_counter()
+            event_id = int(frame[4:frame.index('\n')])
+            with stats_lock:
+                delivered[0] += 1
+                if event_id in published_at:
+                    latencies.append(received - published_at[event_id])
+        hub.unsubscribe(subscription)
+
+    threads = [threading.Thread(target=hub_client, daemon=True) for _ in range(num_subscribers)]
+    for thread in threads:
+        thread.start()
+    while hub.stats()['subscribers'] < num_subscribers:
+        time.sleep(0.01)
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for i in range(num_events):
+        data = {'rfid': f"PENG{i:03d}", 'weight': 3.5, 'timestamp': time.time()}
+        with stats_lock:
+            event_id = hub._next_id
+            published_at[event_id] = time.perf_counter()
+        hub.publish(data)
+        time.sleep(interval)
+    time.sleep(0.5)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    summarise('hub', time.process_time() - cpu_start, delivered[0], latencies,
+              time.perf_counter() - wall_start)
+
+    # Legacy: a thread re-sends the latest data to every client queue every 0.5 s
+    clients = []
+    latest = {'data': None, 'published': None}
+    latencies, delivered = [], [0]
+    stop = threading.Event()
+
+    def legacy_broadcaster():
+        while not stop.is_set():
+            if latest['data'] and clients:
+                for client_queue in clients:
+                    if not client_queue.full():
+                        client_queue.put((latest['data'], latest['published']))
+            time.sleep(0.5)
+
+    def legacy_client():
+        client_queue = queue.Queue()
+        clients.append(client_queue)
+        seen = set()
+        while not stop.is_set():
+            try:
+                data, published = client_queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            json.dumps(data)  # the old stream serialised per client and per frame
+            with stats_lock:
+                delivered[0] += 1
+                if published not in seen:
+                    seen.add(published)
+                    latencies.append(time.perf_counter() - published)
+
+    threads = [threading.Thread(target=legacy_client, daemon=True) for _ in range(num_subscribers)]
+    for thread in threads:
+        thread.start()
+    while len(clients) < num_subscribers:
+        time.sleep(0.01)
+    broadcaster = threading.Thread(target=legacy_broadcaster, daemon=True)
+    broadcaster.start()
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for i in range(num_events):
+        latest['data'] = {'rfid': f"PENG{i:03d}", 'weight': 3.5, 'timestamp': time.time()}
+        latest['published'] = time.perf_counter()
+        time.sleep(interval)
+    time.sleep(0.5)
+    stop.set()
+    for thread in threads + [broadcaster]:
+        thread.join()
+    summarise('polling', time.process_time() - cpu_start, delivered[0], latencies,
+              time.perf_counter() - wall_start)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark SSE fan-out with simulated subscribers")
+    parser.add_argument('--subscribers', type=int, default=500)
+    parser.add_argument('--events', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=0.05, help='Seconds between published events')
+    args = parser.parse_args()
+
+    benchmark(args.subscribers, args.events, args.interval)
@@ -0,0 +1,254 @@
+# visits.py
+
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+from db import get_connection
+
+VISIT_GAP_SECONDS = float(os.environ.get('VISIT_GAP_SECONDS', 30))    # Quiet time that ends a visit (0 = no visits)
+VISIT_MAX_SECONDS = float(os.environ.get('VISIT_MAX_SECONDS', 600))   # Split longer stays into several visits
+VISIT_BEST_FRAMES = int(os.environ.get('VISIT_BEST_FRAMES', 3))       # Sharpest frames sent to the models
+VISIT_TRIM = float(os.environ.get('VISIT_TRIM', 0.2))                 # Share of weights cut from each end
+VISIT_SOURCE = "ESP CAM visit"                                        # detection_jobs.source of a visit
+
+
+def sharpness(image):
+    """Variance of the Laplacian of a small greyscale copy; higher is sharper."""
+    image.draft('L', (320, 240))
+    grey = np.asarray(image.convert('L').resize((160, 120)), dtype=np.float32)
+    laplacian = (grey[:-2, 1:-1] + grey[2:, 1:-1] + grey[1:-1, :-2] + grey[1:-1, 2:]
+                 - 4 * grey[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def robust_weight(weights, trim=VISIT_TRIM):
+    """Trimmed mean of a visit's scale readings, or the median of short visits.
+
+    Readings at or below zero (the bird stepping off the platform) are ignored.
+    """
+    weights = sorted(w for w in weights if w is not None and w > 0)
+    if not weights:
+        return 0.0
+    if len(weights) < 5:
+        return round(statistics.median(weights), 3)
+    cut = int(len(weights) * trim)
+    kept = weights[cut:len(weights) - cut] or weights
+    return round(sum(kept) / len(kept), 3)
+
+
+def median_env(samples):
+    """Per-field median of the samples' environment readings."""
+    values = {}
+    for sample in samples:
+        for key, value in (sample['env_data'] or {}).items():
+            if isinstance(value, (int, float)):
+                values.setdefault(key, []).append(value)
+    return {key: statistics.median(v) for key, v in values.items()} or None
+
+
+class VisitSessionizer:
+    """Groups ESP32 detection samples into visits, one per penguin stay.
+
+    Every sample is written to ``visit_samples`` as it arrives. A visit
+    ends when its RFID has sent nothing for ``gap_seconds`` (or has lasted
+    ``max_seconds``); its samples are tagged with a new job id and
+    ``on_close(rfid, samples, job_id)`` submits the visit's job. Samples not
+    yet in a closed visit, or tagged for a job that was never submitted,
+    are reloaded on start, so a restart only delays their visit.
+    """
+
+    def __init__(self, db_path, on_close, gap_seconds=VISIT_GAP_SECONDS, max_seconds=VISIT_MAX_SECONDS):
+        self.db_path = db_path
+        self.on_close = on_close
+        self.gap_seconds = gap_seconds
+        self.max_seconds = max_seconds
+        self._open = {}  # rfid -> {'started': ts, 'last': ts, 'sample_ids': [...]}
+        self._lock = threading.Lock()
+        self._started = False
+        self.closed = 0
+
+    @property
+    def enabled(self):
+        return self.gap_seconds > 0
+
+    def _connect(self):
+        conn = get_connection(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def start(self):
+        """Reload unclosed samples and start the thread that closes quiet visits."""
+        with self._lock:
+            if self._started or not self.enabled:
+                return
+            self._started = True
+
+        conn = self._connect()
+        # A crash between tagging a visit and submitting its job leaves samples
+        # pointing at a job that was never written; they belong to no visit yet
+        orphaned = conn.execute(
+            '''UPDATE visit_samples SET job_id = NULL
+               WHERE job_id IS NOT NULL AND detection_id IS NULL
+                 AND job_id NOT IN (SELECT id FROM detection_jobs)'''
+        ).rowcount
+        conn.commit()
+        pending = conn.execute(
+            "SELECT id, rfid, sample_time FROM visit_samples WHERE job_id IS NULL ORDER BY sample_time, id"
+        ).fetchall()
+        conn.close()
+        for row in pending:
+            sample_ts = datetime.strptime(row['sample_time'], '%Y-%m-%d %H:%M:%S').timestamp()
+            self._track(row['rfid'], row['id'], sample_ts)
+        if pending:
+            print(f"Resuming {len(pending)} sample(s) from unfinished visits"
+                  + (f", {orphaned} of them from a visit whose job was never submitted" if orphaned else ""))
+
+        threading.Thread(target=self._watch, name="visit-sessionizer", daemon=True).start()
+
+    def add_sample(self, rfid, weight, image_path=None, sharpness=None, sex=None, env_data=None, now=None):
+        """Record one sample and attach it to the RFID's open visit. Returns (sample id, samples in visit)."""
+        now = now or datetime.now()
+        conn = self._connect()
+        cursor = conn.execute(
+            '''INSERT INTO visit_samples (rfid, sample_time, weight_kg, image_path, sharpness, sex, env_data)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (rfid, now.strftime('%Y-%m-%d %H:%M:%S'), weight, image_path, sharpness, sex,
+             json.dumps(env_data) if env_data else None)
+        )
+        sample_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return sample_id, self._track(rfid, sample_id, now.timestamp())
+
+    def _track(self, rfid, sample_id, sample_ts):
+        with self._lock:
+            visit = self._open.get(rfid)
+            finished = None
+            if visit and (sample_ts - visit['last'] > self.gap_seconds
+                          or sample_ts - visit['started'] > self.max_seconds):
+                finished = self._open.pop(rfid)
+                visit = None
+            if visit is None:
+                visit = self._open[rfid] = {'started': sample_ts, 'last': sample_ts, 'sample_ids': []}
+            visit['last'] = max(visit['last'], sample_ts)
+            visit['sample_ids'].append(sample_id)
+            count = len(visit['sample_ids'])
+        if finished:
+            self._close(rfid, finished)
+        return count
+
+    def _watch(self):
+        while True:
+            time.sleep(min(1.0, self.gap_seconds / 4))
+            self.close_idle()
+
+    def close_idle(self, now=None):
+        """Close every visit that has been quiet for ``gap_seconds``. Returns how many closed."""
+        now = now or time.time()
+        with self._lock:
+            idle = [rfid for rfid, visit in self._open.items() if now - visit['last'] > self.gap_seconds]
+            finished = [(rfid, self._open.pop(rfid)) for rfid in idle]
+        for rfid, visit in finished:
+            self._close(rfid, visit)
+        return len(finished)
+
+    def _close(self, rfid, visit):
+        conn = self._connect()
+        placeholders = ', '.join('?' * len(visit['sample_ids']))
+        samples = [dict(row) for row in conn.execute(
+            f"SELECT * FROM visit_samples WHERE id IN ({placeholders}) ORDER BY sample_time, id",
+            visit['sample_ids']
+        ).fetchall()]
+        conn.close()
+        for sample in samples:
+            sample['env_data'] = json.loads(sample['env_data']) if sample['env_data'] else None
+        if not samples:
+            return
+
+        # Tag the samples first so the job's worker always finds them
+        job_id = uuid.uuid4().hex
+        self._set_job(visit['sample_ids'], job_id)
+        try:
+            self.on_close(rfid, samples, job_id)
+        except Exception as e:
+            print(f"Could not close visit of {rfid}: {str(e)}")
+            self._set_job(visit['sample_ids'], None)
+            with self._lock:
+                # Put it back so the next pass retries
+                self._open.setdefault(rfid, visit)
+            return
+        with self._lock:
+            self.closed += 1
+
+    def _set_job(self, sample_ids, job_id):
+        placeholders = ', '.join('?' * len(sample_ids))
+        conn = self._connect()
+        conn.execute(f"UPDATE visit_samples SET job_id = ? WHERE id IN ({placeholders})", [job_id, *sample_ids])
+        conn.commit()
+        conn.close()
+
+    def samples_for_job(self, job_id):
+        """A closed visit's samples, sharpest first among those already scored."""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT * FROM visit_samples WHERE job_id = ? ORDER BY sharpness DESC, sample_time", (job_id,)
+        ).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def get_sample(self, sample_id):
+        """A sample with ``visit_samples`` (its visit's size so far), or None if the id is unknown."""
+        conn = self._connect()
+        row = conn.execute(
+            '''SELECT id, rfid, sample_time, weight_kg, image_path, sharpness, job_id, detection_id
+               FROM visit_samples WHERE id = ?''', (sample_id,)
+        ).fetchone()
+        if row is None:
+            conn.close()
+            return None
+        sample = dict(row)
+        if sample['job_id']:
+            sample['visit_samples'] = conn.execute(
+                "SELECT COUNT(*) FROM visit_samples WHERE job_id = ?", (sample['job_id'],)
+            ).fetchone()[0]
+        conn.close()
+        if not sample['job_id']:
+            with self._lock:
+                visit = self._open.get(sample['rfid'])
+                sample['visit_samples'] = (len(visit['sample_ids'])
+                                           if visit and sample_id in visit['sample_ids'] else None)
+        return sample
+
+    def set_sharpness(self, scores):
+        """Store sharpness scores computed by the worker, as {sample id: score}."""
+        if not scores:
+            return
+        conn = self._connect()
+        conn.executemany("UPDATE visit_samples SET sharpness = ? WHERE id = ?",
+                         [(score, sample_id) for sample_id, score in scores.items()])
+        conn.commit()
+        conn.close()
+
+    def mark_scored(self, job_id, detection_id):
+        conn = self._connect()
+        conn.execute("UPDATE visit_samples SET detection_id = ? WHERE job_id = ?", (detection_id, job_id))
+        conn.commit()
+        conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'gap_seconds': self.gap_seconds,
+                'open_visits': len(self._open),
+                'open_samples': sum(len(v['sample_ids']) for v in self._open.values()),
+                'closed_visits': self.closed
+            }